@@ -0,0 +1,322 @@
+import cv2
+import numpy as np
+import math
+from scipy import ndimage
+from dataclasses import dataclass, replace
+from functools import cached_property
+
+# เกณฑ์ Circularity: RBC ที่ติดเชื้อจะเบี้ยวเล็กน้อยอยู่แล้ว (ปกติ 0.75-0.85)
+# ถ้าค่าต่ำกว่า 0.70 คือ Amoeboid ที่แท้จริง
+AMOEBOID_CIRCULARITY = 0.70
+
+# Preprocess ของแต่ละงาน (ค่าเดิมของ findsize / cellree / diastant ก่อนรวมเป็นรอบเดียว ผลจึงไม่เปลี่ยน)
+# blur: 'gaussian' ทำบนภาพ Gray, 'median' ทำบนภาพ BGR แล้วค่อยแปลงเป็น Gray
+# kernel: 'ellipse' = MORPH_ELLIPSE 5x5, 'rect' = np.ones((5, 5))
+PREPROCESS = {
+    "size":   {"blur": "gaussian", "ksize": 9,  "kernel": "ellipse", "iterations": 2, "fill_holes": False},
+    "shape":  {"blur": "median",   "ksize": 5,  "kernel": "rect",    "iterations": 2, "fill_holes": True},
+    "radial": {"blur": "gaussian", "ksize": 11, "kernel": "ellipse", "iterations": 3, "fill_holes": False},
+}
+
+class CellFeatures:
+    """
+    ค่าทางสัณฐานวิทยาของเซลล์ 1 เซลล์ ใช้ร่วมกันทั้ง findsize (ขนาด), cellree (รูปร่าง) และ diastant (Marginal Ratio)
+    แต่ละงานใช้ Blur / Closing / การเลือก Contour ของตัวเองตาม PREPROCESS และคำนวณแบบ Lazy:
+    Threshold เฉพาะงานที่มีการอ่านค่าครั้งแรก แล้วเก็บผลไว้ (อ่านแค่ Marginal Ratio = Preprocess รอบเดียว)
+    - size:   hull (None = หาไม่เจอ), hull_area, equivalent_diameter (0 ถ้าไม่มี Contour ใกล้กลางภาพ)
+    - shape:  contour, area, perimeter, circularity (0 ถ้าหาไม่เจอ)
+    - radial: radial_hull (None = หาไม่เจอ), centroid, chromatin_point
+    edge_point / marginal_ratio: None = ยังไม่คำนวณ (extract_features(radial=True) หรือ fill_marginal_ratios)
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.image_shape = image.shape
+        self.edge_point = None
+        self.marginal_ratio = None
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+
+    def _contours(self, task):
+        """Blur -> Otsu -> Morphology Closing -> (ถมรู) -> External Contours ตาม PREPROCESS[task]"""
+        params = PREPROCESS[task]
+        k = params["ksize"]
+        if params["blur"] == "median":
+            blurred = cv2.cvtColor(cv2.medianBlur(self.image, k), cv2.COLOR_BGR2GRAY)
+        else:
+            blurred = cv2.GaussianBlur(self.gray, (k, k), 0)
+        _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+        if params["kernel"] == "ellipse":
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        else:
+            kernel = np.ones((5, 5), np.uint8)
+        mask = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=params["iterations"])
+
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if params["fill_holes"] and contours:
+            # ถมรูตรงกลางให้เต็ม เพื่อไม่ให้ Perimeter ไปนับรอยหยักข้างใน
+            cv2.drawContours(mask, contours, -1, 255, thickness=cv2.FILLED)
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return contours
+
+    @cached_property
+    def _size(self):
+        """ขนาด (findsize): Contour ใกล้กลางภาพ -> Convex Hull แก้ปัญหาขอบหยัก / รอยแหว่งจากการ Threshold"""
+        h, w = self.image_shape[:2]
+        contours = self._contours("size")
+        contour = _select_main_contour(contours, h, w) if contours else None
+        if contour is None: return None, 0.0, 0.0
+        hull = cv2.convexHull(contour)
+        hull_area = float(cv2.contourArea(hull))
+        return hull, hull_area, float(2 * np.sqrt(hull_area / np.pi))
+
+    @cached_property
+    def _shape(self):
+        """รูปร่าง (cellree): Circularity จาก Contour ที่ใหญ่ที่สุด (ไม่ใช่ Hull เพราะ Hull กลมเสมอ)"""
+        contours = self._contours("shape")
+        if not contours: return None, 0.0, 0.0, 0.0
+        contour = max(contours, key=cv2.contourArea)
+        area = float(cv2.contourArea(contour))
+        perimeter = float(cv2.arcLength(contour, True))
+        circularity = (4 * np.pi * area) / (perimeter ** 2) if perimeter > 0 else 0.0
+        return contour, area, perimeter, float(circularity)
+
+    @cached_property
+    def _radial(self):
+        """Marginal Ratio (diastant): Hull ของ Contour ที่ใหญ่ที่สุด -> Centroid + จุด Chromatin (จุดมืดสุดใน Hull)"""
+        contours = self._contours("radial")
+        if not contours: return None, None, None
+        hull = cv2.convexHull(max(contours, key=cv2.contourArea))
+        Mc = cv2.moments(hull)
+        if Mc['m00'] == 0: return None, None, None
+        cx, cy = int(Mc['m10'] / Mc['m00']), int(Mc['m01'] / Mc['m00'])
+        hull_mask = np.zeros_like(self.gray)
+        cv2.drawContours(hull_mask, [hull], -1, 255, -1)
+        _, _, min_loc, _ = cv2.minMaxLoc(self.gray, mask=hull_mask)
+        return hull, (cx, cy), (int(min_loc[0]), int(min_loc[1]))
+
+    hull = property(lambda self: self._size[0])
+    hull_area = property(lambda self: self._size[1])
+    equivalent_diameter = property(lambda self: self._size[2])
+    contour = property(lambda self: self._shape[0])
+    area = property(lambda self: self._shape[1])
+    perimeter = property(lambda self: self._shape[2])
+    circularity = property(lambda self: self._shape[3])
+    radial_hull = property(lambda self: self._radial[0])
+    centroid = property(lambda self: self._radial[1])
+    chromatin_point = property(lambda self: self._radial[2])
+
+    @property
+    def shape_status(self):
+        return "Amoeboid" if self.circularity < AMOEBOID_CIRCULARITY else "Round"
+
+def _select_main_contour(contours, h, w):
+    """
+    เลือก Contour ที่ "อยู่ใกล้กลางภาพ" มากที่สุด
+    (ป้องกันการไปจับขอบ Bounding Box หรือขยะที่มุมภาพ) คืนค่า None ถ้าไม่มี Contour ที่ใหญ่พอ
+    """
+    center_img = (w // 2, h // 2)
+    best_contour = None
+    min_dist = float('inf')
+
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area < (h * w * 0.05): continue # กรองขยะที่มีขนาดเล็กกว่า 5% ของรูป
+
+        M = cv2.moments(cnt)
+        if M["m00"] == 0: continue
+        cX = int(M["m10"] / M["m00"])
+        cY = int(M["m01"] / M["m00"])
+
+        dist = np.sqrt((cX - center_img[0])**2 + (cY - center_img[1])**2)
+        if dist < min_dist:
+            min_dist = dist
+            best_contour = cnt
+
+    return best_contour
+
+def _angle_diffs(points, cx, cy, px, py):
+    """
+    ความต่างของมุม (0..pi) ระหว่างทิศ Center -> จุดบน Hull กับทิศ Center -> Chromatin ของทุกจุดพร้อมกัน
+    points: array (N, 2) | cx, cy, px, py: scalar หรือ array ยาว N
+    จุดที่ซ้ำกับศูนย์กลางได้ค่า inf (ไม่ถูกเลือก)
+    """
+    ex, ey = points[:, 0], points[:, 1]
+    target_angle = np.arctan2(py - cy, px - cx)
+    curr_angle = np.arctan2(ey - cy, ex - cx)
+
+    # คำนวณความต่างขององศา (จัดการเรื่องวงกลม 360 องศา -PI ถึง PI)
+    diff = np.abs(curr_angle - target_angle)
+    diff = np.where(diff > np.pi, 2 * np.pi - diff, diff)
+    return np.where((ex == cx) & (ey == cy), np.inf, diff)
+
+def find_edge_point(hull, cx, cy, px, py):
+    """
+    Radial Projection: หาจุดบน Hull ที่อยู่ในทิศเดียวกับ Center -> Chromatin มากที่สุด
+    (คำนวณมุมของทุกจุดด้วย NumPy ครั้งเดียว ถ้ามุมเท่ากันเลือกจุดแรกตามลำดับของ Hull)
+    """
+    points = hull.reshape(-1, 2).astype(np.float64)
+    if len(points) == 0: return (px, py)
+
+    diff = _angle_diffs(points, cx, cy, px, py)
+    best = int(np.argmin(diff))
+    if not np.isfinite(diff[best]): return (px, py)
+    return (int(points[best, 0]), int(points[best, 1]))
+
+def find_edge_points(hulls, centers, targets):
+    """
+    find_edge_point ของหลายเซลล์ในครั้งเดียว: ต่อจุด Hull ของทุกเซลล์เป็น array เดียว
+    แล้วหา argmin แยกตามเซลล์ (ผลลัพธ์เหมือนเรียก find_edge_point ทีละเซลล์)
+    centers / targets: list ของ (cx, cy) และ (px, py) เรียงตาม hulls
+    """
+    if not hulls: return []
+    points = [h.reshape(-1, 2).astype(np.float64) for h in hulls]
+    lengths = np.array([len(p) for p in points])
+    seg = np.repeat(np.arange(len(points)), lengths)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+
+    edges = [tuple(int(v) for v in t) for t in targets]
+    if not lengths.sum(): return edges
+
+    all_points = np.concatenate(points)
+    diff = _angle_diffs(all_points, centers[seg, 0], centers[seg, 1], targets[seg, 0], targets[seg, 1])
+
+    # เรียงตาม (เซลล์, ความต่างของมุม) แบบ Stable -> ตัวแรกของแต่ละเซลล์คือจุดแรกที่มุมใกล้สุด
+    order = np.lexsort((diff, seg))
+    first_seg, first_idx = np.unique(seg[order], return_index=True)
+    for i, k in zip(first_seg, order[first_idx]):
+        if np.isfinite(diff[k]):
+            edges[i] = (int(all_points[k, 0]), int(all_points[k, 1]))
+    return edges
+
+def marginal_ratio(center, chromatin, edge):
+    """ระยะ Center -> Chromatin เทียบกับ Center -> Edge ในทิศเดียวกัน (ไม่เกิน 1.0, ปัด 4 ตำแหน่ง)"""
+    cx, cy = center
+    px, py = chromatin
+    bx, by = edge
+    dist_c_to_p = math.sqrt((px - cx)**2 + (py - cy)**2)
+    dist_c_to_edge = math.sqrt((bx - cx)**2 + (by - cy)**2)
+    ratio = dist_c_to_p / dist_c_to_edge if dist_c_to_edge > 0 else 0.0
+    return round(min(ratio, 1.0), 4)
+
+def fill_marginal_ratios(features_list):
+    """
+    เติม edge_point / marginal_ratio ของ CellFeatures หลายเซลล์ด้วย find_edge_points ครั้งเดียว
+    (เซลล์ที่หา radial_hull ไม่เจอได้ marginal_ratio = 0.0)
+    """
+    pending = []
+    for f in features_list:
+        if f is None or f.edge_point is not None: continue
+        if f.radial_hull is None:
+            f.marginal_ratio = 0.0
+        else:
+            pending.append(f)
+    edges = find_edge_points([f.radial_hull for f in pending], [f.centroid for f in pending],
+                             [f.chromatin_point for f in pending])
+    for f, edge in zip(pending, edges):
+        f.edge_point = edge
+        f.marginal_ratio = marginal_ratio(f.centroid, f.chromatin_point, edge)
+    return features_list
+
+def extract_features(image_input, radial=True):
+    """
+    อ่านภาพครั้งเดียว แล้วคืนค่า CellFeatures ที่คำนวณค่าของแต่ละงาน (size / shape / radial) เมื่อถูกอ่าน
+    image_input: path ของไฟล์ หรือ numpy array (BGR)
+    radial: True = หา edge_point / marginal_ratio เลย
+            False = ปล่อยเป็น None ให้ fill_marginal_ratios ทำทั้ง Batch
+    คืนค่า: CellFeatures หรือ None ถ้าอ่านภาพไม่ได้
+    งานที่หาเซลล์ไม่เจอได้ค่าว่างของตัวเอง (diameter 0 / perimeter 0 / radial_hull None + marginal_ratio 0.0)
+    """
+    img = image_input if isinstance(image_input, np.ndarray) else cv2.imread(image_input)
+    if img is None: return None
+
+    features = CellFeatures(img)
+    if radial: fill_marginal_ratios([features])
+    return features
+
+@dataclass
+class MaskFeatures:
+    """
+    ขนาด / รูปร่างของเซลล์ 1 เซลล์ คำนวณจาก Label Mask ของ Cellpose โดยตรง (ไม่ Threshold crop ซ้ำ)
+    ชื่อ Field ตรงกับ CellFeatures จึงส่งให้ findsize / cellree ใช้แทนกันได้
+    พิกัด (contour, hull, centroid) อยู่ในภาพเต็ม ใช้ in_crop() เพื่อเลื่อนมาอยู่ในพิกัดของ crop
+    """
+    label: int
+    area: float                  # จำนวน Pixel ของ Label
+    perimeter: float             # นับขอบ Pixel แล้วคูณ pi/4 (แก้ค่าเกินของขอบแนวทแยง)
+    hull_area: float
+    solidity: float              # area / hull_area (เซลล์เว้า/แหว่งจะต่ำกว่า 1)
+    equivalent_diameter: float   # 2 * sqrt(area / pi)
+    circularity: float           # (4 * pi * area) / perimeter^2
+    centroid: tuple
+    contour: np.ndarray
+    hull: np.ndarray
+
+    @property
+    def shape_status(self):
+        return "Amoeboid" if self.circularity < AMOEBOID_CIRCULARITY else "Round"
+
+    def in_crop(self, origin):
+        """คืนสำเนาที่เลื่อนพิกัดให้ (0, 0) อยู่ที่ origin (มุมซ้ายบนของ crop ในภาพเต็ม)"""
+        ox, oy = origin
+        offset = np.array([ox, oy], dtype=self.hull.dtype)
+        return replace(self, contour=self.contour - offset, hull=self.hull - offset,
+                       centroid=(self.centroid[0] - ox, self.centroid[1] - oy))
+
+def _edge_count(sub):
+    """
+    นับจำนวนขอบ Pixel ของ Label ที่ติดกับ Label อื่น/พื้นหลัง/ขอบภาพ
+    sub: bool array เฉพาะกรอบ (find_objects) ของ Label -> Pad 1 Pixel แล้วเทียบ Pixel ข้างเคียงแนวนอน + แนวตั้ง
+    """
+    padded = np.pad(sub, 1, mode='constant')
+    return int(np.count_nonzero(padded[:, 1:] != padded[:, :-1]) +
+               np.count_nonzero(padded[1:, :] != padded[:-1, :]))
+
+def features_from_labels(masks, labels=None):
+    """
+    คำนวณ MaskFeatures ของทุก Label จาก Label Image ของ Cellpose
+    ทุกค่าคำนวณเฉพาะกรอบ (find_objects) ของแต่ละ Label -> หน่วยความจำตามขนาดเซลล์ ไม่ใช่ขนาดภาพ
+    - area / centroid: จำนวนและพิกัดเฉลี่ยของ Pixel ในกรอบ
+    - perimeter: นับขอบ Pixel (_edge_count) คูณ pi/4
+    - contour / convex hull: findContours ในกรอบ
+    labels: id ที่ต้องการ (None = ทุก Label)
+    คืนค่า: dict {label_id: MaskFeatures}
+    """
+    masks = np.ascontiguousarray(masks)
+    if masks.size == 0 or not masks.any(): return {}
+
+    wanted = None if labels is None else {int(l) for l in labels}
+    features = {}
+    for i, slc in enumerate(ndimage.find_objects(masks), start=1):
+        if slc is None or (wanted is not None and i not in wanted): continue
+        y_slice, x_slice = slc
+        sub = masks[slc] == i
+        ys, xs = np.nonzero(sub)
+        area = float(len(xs))
+        contours, _ = cv2.findContours(sub.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours: continue
+
+        contour = max(contours, key=cv2.contourArea) + np.array([x_slice.start, y_slice.start], dtype=np.int32)
+        hull = cv2.convexHull(contour)
+        # Hull ผ่านจุดกึ่งกลาง Pixel จึงเล็กกว่าจำนวน Pixel เล็กน้อย -> จำกัด solidity ไม่เกิน 1
+        hull_area = max(float(cv2.contourArea(hull)), 1.0)
+        perimeter = _edge_count(sub) * (np.pi / 4)
+        circularity = min(4 * np.pi * area / perimeter ** 2, 1.0) if perimeter > 0 else 0.0
+
+        features[i] = MaskFeatures(
+            label=i,
+            area=area,
+            perimeter=float(perimeter),
+            hull_area=hull_area,
+            solidity=round(min(area / hull_area, 1.0), 4),
+            equivalent_diameter=float(2 * np.sqrt(area / np.pi)),
+            circularity=float(circularity),
+            centroid=(int(x_slice.start + xs.sum() / area), int(y_slice.start + ys.sum() / area)),
+            contour=contour,
+            hull=hull
+        )
+    return features
@@ -1,112 +1,105 @@
 import cv2
 import numpy as np
-import math
+import os
+import sys
 
-def calculate_marginal_ratio(image_path, save_viz_path=None):
+# เพิ่ม Path เพื่อหาไฟล์ cellfeatures.py
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cellfeatures import extract_features, fill_marginal_ratios
+
+def calculate_marginal_ratio(image_path, save_viz_path=None, features=None):
     """
     ปรับปรุง: เน้นการหาขอบเขตเซลล์ (Segmentation) ให้เนียนขึ้นด้วย Otsu + Convex Hull
     และคำนวณ Marginal Ratio แบบ Radial Projection (เส้นตรง)
+    image_path: path ของไฟล์ หรือ numpy array (BGR) ที่อยู่ในหน่วยความจำ
+    features: CellFeatures ที่คำนวณไว้แล้ว (ถ้ามีจะไม่ Preprocess ภาพซ้ำ)
     """
-    img = cv2.imread(image_path)
-    if img is None: return 0.0
-    
-    # --- 1. Preprocessing (แก้ใหม่เพื่อให้ได้รูปทรงเซลล์ที่ดีขึ้น) ---
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # GaussianBlur ช่วยลด Noise เล็กๆ น้อยๆ
-    blurred = cv2.GaussianBlur(gray, (11, 11), 0)
-    
-    # [แก้จุดที่ 1] ใช้ Otsu's Thresholding แทน Adaptive
-    # Otsu จะหาค่า Threshold กลางที่แยก Background กับ Cell ได้ดีกว่าในภาพ Microscope
-    _, cell_thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    
-    # Morphology: Closing เพื่อถมรูเล็กๆ ภายในเซลล์ให้เต็ม
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-    cell_mask = cv2.morphologyEx(cell_thresh, cv2.MORPH_CLOSE, kernel, iterations=3)
-    
-    # หา Contours
-    cell_cnts, _ = cv2.findContours(cell_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not cell_cnts: return 0.0
-    
-    # เลือก Contour ที่ใหญ่ที่สุด (สมมติว่าเป็นเซลล์หลัก)
-    raw_cnt = max(cell_cnts, key=cv2.contourArea)
-    
-    # [แก้จุดที่ 2] ใช้ Convex Hull
-    # ช่วยแก้ปัญหาขอบหยักๆ ให้กลายเป็นรูปทรงโค้งมน (เหมือนเม็ดเลือดแดงจริง)
-    main_cell_cnt = cv2.convexHull(raw_cnt)
-    
-    # สร้าง Mask สุดท้ายจาก Hull ที่เรียบเนียนแล้ว
-    final_cell_mask = np.zeros_like(gray)
-    cv2.drawContours(final_cell_mask, [main_cell_cnt], -1, 255, -1)
+    if features is None:
+        features = extract_features(image_path)
+    if features is None or features.radial_hull is None: return 0.0
 
-    # --- 2. หาจุดศูนย์กลางเซลล์ (Centroid) ---
-    Mc = cv2.moments(main_cell_cnt)
-    if Mc['m00'] == 0: return 0.0
-    cx, cy = int(Mc['m10']/Mc['m00']), int(Mc['m01']/Mc['m00'])
+    # Centroid, จุด Chromatin (จุดมืดสุดใน Hull) และจุดตัดขอบ คำนวณไว้แล้วใน CellFeatures
+    if save_viz_path:
+        cv2.imwrite(save_viz_path, draw_distance_viz(features))
 
-    # --- 3. หาจุดโครมาทิน (Darkest Point) ---
-    # ใช้ Mask เพื่อหาจุดมืดสุดเฉพาะในเขตเซลล์
-    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(gray, mask=final_cell_mask)
-    px, py = min_loc
+    return features.marginal_ratio
 
-    # --- 4. คำนวณจุดตัดขอบเซลล์ (Radial Projection) ---
-    # คำนวณองศาจาก Center ไปหา Chromatin
-    target_angle = math.atan2(py - cy, px - cx)
-    
-    best_edge_point = (px, py)
-    min_angle_diff = float('inf')
+def calculate_marginal_ratios(images, save_viz_paths=None, features=None):
+    """
+    Batch ของ calculate_marginal_ratio สำหรับเซลล์ 1chromatin ทั้งหมดของ Request เดียว
+    หา Edge Point ของทุกเซลล์ด้วย NumPy ครั้งเดียว (ผลเหมือนเรียกทีละเซลล์)
+    images: list ของ path หรือ numpy array (BGR)
+    save_viz_paths / features: list ที่เรียงตาม images (None ทั้ง list หรือรายตัว = ไม่มี)
+    คืนค่า: (list ของ Marginal Ratio, list ของ CellFeatures)
+    เซลล์ที่คำนวณไม่สำเร็จได้ Ratio = None และ CellFeatures = None (เซลล์อื่นใน Batch ไม่กระทบ)
+    """
+    n = len(images)
+    save_viz_paths = save_viz_paths or [None] * n
+    features = list(features) if features is not None else [None] * n
+    failed = set()
 
-    # วนลูปจุดบน Convex Hull เพื่อหาจุดที่ตรงกับองศานี้ที่สุด
-    # (Convex Hull มีจำนวนจุดน้อยกว่า Contour ดิบ ทำให้ทำงานเร็วและแม่นยำกว่า)
-    for point in main_cell_cnt:
-        ex, ey = point[0]
-        if ex == cx and ey == cy: continue # ป้องกันจุดซ้ำศูนย์กลาง
-        
-        curr_angle = math.atan2(ey - cy, ex - cx)
-        
-        # คำนวณความต่างขององศา (จัดการเรื่องวงกลม 360 องศา -PI ถึง PI)
-        diff = abs(curr_angle - target_angle)
-        if diff > math.pi:
-            diff = 2 * math.pi - diff
-            
-        if diff < min_angle_diff:
-            min_angle_diff = diff
-            best_edge_point = (ex, ey)
+    def fail(i, e):
+        print(f"Distance calc error (cell {i}): {e}")
+        failed.add(i)
 
-    # --- 5. คำนวณ Ratio ---
-    # ระยะจาก Center -> Chromatin
-    dist_c_to_p = math.sqrt((px - cx)**2 + (py - cy)**2)
-    
-    # ระยะจาก Center -> Edge (รัศมีรวมในทิศทางนั้น)
-    bx, by = best_edge_point
-    dist_c_to_edge = math.sqrt((bx - cx)**2 + (by - cy)**2)
-    
-    if dist_c_to_edge == 0: 
-        ratio = 0.0
-    else:
-        ratio = dist_c_to_p / dist_c_to_edge
+    for i, img in enumerate(images):
+        if features[i] is not None: continue
+        try:
+            features[i] = extract_features(img, radial=False)
+        except Exception as e:
+            fail(i, e)
 
-    # --- 6. Visualization ---
-    if save_viz_path:
-        viz = np.zeros_like(img)
-        
-        # วาดเส้นขอบ (Convex Hull) สีขาว
-        cv2.drawContours(viz, [main_cell_cnt], -1, (255, 255, 255), 1)
-        
-        # วาดเส้นไกด์ไลน์จางๆ จาก Center -> Edge
-        cv2.line(viz, (cx, cy), best_edge_point, (50, 50, 50), 1)
+    try:
+        fill_marginal_ratios([f for i, f in enumerate(features) if i not in failed])
+    except Exception:
+        # มีเซลล์ที่ทำให้ทั้ง Batch ล้ม -> คำนวณทีละเซลล์เพื่อแยกเซลล์นั้นออก
+        for i, f in enumerate(features):
+            if i in failed: continue
+            try:
+                fill_marginal_ratios([f])
+            except Exception as e:
+                fail(i, e)
 
-        # เส้น Center -> Chromatin (สีฟ้า)
-        cv2.line(viz, (cx, cy), (px, py), (255, 255, 0), 2)
-        
-        # เส้น Chromatin -> Edge (สีชมพู)
-        cv2.line(viz, (px, py), best_edge_point, (255, 0, 255), 2)
+    ratios = []
+    for i, (feats, viz_path) in enumerate(zip(features, save_viz_paths)):
+        if i in failed:
+            ratios.append(None)
+            continue
+        if feats is None or feats.radial_hull is None:
+            ratios.append(0.0)
+            continue
+        try:
+            if viz_path:
+                cv2.imwrite(viz_path, draw_distance_viz(feats))
+            ratios.append(feats.marginal_ratio)
+        except Exception as e:
+            fail(i, e)
+            ratios.append(None)
+    return ratios, [None if i in failed else f for i, f in enumerate(features)]
 
-        # จุด Marker
-        cv2.circle(viz, (cx, cy), 3, (0, 255, 0), -1)      # เขียว (Center)
-        cv2.circle(viz, (px, py), 3, (0, 0, 255), -1)      # แดง (Chromatin)
-        cv2.circle(viz, best_edge_point, 3, (255, 0, 255), -1) # ชมพู (Edge)
+def draw_distance_viz(features):
+    """วาดภาพอธิบาย Marginal Ratio บนพื้นดำ ขนาดเท่าภาพเซลล์"""
+    viz = np.zeros(features.image_shape, dtype=np.uint8)
+    center = features.centroid
+    chromatin = features.chromatin_point
+    edge = features.edge_point
+    
+    # วาดเส้นขอบ (Convex Hull) สีขาว
+    cv2.drawContours(viz, [features.radial_hull], -1, (255, 255, 255), 1)
+    
+    # วาดเส้นไกด์ไลน์จางๆ จาก Center -> Edge
+    cv2.line(viz, center, edge, (50, 50, 50), 1)
+
+    # เส้น Center -> Chromatin (สีฟ้า)
+    cv2.line(viz, center, chromatin, (255, 255, 0), 2)
+    
+    # เส้น Chromatin -> Edge (สีชมพู)
+    cv2.line(viz, chromatin, edge, (255, 0, 255), 2)
 
-        cv2.imwrite(save_viz_path, viz)
+    # จุด Marker
+    cv2.circle(viz, center, 3, (0, 255, 0), -1)      # เขียว (Center)
+    cv2.circle(viz, chromatin, 3, (0, 0, 255), -1)   # แดง (Chromatin)
+    cv2.circle(viz, edge, 3, (255, 0, 255), -1)      # ชมพู (Edge)
 
-    return round(min(ratio, 1.0), 4)
\ No newline at end of file
+    return viz
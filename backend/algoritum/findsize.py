@@ -3,6 +3,7 @@ import numpy as np
 import os
 import sys
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # เพิ่ม Path เพื่อหาไฟล์ cellree.py
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -12,176 +13,236 @@ try:
 except ImportError:
     print("🚨 Error: ไม่พบไฟล์ cellree.py ในโฟลเดอร์")
 
-def get_diameter_and_visualize(image_path, save_viz_path=None):
+from cellfeatures import extract_features
+
+def get_diameter_and_visualize(image_path, save_viz_path=None, features=None):
     """
     วัดขนาด Diameter โดยใช้ Convex Hull เพื่อแก้ปัญหาขอบเซลล์แหว่ง
     ทำให้ได้ขนาดที่แท้จริง (Equivalent Diameter)
+    image_path: path ของไฟล์ หรือ numpy array (BGR) ที่อยู่ในหน่วยความจำ
+    features: CellFeatures ที่คำนวณไว้แล้ว (ถ้ามีจะไม่ Preprocess ภาพซ้ำ)
     """
-    img = cv2.imread(image_path)
-    if img is None: return 0
+    img = None
+    if features is None or save_viz_path:
+        img = image_path if isinstance(image_path, np.ndarray) else cv2.imread(image_path)
+        if img is None: return 0
 
-    h, w = img.shape[:2]
-    
-    # 1. เตรียมภาพ: Gray -> Blur (เพิ่มขนาด Kernel เพื่อลด Noise ผิวเซลล์)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (9, 9), 0) 
-    
-    # 2. Otsu's Thresholding: แยก Background ออกจาก Cell
-    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-
-    # 3. Morphology: ถมรูพรุนภายในและเชื่อมขอบ
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-    mask = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
-    
-    # 4. หาเส้นขอบ (Contours)
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    if not contours:
-        if save_viz_path: cv2.imwrite(save_viz_path, img)
-        return 0
+    if features is None:
+        features = extract_features(img)
 
-    # 5. เลือก Contour ที่ "อยู่ใกล้กลางภาพ" มากที่สุด 
-    # (ป้องกันการไปจับขอบ Bounding Box หรือขยะที่มุมภาพ)
-    center_img = (w // 2, h // 2)
-    best_contour = None
-    min_dist = float('inf')
-
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area < (h * w * 0.05): continue # กรองขยะที่มีขนาดเล็กกว่า 5% ของรูป
-        
-        # หาจุดศูนย์กลางของ Contour (Centroid)
-        M = cv2.moments(cnt)
-        if M["m00"] == 0: continue
-        cX = int(M["m10"] / M["m00"])
-        cY = int(M["m01"] / M["m00"])
-        
-        # คำนวณระยะห่างจากกลางภาพ
-        dist = np.sqrt((cX - center_img[0])**2 + (cY - center_img[1])**2)
-        if dist < min_dist:
-            min_dist = dist
-            best_contour = cnt
-
-    if best_contour is None:
+    if features is None:
         if save_viz_path: cv2.imwrite(save_viz_path, img)
         return 0
 
-    # --- ✨ KEY FIX: ใช้ Convex Hull หาขอบเขตจริง ---
-    # ช่วยแก้ปัญหาขอบหยัก หรือรอยแหว่งจากการ Threshold 
-    hull = cv2.convexHull(best_contour)
-
-    # 6. คำนวณ Diameter จากพื้นที่ของ Convex Hull (Area-based)
-    # สูตร: Diameter = 2 * sqrt(Area / pi)
-    area = cv2.contourArea(hull)
-    diameter = 2 * np.sqrt(area / np.pi)
+    # สูตร: Diameter = 2 * sqrt(Area / pi) จากพื้นที่ของ Convex Hull
+    diameter = features.equivalent_diameter
     
-    # 7. วาดภาพ Visualization (เส้นขอบเขียวของ Hull)
+    # วาดภาพ Visualization (เส้นขอบเขียวของ Hull)
     if save_viz_path:
-        viz_img = img.copy()
-        # วาดเส้น Hull สีเขียวหนา 2px
-        cv2.drawContours(viz_img, [hull], -1, (0, 255, 0), 2)
-        
-        # (Optional) วาด Contour ดิบสีแดงจางๆ เพื่อเปรียบเทียบ
-        # cv2.drawContours(viz_img, [best_contour], -1, (0, 0, 255), 1)
-        
-        cv2.imwrite(save_viz_path, viz_img)
+        cv2.imwrite(save_viz_path, draw_size_viz(img, features))
 
     return diameter
 
+def draw_size_viz(img, features, label=None):
+    """วาดเส้น Hull สีเขียวหนา 2px บนภาพเซลล์ (และข้อความกำกับ ถ้ามี)"""
+    viz_img = img.copy()
+    if features.hull is not None:
+        cv2.drawContours(viz_img, [features.hull], -1, (0, 255, 0), 2)
+    if label:
+        cv2.putText(viz_img, label, (5, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+    return viz_img
+
+def amoeboid_label(circ, shape_stat):
+    """ข้อความกำกับบนภาพ Size Visualization (เฉพาะเซลล์ Amoeboid)"""
+    return f"Amoeboid ({circ:.2f})" if shape_stat == "Amoeboid" else None
+
+# เกณฑ์ของ Size Analysis (รวมไว้ที่เดียว pipeline.PIPELINE_VERSION คำนวณ Hash จากค่าเหล่านี้)
+SIZE_THRESHOLDS = {
+    "default_baseline_px": 120.0,       # ค่าเริ่มต้นกรณีหา Baseline ไม่ได้
+    "baseline_min_px": 40,              # Baseline ต้องใหญ่กว่านี้
+    "baseline_min_circularity": 0.70,   # และกลมกว่านี้ (ถ้าวัดรูปร่างได้)
+    "enlarged_ratio": 1.20,             # B/A เกินนี้ = Enlarged
+}
+
 def calculate_refined_baseline(baseline_diameters):
     """คำนวณค่าเฉลี่ย RBC ปกติ โดยใช้ Median เพื่อป้องกันค่ากระโดด (Outliers)"""
-    if not baseline_diameters: return 120.0 # ค่าเริ่มต้นกรณีหา Baseline ไม่ได้
+    if not baseline_diameters: return SIZE_THRESHOLDS["default_baseline_px"]
     return np.median(baseline_diameters)
 
-def process_folder_sizes(case_folder_path):
+# โฟลเดอร์เป้าหมายที่จะวิเคราะห์
+TARGET_FOLDERS = ["1chromatin", "band form", "basket form", "schuffner dot", "Appliqué"]
+
+# โฟลเดอร์ที่ใช้เป็นมาตรฐาน (Normal Cell)
+BASELINE_FOLDERS = ["nomal_cell", "normal_cell", "normal"]
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# จำนวน Thread ที่ใช้วัดเซลล์พร้อมกัน (OpenCV ปล่อย GIL ระหว่างประมวลผลภาพ)
+SIZE_WORKERS = max(1, min(8, os.cpu_count() or 1))
+
+def process_folder_sizes(case_folder_path, precomputed=None, workers=None):
     """
     วิเคราะห์ขนาดและรูปร่างเซลล์ในโปรเจกต์ MalariaX
+    precomputed: list ของ (filename, folder_name, features) ที่คำนวณไว้แล้ว
+                 (เช่น "features" จาก segment_and_save_cells) -> ไม่ต้องสแกนโฟลเดอร์และ Threshold ภาพซ้ำ
+                 ภาพใน case_folder_path จะถูกอ่านเฉพาะตอนวาด Visualization (ถ้าไฟล์มีอยู่)
     """
-    # โฟลเดอร์เป้าหมายที่จะวิเคราะห์
-    TARGET_FOLDERS = ["1chromatin", "band form", "basket form", "schuffner dot", "Appliqué"]
-    
-    # โฟลเดอร์ที่ใช้เป็นมาตรฐาน (Normal Cell)
-    possible_baseline = ["nomal_cell", "normal_cell", "normal"]
+    VIZ_ROOT = os.path.join(case_folder_path, "size_visualization")
+    if precomputed is not None:
+        def item_of(file, folder_name, feats):
+            p = os.path.join(case_folder_path, folder_name, file)
+            return (p if os.path.exists(p) else None, feats)
+
+        baseline_items = [item_of(*entry) for entry in precomputed if entry[1] in BASELINE_FOLDERS]
+        target_items = [(file, folder_name, item_of(file, folder_name, feats))
+                        for file, folder_name, feats in precomputed if folder_name in TARGET_FOLDERS]
+        return _analyze_sizes(baseline_items, target_items, VIZ_ROOT, workers)
+
     baseline_path = None
     
-    for name in possible_baseline:
+    for name in BASELINE_FOLDERS:
         p = os.path.join(case_folder_path, name)
         if os.path.exists(p):
             baseline_path = p
             break
             
-    VIZ_ROOT = os.path.join(case_folder_path, "size_visualization")
-    os.makedirs(VIZ_ROOT, exist_ok=True)
-    
-    # --- Step 1: คำนวณ Baseline (A) ---
-    baseline_diameters = []
+    baseline_items = []
     if baseline_path:
         for file in os.listdir(baseline_path):
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                full_p = os.path.join(baseline_path, file)
-                
-                # ใช้ฟังก์ชันใหม่ที่มี Convex Hull
-                d = get_diameter_and_visualize(full_p)
-                
-                # Baseline ต้องกลมและมีขนาดสมเหตุสมผล
-                # (เรียกใช้ฟังก์ชันเช็ค Shape จากไฟล์ cellree.py)
-                try:
-                    circ, _ = cellree.analyze_shape(full_p)
-                    if d > 40 and circ > 0.70:
-                        baseline_diameters.append(d)
-                except:
-                    # กรณีไม่มี cellree หรือ error ให้ข้ามไปก่อน
-                    if d > 40: baseline_diameters.append(d)
-    
-    baseline_A = calculate_refined_baseline(baseline_diameters)
-    print(f"📊 Baseline A (Normal RBC size): {baseline_A:.2f} px")
-
-    # --- Step 2: วิเคราะห์เชื้อ (B) ---
-    results_summary = {} 
-    amoeboid_count = 0 
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                baseline_items.append(os.path.join(baseline_path, file))
 
+    target_items = []
     for folder_name in TARGET_FOLDERS:
         target_path = os.path.join(case_folder_path, folder_name)
         if not os.path.exists(target_path): continue
-        
-        viz_folder = os.path.join(VIZ_ROOT, folder_name)
-        os.makedirs(viz_folder, exist_ok=True)
-            
+
         for file in os.listdir(target_path):
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                full_path = os.path.join(target_path, file)
-                viz_out = os.path.join(viz_folder, file)
-                
-                # 1. วัดขนาด (ใช้ Convex Hull แล้ว)
-                size_B = get_diameter_and_visualize(full_path, viz_out)
-                
-                # 2. วิเคราะห์รูปร่าง
-                circ, shape_stat = 0, "Unknown"
-                try:
-                    circ, shape_stat = cellree.analyze_shape(full_path)
-                except:
-                    pass
-                
-                if shape_stat == "Amoeboid":
-                    amoeboid_count += 1
-                    # เขียน Text บนภาพ Viz
-                    tmp = cv2.imread(viz_out)
-                    if tmp is not None:
-                        cv2.putText(tmp, f"Amoeboid ({circ:.2f})", (5, 20), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-                        cv2.imwrite(viz_out, tmp)
-
-                # 3. คำนวณ Ratio (B/A)
-                ratio = size_B / baseline_A if baseline_A > 0 else 0
-                
-                results_summary[file] = {
-                    "folder": folder_name,
-                    "size_px": round(size_B, 2),
-                    "ratio": round(ratio, 2),
-                    "size_status": "Enlarged" if ratio > 1.20 else "Normal",
-                    "shape_status": shape_stat,
-                    "circularity": round(circ, 4),
-                    "viz_image": viz_out 
-                }
-
-    return results_summary, amoeboid_count
\ No newline at end of file
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                target_items.append((file, folder_name, os.path.join(target_path, file)))
+
+    return _analyze_sizes(baseline_items, target_items, VIZ_ROOT, workers)
+
+def process_cell_sizes(cells, viz_root=None, labels=None, workers=None):
+    """
+    เหมือน process_folder_sizes แต่รับ list ของ CellRecord (มี .label และ .crop) ในหน่วยความจำ
+    ไม่ต้องอ่านไฟล์จาก sorted_by_morphology
+    viz_root: โฟลเดอร์สำหรับบันทึกภาพ Visualization (None = ไม่บันทึก)
+    labels: Class ของแต่ละเซลล์ (เรียงตาม cells) ถ้าไม่ส่งมาใช้ c.label
+    workers: จำนวน Thread ที่วัดเซลล์พร้อมกัน (None = SIZE_WORKERS)
+    """
+    if labels is None:
+        labels = [c.label for c in cells]
+
+    def image_of(c):
+        # ใช้ค่าที่คำนวณไว้แล้ว (Mask ของ Cellpose ก่อน แล้วค่อย CellFeatures) แทนการ Preprocess ซ้ำ
+        feats = c.mask_features if c.mask_features is not None else c.features
+        return (c.crop, feats) if feats is not None else c.crop
+
+    baseline_items = [image_of(c) for c, label in zip(cells, labels) if label in BASELINE_FOLDERS]
+    target_items = [(c.filename, label, image_of(c)) for c, label in zip(cells, labels) if label in TARGET_FOLDERS]
+    return _analyze_sizes(baseline_items, target_items, viz_root, workers)
+
+def _with_features(item):
+    """แยก (ภาพ, CellFeatures) ถ้ามีมาให้แล้ว ไม่งั้นคำนวณจากภาพ"""
+    if isinstance(item, tuple):
+        return item
+    img = item if isinstance(item, np.ndarray) else cv2.imread(item)
+    if img is None: return item, None
+    return img, extract_features(img)
+
+def _measure(item):
+    """
+    วัดขนาด + รูปร่างของเซลล์ 1 เซลล์
+    คืนค่า (ภาพ, features, diameter, circularity, shape_status, shape_ok)
+    """
+    img, feats = _with_features(item)
+
+    # 1. วัดขนาด (ใช้ Convex Hull แล้ว)
+    diameter = get_diameter_and_visualize(img, features=feats) if feats else 0
+
+    # 2. วิเคราะห์รูปร่าง (เรียกใช้ฟังก์ชันเช็ค Shape จากไฟล์ cellree.py)
+    circ, shape_stat, shape_ok = 0, "Unknown", True
+    try:
+        circ, shape_stat = cellree.analyze_shape(img, features=feats)
+    except:
+        # กรณีไม่มี cellree หรือ error ให้ข้ามไปก่อน
+        shape_ok = False
+    return img, feats, diameter, circ, shape_stat, shape_ok
+
+def _measure_target(item, viz_out):
+    """วัดเซลล์ติดเชื้อ แล้ววาด Viz ครั้งเดียว (เขียน Text "Amoeboid" ไปพร้อมกัน ไม่ต้องอ่านไฟล์กลับมาแก้)"""
+    img, feats, diameter, circ, shape_stat, _ = _measure(item)
+
+    if viz_out and img is not None:
+        if not isinstance(img, np.ndarray): img = cv2.imread(img)
+        if img is not None:
+            if feats is None:
+                cv2.imwrite(viz_out, img)
+            else:
+                cv2.imwrite(viz_out, draw_size_viz(img, feats, amoeboid_label(circ, shape_stat)))
+        else:
+            viz_out = None
+    elif img is None:
+        viz_out = None
+    return diameter, circ, shape_stat, viz_out
+
+def _analyze_sizes(baseline_items, target_items, viz_root=None, workers=None):
+    """
+    baseline_items: list ของภาพ (path หรือ array) ของเซลล์ปกติ
+    target_items: list ของ (filename, folder_name, ภาพ) ของเซลล์ที่ติดเชื้อ
+    ภาพอาจเป็น (ภาพ, CellFeatures) เพื่อใช้ค่าที่คำนวณไว้แล้ว
+    การวัดแต่ละเซลล์กระจายไปใน Thread Pool (เฉพาะเมื่อต้อง Threshold ภาพหรือวาด Viz)
+    ส่วน Baseline / Ratio คำนวณด้วย NumPy ครั้งเดียว
+    คืนค่า: (results_summary, amoeboid_count)
+    """
+    viz_outs = [None] * len(target_items)
+    if viz_root:
+        os.makedirs(viz_root, exist_ok=True)
+        for folder_name in {folder for _, folder, _ in target_items}:
+            os.makedirs(os.path.join(viz_root, folder_name), exist_ok=True)
+        viz_outs = [os.path.join(viz_root, folder_name, file) for file, folder_name, _ in target_items]
+
+    images = [item for _, _, item in target_items]
+    # Features คำนวณไว้ครบแล้วและไม่ต้องวาด Viz -> เหลือแค่อ่านค่า ไม่คุ้มที่จะสร้าง Thread Pool
+    needs_pool = viz_root or not all(isinstance(item, tuple) for item in baseline_items + images)
+    if needs_pool:
+        workers = workers or SIZE_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            baseline = list(executor.map(_measure, baseline_items))
+            targets = list(executor.map(_measure_target, images, viz_outs))
+    else:
+        baseline = [_measure(item) for item in baseline_items]
+        targets = [_measure_target(item, viz_out) for item, viz_out in zip(images, viz_outs)]
+
+    # --- Step 1: คำนวณ Baseline (A) ---
+    # Baseline ต้องกลมและมีขนาดสมเหตุสมผล (ถ้าวัดรูปร่างไม่ได้ ใช้เฉพาะขนาด)
+    base_d = np.array([m[2] for m in baseline], dtype=np.float64)
+    base_circ = np.array([m[3] for m in baseline], dtype=np.float64)
+    base_shape_ok = np.array([m[5] for m in baseline], dtype=bool)
+    keep = ((base_d > SIZE_THRESHOLDS["baseline_min_px"]) &
+            ((base_circ > SIZE_THRESHOLDS["baseline_min_circularity"]) | ~base_shape_ok))
+    baseline_A = calculate_refined_baseline(base_d[keep].tolist())
+    print(f"📊 Baseline A (Normal RBC size): {baseline_A:.2f} px")
+
+    # --- Step 2: วิเคราะห์เชื้อ (B) -> Ratio (B/A) ของทุกเซลล์พร้อมกัน ---
+    sizes = np.array([t[0] for t in targets], dtype=np.float64)
+    ratios = sizes / baseline_A if baseline_A > 0 else np.zeros_like(sizes)
+
+    results_summary = {}
+    amoeboid_count = 0
+    for (file, folder_name, _), (size_B, circ, shape_stat, viz_out), ratio in zip(target_items, targets, ratios):
+        if shape_stat == "Amoeboid":
+            amoeboid_count += 1
+
+        results_summary[file] = {
+            "folder": folder_name,
+            "size_px": round(float(size_B), 2),
+            "ratio": round(float(ratio), 2),
+            "size_status": "Enlarged" if ratio > SIZE_THRESHOLDS["enlarged_ratio"] else "Normal",
+            "shape_status": shape_stat,
+            "circularity": round(circ, 4),
+            "viz_image": viz_out
+        }
+
+    return results_summary, amoeboid_count
@@ -35,10 +35,10 @@ def detect_circle(img_bgr):
     cx, cy, r = circles[0][0] 
     return int(cx), int(cy), int(r)
 
-def crop_inner_square(img_bgr, cx, cy, r):
+def inner_square_box(img_bgr, cx, cy, r):
     """
-    ตัดภาพเป็นสี่เหลี่ยมจัตุรัสที่ 'อยู่ภายใน' วงกลม (Inscribed Square)
-    เพื่อกำจัดขอบดำ/ขาว ออกไปให้หมด เหลือแต่เนื้อเซลล์
+    พิกัด (x1, y1, x2, y2) ของสี่เหลี่ยมจัตุรัสที่ 'อยู่ภายใน' วงกลม (Inscribed Square)
+    คืนค่า None ถ้าตัดไม่ได้ (วงกลมหลุดขอบภาพ)
     """
     h, w = img_bgr.shape[:2]
 
@@ -61,17 +61,37 @@ def crop_inner_square(img_bgr, cx, cy, r):
 
     # ตรวจสอบว่าพื้นที่ที่ตัดมาถูกต้องไหม (เผื่อวงกลมหลุดขอบ)
     if x2 <= x1 or y2 <= y1:
-        return img_bgr # คืนภาพเดิมถ้าตัดไม่ได้
+        return None
+    return x1, y1, x2, y2
 
-    # ตัดภาพ (Crop)
-    cropped_img = img_bgr[y1:y2, x1:x2].copy()
+def crop_inner_square(img_bgr, cx, cy, r):
+    """
+    ตัดภาพเป็นสี่เหลี่ยมจัตุรัสที่ 'อยู่ภายใน' วงกลม (Inscribed Square)
+    เพื่อกำจัดขอบดำ/ขาว ออกไปให้หมด เหลือแต่เนื้อเซลล์
+    """
+    return crop_with_box(img_bgr, cx, cy, r)[0]
+
+def crop_with_box(img_bgr, cx, cy, r):
+    """เหมือน crop_inner_square แต่คืนค่า (ภาพ, box ในพิกัดภาพเดิม หรือ None ถ้าใช้ภาพเดิมทั้งภาพ)"""
+    box = inner_square_box(img_bgr, cx, cy, r)
+    if box is None:
+        return img_bgr, None # คืนภาพเดิมถ้าตัดไม่ได้
 
-    return cropped_img
+    # ตัดภาพ (Crop)
+    x1, y1, x2, y2 = box
+    return img_bgr[y1:y2, x1:x2].copy(), box
 
 def process_image(image_input):
     """
     Main Function: รับภาพ -> หาวงกลม -> ตัดสี่เหลี่ยมเนื้อใน -> ส่งคืน
     """
+    return process_image_with_box(image_input)[0]
+
+def process_image_with_box(image_input):
+    """
+    เหมือน process_image แต่คืนค่า (ภาพที่ตัดแล้ว, box [x1, y1, x2, y2] ในพิกัดภาพเดิม หรือ None)
+    ใช้แปลง bbox ของเซลล์กลับไปวาดบนภาพต้นฉบับ (เช่นเฟรมจากกล้องแบบ Live)
+    """
     # 1. Load Image
     if isinstance(image_input, str):
         if not os.path.exists(image_input):
@@ -89,9 +109,7 @@ def process_image(image_input):
     cx, cy, r = detect_circle(img)
 
     # 3. Crop Inner Square (ตัดเอาเฉพาะสี่เหลี่ยมข้างใน)
-    result_img = crop_inner_square(img, cx, cy, r)
-
-    return result_img
+    return crop_with_box(img, cx, cy, r)
 
 # --- Test Block (รันไฟล์นี้เพื่อทดสอบได้เลย) ---
 if __name__ == "__main__":
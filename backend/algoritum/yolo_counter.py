@@ -1,31 +1,78 @@
 from ultralytics import YOLO
 import cv2
+import numpy as np
+
+import config
+
+YOLO_CONFIDENCE = config.YOLO_CONFIDENCE
+
+def load_yolo_model(model_path):
+    """โหลด YOLOv8 (คืนค่า None ถ้าโหลดไม่สำเร็จ)"""
+    print(f"📦 Loading YOLOv8 from {model_path}...")
+    try:
+        return YOLO(model_path)
+    except Exception as e:
+        print(f"❌ Error loading YOLO model: {e}")
+        return None
+
+def warm_up_yolo(model):
+    """เรียก predict กับภาพสังเคราะห์ 1 ครั้ง (ultralytics จะสร้าง Predictor / fuse layer ตอนเรียกครั้งแรก)"""
+    dummy = np.full((96, 96, 3), 230, dtype=np.uint8)
+    model.predict(source=dummy, conf=YOLO_CONFIDENCE, verbose=False)
+
+def _result_to_boxes(result):
+    """แปลงผลของ YOLO 1 ภาพ เป็น (จำนวน, รายการพิกัด [ [x1, y1, x2, y2], ... ])"""
+    boxes = result.boxes
+    count = len(boxes)
+
+    # ✨ สร้าง List เก็บพิกัดของแต่ละกล่อง
+    boxes_list = []
+    for box in boxes:
+        # ดึงพิกัด (x1, y1, x2, y2) และแปลงเป็น List ธรรมดา (เพื่อให้ส่งเป็น JSON ได้)
+        coords = box.xyxy[0].tolist() 
+        boxes_list.append(coords)
+
+    return count, boxes_list
 
 def count_chromatin_with_yolo(model, image_path):
     """
     ใช้ YOLOv8 นับจำนวน Object (Chromatin) ในภาพ
+    image_path: path ของไฟล์ หรือ numpy array (BGR) ที่อยู่ในหน่วยความจำ
     Return: (จำนวนจุดที่พบ, รายการพิกัด [ [x1, y1, x2, y2], ... ])
     """
     try:
         # Run inference
         # conf=0.25 คือค่าความมั่นใจขั้นต่ำ (ปรับได้ตามความเหมาะสม)
-        results = model.predict(source=image_path, conf=0.25, verbose=False)
-        
-        # ดึงข้อมูล Boxes ที่โมเดลเจอ
-        boxes = results[0].boxes
-        count = len(boxes)
+        results = model.predict(source=image_path, conf=YOLO_CONFIDENCE, verbose=False)
         
-        # ✨ สร้าง List เก็บพิกัดของแต่ละกล่อง
-        boxes_list = []
-        for box in boxes:
-            # ดึงพิกัด (x1, y1, x2, y2) และแปลงเป็น List ธรรมดา (เพื่อให้ส่งเป็น JSON ได้)
-            coords = box.xyxy[0].tolist() 
-            boxes_list.append(coords)
-            
         # ส่งคืนค่า 2 ตัว: (จำนวน, รายการพิกัด)
-        return count, boxes_list
+        return _result_to_boxes(results[0])
 
     except Exception as e:
         print(f"⚠️ YOLO Counting Error: {e}")
         # กรณี Error ให้ส่งคืน 0 และ List ว่าง
-        return 0, []
\ No newline at end of file
+        return 0, []
+
+def count_chromatin_batch(model, images, batch_size=16, on_chunk=None):
+    """
+    นับ Chromatin ของหลายเซลล์ด้วยการเรียก YOLO แบบ Batch (แทนการเรียกทีละภาพ)
+    images: list ของ numpy array (BGR) ของเซลล์ที่เป็น 1chromatin
+    on_chunk: callback(start, ผลของ Chunk นั้น) เรียกทันทีที่แต่ละ Chunk เสร็จ
+    Return: list ของ (จำนวน, รายการพิกัด xyxy) เรียงตามลำดับ input
+    """
+    results_list = []
+    if not images: return results_list
+
+    batch_size = max(1, int(batch_size))
+    for start in range(0, len(images), batch_size):
+        chunk = list(images[start:start + batch_size])
+        try:
+            results = model.predict(source=chunk, conf=YOLO_CONFIDENCE, verbose=False)
+            results_list.extend(_result_to_boxes(r) for r in results)
+        except Exception as e:
+            print(f"⚠️ YOLO Batch Counting Error: {e}")
+            results_list.extend([(0, [])] * len(chunk))
+
+        if on_chunk is not None: on_chunk(start, results_list[start:])
+
+    return results_list
@@ -1,54 +1,119 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import json
 import os
-import uuid
 import traceback
-import shutil
+import uuid
+from contextlib import nullcontext
 import cv2
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, abort
 from flask_cors import CORS
-from collections import Counter
-from ultralytics import YOLO 
 
-# --- Import Pipeline ---
-from cellpose_segmenter import segment_and_save_cells, filter_bad_cells
-from image_processor import preprocess_image_with_mask
-from model_loader import load_resnet_model, predict_image_file 
+import config
+from config import UPLOAD_FOLDER, SEGMENTED_FOLDER, PROCESSED_FOLDER, DEBUG_FOLDER
+from model_manager import ModelManager
+from jobs import JobManager
+from pipeline import (run_analysis, artifacts_exist, artifact_available, load_artifact_image,
+                      PIPELINE_VERSION)
+from result_cache import ResultCache, build_version
+from calibration import DiameterCalibration
+from viz_renderer import VizRenderer
+from retention import RetentionManager
+from live_stream import LiveAnalyzer, start_socket_server
+import response_format
+import metrics
+import profiling
 
-# Import Algorithms
-from algoritum.findsize import process_folder_sizes 
-from algoritum.diastant import calculate_marginal_ratio 
-from algoritum.yolo_counter import count_chromatin_with_yolo
-from algoritum import removebg  # <--- เรียกใช้ไฟล์ตัดพื้นหลัง
+try:
+    from flask_sock import Sock  # Optional: pip install flask-sock (WebSocket สำหรับ Live Stream)
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_CONTENT_LENGTH
+# WebSocket (flask-sock): ปฏิเสธ Message ที่ใหญ่กว่า 1 เฟรมแบบ base64 ตั้งแต่ตอนรับ
+app.config['SOCK_SERVER_OPTIONS'] = {'max_message_size': config.LIVE_MAX_FRAME_BYTES * 4 // 3 + 1024}
 CORS(app)
 
 # ================== SETUP FOLDERS ==================
-UPLOAD_FOLDER = 'uploads'
-SEGMENTED_FOLDER = 'segmented_cells'
-PROCESSED_FOLDER = 'processed_results'
-DEBUG_FOLDER = 'debug_crops'  # <--- โฟลเดอร์เก็บรูปที่ตัดแล้ว
-
 # สร้างโฟลเดอร์ให้ครบ
 for folder in [UPLOAD_FOLDER, SEGMENTED_FOLDER, PROCESSED_FOLDER, DEBUG_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
 # ================== LOAD MODELS ==================
 print("🚀 Loading System...")
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-
-# 1. Load ResNet
-MODEL_PATH = os.path.join(BASE_DIR, 'model', 'best_resnet-50_new_start.pth') 
-CLASS_NAMES = ['1chromatin', 'band form', 'basket form', 'nomal_cell', 'schuffner dot'] 
-resnet_model, device = load_resnet_model(MODEL_PATH, num_classes=len(CLASS_NAMES))
 
-# 2. Load YOLO
-YOLO_PATH = os.path.join(BASE_DIR, 'model', 'best.pt') 
-print(f"📦 Loading YOLOv8 from {YOLO_PATH}...")
-try:
-    yolo_model = YOLO(YOLO_PATH)
-except Exception as e:
-    print(f"❌ Error loading YOLO model: {e}")
-    yolo_model = None
+models = ModelManager(config.MODEL_PATH, config.YOLO_PATH, num_classes=len(config.CLASS_NAMES),
+                      resnet_options=config.resnet_options())
+if config.PRELOAD_MODELS:
+    # Production (gunicorn --preload): โหลดครั้งเดียวใน Master แล้วแชร์ Weights ให้ทุก Worker
+    # Warm-up จะทำในแต่ละ Worker หลัง fork (ดู gunicorn.conf.py)
+    models.load_all(warm_up=False)
+    models.share_memory()
+elif config.MODELS_AUTOLOAD:
+    # โหลด Cellpose / ResNet / YOLO พร้อมกันใน Background + Warm-up
+    models.start()
+
+# Worker Pool สำหรับงานแบบ Async (/api/jobs)
+jobs = JobManager(max_workers=config.JOB_WORKERS, max_pending=config.JOB_QUEUE_LIMIT,
+                  ttl_seconds=config.JOB_TTL_SECONDS, max_finished=config.JOB_MAX_FINISHED)
+
+# วาดภาพ Visualization เมื่อถูกเปิดดูครั้งแรก (Lazy) จาก Geometry ที่ Pipeline เก็บไว้
+viz = VizRenderer(PROCESSED_FOLDER, config.VIZ_CACHE_FOLDER, load_source=load_artifact_image,
+                  source_exists=artifact_available, max_bytes=config.VIZ_CACHE_MAX_BYTES)
+
+# Cache ผลลัพธ์ของภาพที่เคยวิเคราะห์แล้ว (Key = Hash ของไฟล์ + Version ของโมเดล/Config)
+cache = None
+if config.CACHE_ENABLED:
+    # Backend ของ ResNet อยู่ใน Key (_lookup_or_run) เพราะรู้ค่าจริงหลังโหลดโมเดลเสร็จเท่านั้น
+    cache_version = build_version(PIPELINE_VERSION, config.CLASS_NAMES, config.SAVE_ARTIFACTS, config.SIZE_FROM_MASKS,
+                                  config.VIZ_MODE, files=(config.MODEL_PATH, config.YOLO_PATH))
+    cache = ResultCache(config.CACHE_FOLDER, cache_version, max_entries=config.CACHE_MAX_ENTRIES,
+                        max_bytes=config.CACHE_MAX_BYTES,
+                        validate=lambda payload: artifacts_exist(payload, can_render=viz.can_render))
+
+# Calibration ขนาดเซลล์ต่อกล้อง (ข้าม Size Estimation ของ Cellpose เมื่อค่านิ่งแล้ว)
+calibration = None
+if config.CALIBRATION_ENABLED:
+    calibration = DiameterCalibration(config.CALIBRATION_FILE, min_samples=config.CALIBRATION_MIN_SAMPLES,
+                                      reestimate_every=config.CALIBRATION_REESTIMATE_EVERY,
+                                      allowed_profiles=config.CALIBRATION_PROFILES,
+                                      max_profiles=config.CALIBRATION_MAX_PROFILES)
+
+# ลบไฟล์ของ Session เก่า (TTL + โควตา Disk) ด้วย Sweeper Thread
+# โหมด gunicorn --preload: Thread ไม่ข้าม fork จึงเริ่มใน post_fork ของแต่ละ Worker แทน
+retention = None
+if config.RETENTION_ENABLED:
+    retention = RetentionManager(
+        [UPLOAD_FOLDER, DEBUG_FOLDER, SEGMENTED_FOLDER, PROCESSED_FOLDER, config.VIZ_CACHE_FOLDER],
+        session_ttl=config.RETENTION_SESSION_TTL, max_bytes=config.RETENTION_MAX_BYTES,
+        interval=config.RETENTION_INTERVAL, grace=config.RETENTION_GRACE,
+        lock_path=os.path.join(PROCESSED_FOLDER, '.retention.lock'))
+    if not config.PRELOAD_MODELS:
+        retention.start()
+
+# วิเคราะห์เฟรมจากกล้องแบบ Live (เก็บเฉพาะเฟรมล่าสุด ไม่บันทึกไฟล์ลง Disk)
+def _analyze_live_frame(frame_bytes):
+    if not models.wait_loaded(timeout=config.MODEL_WAIT_TIMEOUT):
+        return {'error': 'Models are not ready', 'success': False}, 503
+    with metrics.REQUEST_SECONDS.time(endpoint='live'):
+        payload, status = run_analysis(frame_bytes, 'live.jpg', models, save_artifacts=False, viz=False,
+                                       calibration=calibration, device_profile='live')
+    metrics.REQUESTS.inc(endpoint='live', status=status)
+    return payload, status
+
+live = None
+if config.LIVE_ENABLED:
+    live = LiveAnalyzer(_analyze_live_frame, max_frame_bytes=config.LIVE_MAX_FRAME_BYTES)
+    if config.LIVE_SOCKET_PORT and not config.PRELOAD_MODELS:
+        start_socket_server(live, config.LIVE_SOCKET_HOST, config.LIVE_SOCKET_PORT)
+
+# เวลาตั้งแต่เริ่ม import app จนพร้อมรับ Request (ไม่รวมการโหลดโมเดลที่ยังทำอยู่ใน Background)
+STARTUP_SECONDS = round(time.perf_counter() - _IMPORT_STARTED, 3)
+_model_mode = 'preloaded' if config.PRELOAD_MODELS else ('loading in background' if config.MODELS_AUTOLOAD
+                                                         else 'load on first request')
+print(f"⏱️ App imported in {STARTUP_SECONDS:.2f}s (models: {_model_mode})")
 
 # ================== ROUTES ==================
 
@@ -58,211 +123,343 @@ def send_uploaded_image(filename):
 
 @app.route('/cells/<path:path>')
 def send_cell_image(path): 
-    return send_from_directory(SEGMENTED_FOLDER, path)
+    if os.path.isfile(os.path.join(SEGMENTED_FOLDER, path)):
+        return send_from_directory(SEGMENTED_FOLDER, path)
+    # Session ที่เก็บแบบ Atlas: ตัด crop ของเซลล์นี้ออกมาส่งให้ (URL แบบเดิมยังใช้ได้)
+    img = load_artifact_image(f"cells/{path}") if '..' not in path.split('/') else None
+    if img is None: abort(404)
+    ok, buf = cv2.imencode('.png', img)
+    if not ok: abort(500)
+    return Response(buf.tobytes(), mimetype='image/png', headers={'Cache-Control': 'max-age=3600'})
 
 @app.route('/processed/<path:path>')
 def send_processed_image(path):
-    return send_from_directory(PROCESSED_FOLDER, path)
+    if os.path.isfile(os.path.join(PROCESSED_FOLDER, path)):
+        return send_from_directory(PROCESSED_FOLDER, path)
+    # ยังไม่เคยวาด -> วาดจาก Geometry ใน viz_index.json แล้วเก็บลง Viz Cache
+    if viz.render(path) is None: abort(404)
+    return send_from_directory(config.VIZ_CACHE_FOLDER, path)
 
 # Route สำหรับส่งรูปที่ Crop แล้วให้หน้าเว็บ
 @app.route('/debug_crops/<path:filename>')
 def send_debug_image(filename):
     return send_from_directory(DEBUG_FOLDER, filename)
 
+# ================== HEALTH CHECK ==================
+
+@app.route('/api/health/live')
+def health_live():
+    return jsonify({'alive': True, 'startup_seconds': STARTUP_SECONDS})
+
+# Load Balancer ควรส่งงานมาเมื่อ endpoint นี้ตอบ 200 เท่านั้น (โหลด + Warm-up เสร็จแล้ว)
+# MALARIAX_MODELS_AUTOLOAD=0: Probe ครั้งแรกเป็นตัวเริ่มโหลดโมเดล (ตอบ 503 จนกว่าจะโหลด + Warm-up เสร็จ)
+@app.route('/api/health/ready')
+def health_ready():
+    models.start()
+    health = models.health()
+    return jsonify(health), (200 if health['ready'] else 503)
+
 # ================== MAIN API ==================
 
+def _get_upload():
+    """ตรวจไฟล์ที่อัปโหลด คืนค่า (file, None) หรือ (None, error response)"""
+    if 'file' not in request.files: return None, (jsonify({'error': 'No file part'}), 400)
+    file = request.files['file']
+    if file.filename == '': return None, (jsonify({'error': 'No file selected'}), 400)
+    return file, None
+
+def _models_not_ready():
+    return jsonify({'error': 'Models are not ready', 'models': models.health()['models'], 'success': False}), 503
+
+def _device_profile():
+    """ชื่อกล้อง/อุปกรณ์ของ Request (form field device_id หรือ Header X-Device-Id)"""
+    return request.form.get('device_id') or request.headers.get('X-Device-Id') or 'default'
+
+def _request_option(name):
+    return request.args.get(name) or request.form.get(name)
+
+def _send_payload(payload, status=200, headers=None, compact_key=None):
+    """
+    ส่งผลลัพธ์ตามที่ Client ขอ:
+    - format=compact (query/form) หรือ Header X-Response-Format: compact -> ข้อมูลรายเซลล์แบบ Column + offset/limit
+    - Accept: application/msgpack -> msgpack (ถ้าติดตั้งไว้)
+    - compress=1 (query/form) หรือ Header X-Compress: 1 (หรือ config.RESPONSE_GZIP) + Accept-Encoding: gzip -> บีบอัด
+    compact_key: key ใน payload ที่เป็นผลลัพธ์การวิเคราะห์ (None = ทั้ง payload)
+    """
+    fmt = (_request_option('format') or request.headers.get('X-Response-Format') or '').lower()
+    if fmt == 'compact':
+        try:
+            offset = int(_request_option('offset') or 0)
+            limit = _request_option('limit')
+            limit = int(limit) if limit else None
+        except ValueError:
+            return jsonify({'error': 'offset / limit must be integers', 'success': False}), 400
+        if compact_key is None:
+            payload = response_format.compact_payload(payload, offset, limit)
+        elif payload.get(compact_key):
+            payload = dict(payload, **{compact_key: response_format.compact_payload(payload[compact_key], offset, limit)})
+
+    compress = _request_option('compress') or request.headers.get('X-Compress')
+    compress = config.RESPONSE_GZIP or (compress or '').strip().lower() in ('1', 'true', 'yes', 'on')
+    encoding, content_encoding = response_format.negotiate(request.headers.get('Accept'),
+                                                           request.headers.get('Accept-Encoding'), compress)
+    if fmt != 'compact' and encoding == 'json' and content_encoding is None:
+        response = jsonify(payload)  # รูปแบบเดิม
+        response.headers['Vary'] = response_format.VARY
+    else:
+        body, mimetype, extra = response_format.encode(payload, encoding, content_encoding)
+        response = Response(body, mimetype=mimetype, headers=extra)
+    for key, value in (headers or {}).items():
+        response.headers[key] = value
+    return response, status
+
+def _viz_requested():
+    """ปิด Visualization ได้ด้วย form field / query viz=0 หรือ Header X-Viz: off (สำหรับ Batch / Automated Caller)"""
+    value = request.form.get('viz') or request.args.get('viz') or request.headers.get('X-Viz')
+    if value is None: return True
+    return value.strip().lower() not in ('0', 'false', 'no', 'off')
+
+def _profile_allowed():
+    if not config.PROFILING_ENABLED: return False
+    return not config.PROFILING_TOKEN or request.headers.get('X-Profile-Token') == config.PROFILING_TOKEN
+
+def _profile_requested():
+    """
+    profile=1 / sample / cprofile (query/form) หรือ Header X-Profile
+    คืนค่า (mode หรือ None, error response หรือ None)
+    """
+    value = (_request_option('profile') or request.headers.get('X-Profile') or '').strip().lower()
+    if value in ('', '0', 'false', 'no', 'off'): return None, None
+    if not _profile_allowed():
+        return None, (jsonify({'error': 'Profiling is disabled', 'success': False}), 403)
+    return (value if value in profiling.MODES else config.PROFILING_MODE), None
+
+def _analyze_with_cache(file_bytes, filename, on_stage=None, device_profile='default', viz=True, endpoint='analyze',
+                        session_id=None, use_cache=True, on_cell=None):
+    """run_analysis + Result Cache คืนค่า (payload, status, cache_hit) พร้อมบันทึก Metrics ของ Request"""
+    with metrics.REQUEST_SECONDS.time(endpoint=endpoint):
+        payload, status, cache_hit = _lookup_or_run(file_bytes, filename, on_stage, device_profile, viz,
+                                                    session_id, use_cache, on_cell)
+    metrics.REQUESTS.inc(endpoint=endpoint, status=status)
+    return payload, status, cache_hit
+
+def _lookup_or_run(file_bytes, filename, on_stage, device_profile, viz, session_id, use_cache, on_cell):
+    use_cache = use_cache and cache is not None
+    # Calibration ให้ Diameter ต่างกันตามกล้อง -> ผลของ device_profile ต่างกันเก็บแยก Key
+    # Backend ของ ResNet ใช้ค่าที่โหลดได้จริง (ถอยกลับเป็น eager ได้ถ้า Export / onnxruntime ใช้ไม่ได้)
+    variant = ('' if viz else 'no-viz') + f"|resnet={models.resnet_backend}" + \
+              (f"|profile={calibration.normalize_profile(device_profile)}" if calibration is not None else '')
+    key = cache.key_for(file_bytes, variant=variant) if use_cache else None
+    if key is not None:
+        cached = cache.get(key)
+        metrics.CACHE_LOOKUPS.inc(outcome='hit' if cached is not None else 'miss')
+        if cached is not None:
+            print(f"♻️ Cache hit: session {cached.get('session_id')}")
+            if on_stage is not None: on_stage('cache_hit', {"session_id": cached.get('session_id')})
+            if on_cell is not None:
+                for entry in cached.get('vit_characteristics', []): on_cell(entry)
+            return cached, 200, True
+
+    payload, status = run_analysis(file_bytes, filename, models, on_stage=on_stage, session_id=session_id,
+                                   calibration=calibration, device_profile=device_profile, viz=viz, on_cell=on_cell)
+    if key is not None and status == 200:
+        cache.put(key, payload)
+    return payload, status, False
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_image():
-    if 'file' not in request.files: return jsonify({'error': 'No file part'}), 400
-    file = request.files['file']
-    if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    file, error = _get_upload()
+    if error: return error
+    profile_mode, error = _profile_requested()
+    if error: return error
+    # รอโหลดจบก่อน (ถ้าบางโมเดลโหลดไม่ได้ Pipeline จะทำงานแบบลดระดับเหมือนเดิม)
+    if not models.wait_loaded(timeout=config.MODEL_WAIT_TIMEOUT): return _models_not_ready()
     
-    filepath = None
     try:
-        unique_id = str(uuid.uuid4())
-        # เก็บชื่อไฟล์ดั้งเดิมไว้
-        original_filename = unique_id + os.path.splitext(file.filename)[1]
-        filepath = os.path.join(UPLOAD_FOLDER, original_filename)
-        file.save(filepath)
-
-        # ==================================================================================
-        # 0️⃣ Step 0: Remove Background / Crop Square
-        # ==================================================================================
-        print("0️⃣ Preprocessing: Cropping Inner Square...")
-        
-        # ตั้งค่า Default URL เป็นรูปต้นฉบับก่อน (เผื่อ Crop ไม่ผ่าน)
-        final_image_url = f"uploads/{original_filename}"
-        
-        try:
-            # 1. ส่งรูปเข้า Algorithm ตัดให้เหลือแค่สี่เหลี่ยมด้านใน
-            cleaned_img_bgr = removebg.process_image(filepath)
-
-            # 2. ตั้งชื่อไฟล์ใหม่ (เติม crop_ ข้างหน้า)
-            cleaned_filename = "crop_" + original_filename
-            cleaned_filepath = os.path.join(DEBUG_FOLDER, cleaned_filename) # เซฟลง debug_crops
-
-            # 3. บันทึกรูปลง Disk
-            cv2.imwrite(cleaned_filepath, cleaned_img_bgr)
-            print(f"✅ Image cropped. Saved at: {cleaned_filepath}")
-
-            # 4. [สำคัญมาก] เปลี่ยน filepath ให้ Pipeline ไปใช้รูปที่ตัดแล้วทำงานต่อ
-            filepath = cleaned_filepath
-            
-            # 5. [สำคัญมาก] เปลี่ยน URL ที่จะส่งกลับหน้าเว็บ ให้เป็นรูปที่ตัดแล้ว
-            # เพื่อให้พิกัด Bounding Box ตรงกับภาพที่แสดง
-            final_image_url = f"debug_crops/{cleaned_filename}"
-
-        except Exception as e:
-            print(f"⚠️ Cropping failed (using original image instead): {e}")
-            # ถ้า Error ก็ใช้ filepath เดิมทำงานต่อ
-        # ==================================================================================
-        
-        # 1. Segmentation (ทำบนรูปที่ Crop แล้ว)
-        print(f"1️⃣ Running Cellpose Segmentation...")
-        raw_cells_data = segment_and_save_cells(filepath)
-        if not raw_cells_data: return jsonify({'message': 'No cells found.', 'success': False})
-        
-        # 2. Filtering
-        print(f"2️⃣ Filtering cells...")
-        valid_cells_data = filter_bad_cells(raw_cells_data)
-        if not valid_cells_data: return jsonify({'message': 'All cells filtered.', 'success': False})
-
-        # Prepare folders
-        first_cell_path = valid_cells_data[0]['file_path']
-        session_id = os.path.basename(os.path.dirname(first_cell_path))
-        sorted_base_dir = os.path.join(PROCESSED_FOLDER, session_id, 'sorted_by_morphology')
-        
-        for class_name in CLASS_NAMES + ['Unknown']:
-            os.makedirs(os.path.join(sorted_base_dir, class_name), exist_ok=True)
-
-        analysis_results = []
-        counts = Counter()
-
-        # 3. Classification
-        print(f"3️⃣ Classifying {len(valid_cells_data)} cells...")
-        CONFIDENCE_THRESHOLD = 90.0
-
-        for cell_item in valid_cells_data:
-            cell_path = cell_item['file_path']
-            bbox = cell_item['bbox']
-            cell_filename = os.path.basename(cell_path)
-            
-            # Preprocess for ResNet
-            temp_masked_path = cell_path.replace(".png", "_temp_mask.png")
-            try:
-                masked_img = preprocess_image_with_mask(cell_path)
-                if masked_img: masked_img.save(temp_masked_path)
-                else: shutil.copy(cell_path, temp_masked_path)
-            except: shutil.copy(cell_path, temp_masked_path)
-
-            # Predict ResNet
-            predicted_label = "Unknown"
-            confidence = 0.0
-            if resnet_model is not None:
-                predicted_label, confidence = predict_image_file(resnet_model, device, temp_masked_path)
-                if predicted_label != 'nomal_cell' and confidence < CONFIDENCE_THRESHOLD:
-                    predicted_label = 'nomal_cell' 
-
-            # --- Chromatin Analysis ---
-            marginal_ratio = 0.0
-            chromatin_count = 0
-            chromatin_bboxes = []
-            distance_viz_url = None 
-            
-            if predicted_label == '1chromatin':
-                # B1. วัดระยะห่าง
-                try:
-                    dist_viz_filename = cell_filename.replace(".png", "_dist_viz.png")
-                    dist_viz_path = os.path.join(sorted_base_dir, predicted_label, dist_viz_filename)
-                    
-                    marginal_ratio = calculate_marginal_ratio(cell_path, save_viz_path=dist_viz_path)
-                    
-                    distance_viz_url = f"processed/{session_id}/sorted_by_morphology/{predicted_label}/{dist_viz_filename}"
-                except Exception as e:
-                    print(f"Distance calc error: {e}")
-
-                # B2. นับจำนวน YOLO
-                if yolo_model is not None:
-                    try:
-                        count, bboxes = count_chromatin_with_yolo(yolo_model, cell_path)
-                        chromatin_count = count
-                        chromatin_bboxes = bboxes 
-                        if chromatin_count == 0: chromatin_count = 1
-                    except Exception as e:
-                        print(f"YOLO error: {e}")
-                        chromatin_count = 1
-                else:
-                    chromatin_count = 1
-
-            # Cleanup & Sort
-            if os.path.exists(temp_masked_path):
-                try: os.remove(temp_masked_path)
-                except: pass
-
-            target_path = os.path.join(sorted_base_dir, predicted_label, cell_filename)
-            shutil.copy(cell_path, target_path)
-
-            analysis_results.append({
-                "cell": cell_filename,
-                "characteristic": predicted_label,
-                "confidence": f"{confidence:.2f}%",
-                "marginal_ratio": marginal_ratio,
-                "chromatin_count": chromatin_count,
-                "chromatin_bboxes": chromatin_bboxes,
-                "distance_viz_url": distance_viz_url,
-                "url": f"cells/{session_id}/{cell_filename}",
-                "bbox": bbox
-            })
-            counts[predicted_label] += 1
-
-        # 4. Size Analysis
-        print(f"4️⃣ Analyzing Sizes...")
-        size_data_raw, amoeboid_count = process_folder_sizes(sorted_base_dir)
-        
-        size_analysis_for_web = []
-        if size_data_raw:
-            for fname, details in size_data_raw.items():
-                viz_url = None
-                if details.get('viz_image'):
-                    rel_path = os.path.relpath(details['viz_image'], PROCESSED_FOLDER).replace("\\", "/")
-                    viz_url = f"processed/{rel_path}"
-
-                size_analysis_for_web.append({
-                    "filename": fname,
-                    "folder": details['folder'],
-                    "size_px": details['size_px'],
-                    "ratio": details['ratio'],
-                    "status": details.get('size_status', 'Unknown'),
-                    "shape": details.get('shape_status', 'Unknown'),
-                    "circularity": details.get('circularity', 0),
-                    "visualization_url": viz_url 
-                })
-
-        # Overall Diagnosis
-        overall_diagnosis = "Normal / No Parasite Detected"
-        if counts['schuffner dot'] > 0: overall_diagnosis = "P. vivax Detected"
-        elif counts['band form'] > 0 or counts['basket form'] > 0: overall_diagnosis = "P. malariae Detected"
-        elif counts['1chromatin'] > 0: overall_diagnosis = "P. falciparum Detected"
-        
-        if amoeboid_count > 2 and overall_diagnosis == "Normal / No Parasite Detected":
-            overall_diagnosis = "Potential P. vivax (Amoeboid forms observed)"
-
-        return jsonify({
-            "session_id": session_id,
-            # ส่ง URL ของภาพที่ Crop แล้วกลับไปให้หน้าเว็บแสดงผล (เพื่อให้กรอบแดงตรงตำแหน่ง)
-            "original_image_url": final_image_url, 
-            "overall_diagnosis": overall_diagnosis,
-            "total_cells_segmented": len(valid_cells_data),
-            "vit_characteristics": analysis_results, 
-            "size_analysis": size_analysis_for_web, 
-            "amoeboid_count": amoeboid_count,
-            "summary": dict(counts),
-            "success": True
-        })
+        # Profile: ข้าม Cache (ต้องการเห็นเวลาของ Pipeline จริง) และกำหนด session_id ล่วงหน้าเพื่อเก็บไฟล์
+        session_id = str(uuid.uuid4()) if profile_mode else None
+        profile = None
+        if profile_mode:
+            profile = profiling.acquire(profile_mode, os.path.join(PROCESSED_FOLDER, session_id),
+                                        interval=config.PROFILING_INTERVAL_MS / 1000)
+            if profile is None: print("⚠️ Another request is being profiled, running without profiler")
+
+        with profile or nullcontext():
+            payload, status, cache_hit = _analyze_with_cache(file.read(), file.filename,
+                                                             device_profile=_device_profile(),
+                                                             viz=_viz_requested(), session_id=session_id,
+                                                             use_cache=profile is None)
+        headers = {'X-Cache': 'HIT' if cache_hit else 'MISS'}
+        if profile is not None:
+            payload = dict(payload, profile=profile.summary(session_id))
+            headers['X-Profile-Url'] = payload['profile']['files'].get('folded') or payload['profile']['files'].get('prof')
+        return _send_payload(payload, status, headers=headers)
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': str(e), 'success': False}), 500
 
+# Stream ผลลัพธ์ระหว่างวิเคราะห์ (Response เดียว ไม่ต้อง Poll):
+#   classification (จำนวนเซลล์ + bboxes ทั้งหมด) -> cell (ทีละเซลล์เมื่อได้ผล ResNet / YOLO)
+#   -> size_analysis -> done (ผลลัพธ์เต็ม: Size Analysis + Overall Diagnosis)
+# รูปแบบ: SSE (default) หรือ NDJSON (format=ndjson หรือ Accept: application/x-ndjson)
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_image_stream():
+    file, error = _get_upload()
+    if error: return error
+
+    job = jobs.submit(_run_job, file.read(), file.filename, _device_profile(), _viz_requested(), True)
+    if job is None:
+        return jsonify({'error': 'Job queue is full, try again later', 'success': False}), 503
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Job-Id': job.id}
+    fmt = (_request_option('format') or '').lower()
+    if fmt == 'ndjson' or 'application/x-ndjson' in (request.headers.get('Accept') or ''):
+        return Response(jobs.stream_ndjson(job), mimetype='application/x-ndjson', headers=headers)
+    return Response(jobs.stream_events(job), mimetype='text/event-stream', headers=headers)
+
+# ================== ASYNC JOB API ==================
+# POST /api/jobs              -> ส่งงาน ได้ job_id กลับทันที (202)
+# GET  /api/jobs/<id>         -> สถานะ / ขั้นตอน / ผลลัพธ์เมื่อเสร็จ
+# GET  /api/jobs/<id>/events  -> Server-Sent Events รายงานทุกขั้นตอนแบบ Real-time
+
+def _run_job(file_bytes, filename, device_profile, viz=True, stream_cells=False, on_stage=None):
+    if not models.wait_loaded(timeout=config.MODEL_WAIT_TIMEOUT):
+        return {'error': 'Models are not ready', 'success': False}, 503
+    # stream_cells: ส่งผลรายเซลล์เป็น Event 'cell' ทันทีที่ได้ผล (ใช้โดย /api/analyze/stream)
+    on_cell = (lambda entry: on_stage('cell', entry)) if stream_cells and on_stage is not None else None
+    payload, status, _ = _analyze_with_cache(file_bytes, filename, on_stage=on_stage, on_cell=on_cell,
+                                             device_profile=device_profile, viz=viz,
+                                             endpoint='stream' if stream_cells else 'job')
+    return payload, status
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    file, error = _get_upload()
+    if error: return error
+
+    job = jobs.submit(_run_job, file.read(), file.filename, _device_profile(), _viz_requested())
+    if job is None:
+        return jsonify({'error': 'Job queue is full, try again later', 'success': False}), 503
+
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"api/jobs/{job.id}",
+        "events_url": f"api/jobs/{job.id}/events"
+    }), 202
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None: return jsonify({'error': 'Job not found'}), 404
+    # ผลลัพธ์ของ Job อยู่ในหน่วยความจำจนหมด TTL -> ใช้ format=compact&offset=..&limit=.. แบ่งหน้าได้
+    return _send_payload(job.to_dict(), compact_key='result')
+
+@app.route('/api/jobs/<job_id>/events')
+def stream_job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None: return jsonify({'error': 'Job not found'}), 404
+    return Response(jobs.stream_events(job), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/calibration')
+def calibration_status():
+    if calibration is None: return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'profiles': calibration.status()})
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    if cache is None: return jsonify({'enabled': False})
+    return jsonify(dict(cache.stats(), enabled=True))
+
+@app.route('/api/retention')
+def retention_status():
+    if retention is None: return jsonify({'enabled': False})
+    return jsonify(dict(retention.stats(), enabled=True))
+
+@app.route('/api/retention/sweep', methods=['POST'])
+def retention_sweep():
+    if retention is None: return jsonify({'enabled': False}), 404
+    return jsonify(retention.sweep())
+
+@app.route('/api/viz/stats')
+def viz_stats():
+    return jsonify(dict(viz.stats(), mode=config.VIZ_MODE))
+
+@app.route('/api/profile/<session_id>/<kind>')
+def download_profile(session_id, kind):
+    """kind: folded (Flame Graph), prof (cProfile / snakeviz), txt (สรุป Top Functions)"""
+    if not _profile_allowed(): abort(404)
+    try: uuid.UUID(session_id)
+    except ValueError: abort(404)
+    path = profiling.profile_path(PROCESSED_FOLDER, session_id, kind)
+    if path is None: abort(404)
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), as_attachment=True,
+                               download_name=f"{session_id}_{os.path.basename(path)}",
+                               mimetype='text/plain' if kind != 'prof' else 'application/octet-stream')
+
+# ================== LIVE STREAM ==================
+# ส่งเฟรม: WebSocket /api/live/ws, POST /api/live/frame หรือ Socket ภายในเครื่อง (config.LIVE_SOCKET_PORT)
+# อ่านผล:  GET /api/live/latest, GET /api/live/events (SSE ทุกครั้งที่วิเคราะห์เฟรมเสร็จ)
+
+def _live_disabled():
+    return jsonify({'error': 'Live mode is disabled', 'success': False}), 404
+
+@app.route('/api/live/frame', methods=['POST'])
+def live_frame():
+    if live is None: return _live_disabled()
+    # เฟรมแบบ base64 / Data URL ใหญ่กว่าภาพจริง ~4/3 เท่า (+ Header ของ Form) ตรวจก่อนอ่าน Body
+    if (request.content_length or 0) > config.LIVE_MAX_FRAME_BYTES * 4 // 3 + 64 * 1024:
+        return jsonify({'error': 'Frame too large', 'success': False}), 413
+    file = request.files.get('file')
+    data = file.read() if file is not None else (request.form.get('frame') or request.get_data())
+    frame_id = live.submit(data, source='http')
+    if frame_id is None:
+        return jsonify({'error': 'Invalid or too large frame', 'success': False}), 400
+    # 202: รับเฟรมแล้ว (อาจถูกแทนที่ด้วยเฟรมใหม่กว่าก่อนได้วิเคราะห์)
+    return jsonify({'frame_id': frame_id, 'busy': live.busy}), 202
+
+@app.route('/api/live/latest')
+def live_latest():
+    if live is None: return _live_disabled()
+    latest = live.latest()
+    if latest is None: return '', 204
+    return jsonify(latest)
+
+@app.route('/api/live/events')
+def live_events():
+    if live is None: return _live_disabled()
+    stream = live.stream_events(max_seconds=config.LIVE_EVENTS_MAX_SECONDS,
+                                idle_seconds=config.LIVE_EVENTS_IDLE_SECONDS)
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/live/stats')
+def live_stats():
+    if live is None: return _live_disabled()
+    return jsonify(live.stats())
+
+if live is not None and Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/api/live/ws')
+    def live_websocket(ws):
+        """รับเฟรม (binary หรือ Data URL) แล้วส่งผลล่าสุดกลับใน Connection เดียวกันเมื่อมีผลใหม่"""
+        sent = 0
+        while True:
+            data = ws.receive(timeout=1.0)
+            if data is not None:
+                live.submit(data, source='websocket')
+            latest = live.latest()
+            if latest is not None and latest['version'] > sent:
+                ws.send(json.dumps(latest))
+                sent = latest['version']
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus Text Format (ค่าของ Worker ที่ตอบ Request นี้ ดู malariax_process_info)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    app.run(debug=True, port=5001, threaded=True)
\ No newline at end of file
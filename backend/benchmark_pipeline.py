@@ -0,0 +1,277 @@
+"""
+Benchmark ของ Pipeline แยกตามขั้นตอน บนชุด Fixture คงที่ (fixtures/fields + ภาพสังเคราะห์)
+รายงาน Latency (ms ต่อรอบ / ต่อชิ้น), Throughput และ Peak Memory (tracemalloc) ของแต่ละขั้นตอน
+แล้วเทียบกับเกณฑ์ใน fixtures/benchmark_thresholds.json -> exit 1 ถ้าช้าลง/ใช้ Memory เกินเกณฑ์
+
+    python benchmark_pipeline.py                       # รันทุกขั้นตอน
+    python benchmark_pipeline.py --stages removebg,marginal_ratio --repeats 5
+    python benchmark_pipeline.py --update-baseline     # บันทึกผลรอบนี้เป็น Baseline ใหม่
+
+ขั้นตอนที่ต้องใช้โมเดล (segmentation / classification / yolo) จะถูกข้ามถ้าโหลดโมเดลไม่ได้
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import config
+from algoritum import removebg
+from algoritum.diastant import calculate_marginal_ratio, calculate_marginal_ratios
+from algoritum.findsize import process_folder_sizes
+
+try:
+    import resource  # Unix เท่านั้น (Peak RSS รวม Memory ของ Torch / OpenCV ที่ tracemalloc มองไม่เห็น)
+except ImportError:
+    resource = None
+
+FIXTURE_FIELDS = os.path.join(config.BASE_DIR, 'fixtures', 'fields')
+THRESHOLDS_FILE = os.path.join(config.BASE_DIR, 'fixtures', 'benchmark_thresholds.json')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+STAGES = ['removebg', 'segmentation', 'filtering', 'classification', 'yolo', 'marginal_ratio',
+          'marginal_ratio_batch', 'folder_sizes']
+
+# ================== FIXTURES ==================
+
+def synthetic_field(seed, size=768, n_cells=40):
+    """
+    ภาพสนามกล้องจุลทรรศน์สังเคราะห์ (กำหนด seed -> ได้ภาพเดิมทุกครั้ง)
+    พื้นดำรอบวงกลมกล้อง + พื้นชมพู + RBC วงรี บางเซลล์มีจุด Chromatin สีเข้ม
+    """
+    rng = np.random.default_rng(seed)
+    img = np.zeros((size, size, 3), dtype=np.uint8)
+    cv2.circle(img, (size // 2, size // 2), int(size * 0.48), (225, 215, 235), -1)
+
+    for _ in range(n_cells):
+        cx, cy = rng.integers(int(size * 0.25), int(size * 0.75), size=2)
+        axes = (int(rng.integers(22, 32)), int(rng.integers(22, 32)))
+        color = tuple(int(v) for v in rng.integers(150, 190, size=3))
+        cv2.ellipse(img, (int(cx), int(cy)), axes, float(rng.integers(0, 180)), 0, 360, color, -1)
+        if rng.random() < 0.3:
+            dx, dy = rng.integers(-12, 12, size=2)
+            cv2.circle(img, (int(cx + dx), int(cy + dy)), 4, (90, 40, 110), -1)
+
+    noise = rng.normal(0, 4, img.shape)
+    return np.clip(img.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+def load_fields(n_synthetic=4):
+    """ภาพจาก fixtures/fields (crop ที่เคยเก็บไว้) + ภาพสังเคราะห์ คืนค่า list ของ (ชื่อ, BGR)"""
+    fields = []
+    if os.path.isdir(FIXTURE_FIELDS):
+        for name in sorted(os.listdir(FIXTURE_FIELDS)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS): continue
+            img = cv2.imread(os.path.join(FIXTURE_FIELDS, name))
+            if img is not None: fields.append((name, img))
+    fields += [(f"synthetic_{i}.png", synthetic_field(i)) for i in range(n_synthetic)]
+    return fields
+
+# ================== MEASUREMENT ==================
+
+def _peak_rss_mb():
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def measure(stage, fn, n_items, repeats):
+    """รัน fn() ซ้ำ repeats รอบ (+ Warm-up 1 รอบ) คืนค่าสถิติของขั้นตอน"""
+    fn()  # warm-up (Lazy Init / Cache ของ OpenCV และ Torch)
+    timings = []
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mean = sum(timings) / len(timings)
+    return {
+        "stage": stage,
+        "items": n_items,
+        "ms_per_run": round(mean * 1000, 2),
+        "ms_per_item": round(mean * 1000 / max(1, n_items), 3),
+        "items_per_second": round(n_items / mean, 1) if mean > 0 else 0.0,
+        "peak_mb": round(peak / (1024 * 1024), 2),
+        "peak_rss_mb": _peak_rss_mb()
+    }
+
+# ================== THRESHOLDS ==================
+
+def load_thresholds(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"tolerance": 0.25, "stages": {}}
+
+def check(results, thresholds):
+    """
+    เกณฑ์ต่อขั้นตอน (ใส่เฉพาะที่ต้องการ):
+      max_ms_per_item / max_peak_mb: เพดานตายตัว
+      baseline_ms_per_item: ผลที่บันทึกไว้ -> ล้มเหลวถ้าช้ากว่า baseline * (1 + tolerance)
+    """
+    tolerance = thresholds.get('tolerance', 0.25)
+    failures = []
+    for r in results:
+        limits = thresholds.get('stages', {}).get(r['stage'], {})
+        if 'max_ms_per_item' in limits and r['ms_per_item'] > limits['max_ms_per_item']:
+            failures.append(f"{r['stage']}: {r['ms_per_item']} ms/item > max {limits['max_ms_per_item']}")
+        if 'max_peak_mb' in limits and r['peak_mb'] > limits['max_peak_mb']:
+            failures.append(f"{r['stage']}: peak {r['peak_mb']} MB > max {limits['max_peak_mb']}")
+        baseline = limits.get('baseline_ms_per_item')
+        if baseline and r['ms_per_item'] > baseline * (1 + tolerance):
+            failures.append(f"{r['stage']}: {r['ms_per_item']} ms/item > baseline {baseline} (+{tolerance:.0%})")
+    return failures
+
+def update_baseline(results, thresholds, path):
+    stages = thresholds.setdefault('stages', {})
+    for r in results:
+        stages.setdefault(r['stage'], {})['baseline_ms_per_item'] = r['ms_per_item']
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(thresholds, f, indent=2)
+    print(f"💾 Baseline updated: {path}")
+
+# ================== STAGES ==================
+
+def run_benchmarks(stages, repeats, n_synthetic, workdir):
+    fields = load_fields(n_synthetic)
+    print(f"📊 {len(fields)} fields ({n_synthetic} synthetic), {repeats} repeats, workdir {workdir}")
+    results = []
+
+    def add(stage, fn, n_items):
+        if stage not in stages: return
+        print(f"⏱️  {stage} ({n_items} items)...")
+        results.append(measure(stage, fn, n_items, repeats))
+
+    # 1. Remove Background / Crop Square
+    add('removebg', lambda: [removebg.process_image(img) for _, img in fields], len(fields))
+    cropped = []
+    for _, img in fields:
+        try: cropped.append(removebg.process_image(img))
+        except Exception: cropped.append(img)
+
+    # 2-3. Segmentation (Cellpose) + Filtering
+    from cellpose_segmenter import (get_cellpose_model, segment_and_save_cells, run_cellpose,
+                                    compute_label_stats, filter_bad_cells, extract_cells)
+    crops = []
+    if {'segmentation', 'filtering', 'classification', 'yolo', 'marginal_ratio',
+            'marginal_ratio_batch', 'folder_sizes'} & set(stages):
+        if get_cellpose_model() is None:
+            print("⏭️  Cellpose not available: skipping segmentation-based stages")
+        else:
+            field_paths = []
+            for i, img in enumerate(cropped):
+                path = os.path.join(workdir, f"field_{i}.png")
+                cv2.imwrite(path, img)
+                field_paths.append(path)
+            add('segmentation', lambda: [segment_and_save_cells(p) for p in field_paths], len(field_paths))
+
+            all_stats = []
+            for img in cropped:
+                masks, _ = run_cellpose(img)
+                if masks is None: continue
+                stats = [s for s in compute_label_stats(masks) if not s['touches_border']]
+                all_stats.append(stats)
+                crops += [c.crop for c in extract_cells(img, masks, filter_bad_cells(stats))]
+            add('filtering', lambda: [filter_bad_cells(s) for s in all_stats], sum(len(s) for s in all_stats))
+
+    if not crops:
+        return results
+
+    # 4. ResNet Classification
+    labels = ['nomal_cell'] * len(crops)
+    if 'classification' in stages or 'folder_sizes' in stages:
+        from image_processor import apply_circular_mask
+        from model_loader import load_resnet_model, predict_batch
+        model, device = load_resnet_model(config.MODEL_PATH, num_classes=len(config.CLASS_NAMES))
+        if model is None:
+            print("⏭️  ResNet not available: skipping classification")
+        else:
+            masked = [apply_circular_mask(c) for c in crops]
+            add('classification', lambda: predict_batch(model, device, masked, batch_size=config.RESNET_BATCH_SIZE),
+                len(crops))
+            labels = [label for label, _ in predict_batch(model, device, masked, batch_size=config.RESNET_BATCH_SIZE)]
+
+    # 5. YOLO Chromatin Counting
+    if 'yolo' in stages:
+        from algoritum.yolo_counter import load_yolo_model, count_chromatin_batch
+        yolo = load_yolo_model(config.YOLO_PATH)
+        if yolo is None:
+            print("⏭️  YOLO not available: skipping yolo")
+        else:
+            add('yolo', lambda: count_chromatin_batch(yolo, crops, batch_size=config.YOLO_BATCH_SIZE), len(crops))
+
+    # 6. Marginal Ratio (ทีละเซลล์ / ทั้ง Batch)
+    add('marginal_ratio', lambda: [calculate_marginal_ratio(c) for c in crops], len(crops))
+    add('marginal_ratio_batch', lambda: calculate_marginal_ratios(crops), len(crops))
+
+    # 7. Size Analysis จากโฟลเดอร์ (ถ้าไม่มีผล ResNet: แบ่งครึ่งเป็น Baseline / Target)
+    if 'folder_sizes' in stages:
+        if all(label == 'nomal_cell' for label in labels):
+            labels = ['nomal_cell' if i % 2 == 0 else '1chromatin' for i in range(len(crops))]
+        case_dir = os.path.join(workdir, 'case')
+        for i, (crop, label) in enumerate(zip(crops, labels)):
+            os.makedirs(os.path.join(case_dir, label), exist_ok=True)
+            cv2.imwrite(os.path.join(case_dir, label, f"cell_crop_{i}.png"), crop)
+        add('folder_sizes', lambda: process_folder_sizes(case_dir), len(crops))
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage pipeline benchmark")
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"คั่นด้วย , จาก {STAGES}")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--synthetic', type=int, default=4, help="จำนวนภาพสังเคราะห์ที่เพิ่มเข้าชุด Fixture")
+    parser.add_argument('--thresholds', default=THRESHOLDS_FILE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--json', help="บันทึกผลเป็น JSON")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {sorted(unknown)}")
+
+    # segment_and_save_cells / process_folder_sizes เขียนไฟล์ลง Working Directory -> แยกไว้ใน temp
+    workdir = tempfile.mkdtemp(prefix='malariax_bench_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = run_benchmarks(stages, max(1, args.repeats), args.synthetic, workdir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    header = f"{'stage':<22}{'items':>7}{'ms/run':>11}{'ms/item':>10}{'items/s':>10}{'peak MB':>9}{'RSS MB':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['stage']:<22}{r['items']:>7}{r['ms_per_run']:>11}{r['ms_per_item']:>10}"
+              f"{r['items_per_second']:>10}{r['peak_mb']:>9}{str(r['peak_rss_mb']):>9}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"results": results}, f, indent=2)
+
+    thresholds = load_thresholds(args.thresholds)
+    if args.update_baseline:
+        update_baseline(results, thresholds, args.thresholds)
+        return 0
+
+    failures = check(results, thresholds)
+    if failures:
+        print("❌ Performance regression:")
+        for failure in failures: print(f"   - {failure}")
+        return 1
+    print("✅ All stages within thresholds")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
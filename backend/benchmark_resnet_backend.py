@@ -0,0 +1,151 @@
+"""
+เปรียบเทียบ Backend ของ ResNet (eager / TorchScript / ONNX, INT8, channels_last) กับโมเดล FP32 ต้นฉบับ
+รายงาน Latency ต่อ Batch / ต่อเซลล์, Throughput และอัตราที่ผลทำนาย (Top-1) ตรงกับ FP32
+
+    python benchmark_resnet_backend.py                        # ใช้ crop จาก fixtures/cells หรือ segment fixtures/fields
+    python benchmark_resnet_backend.py --crops path/to/crops --min-agreement 0.99 --json report.json
+
+ใช้ผลนี้ก่อนเปลี่ยน MALARIAX_RESNET_BACKEND / MALARIAX_RESNET_QUANTIZE บน Production
+"""
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import torch
+
+import config
+from image_processor import apply_circular_mask
+from inference_backend import build_resnet_backend
+from model_loader import RESNET_TRANSFORM, load_resnet_model
+from result_cache import build_version
+
+FIXTURE_CROPS = os.path.join(config.BASE_DIR, 'fixtures', 'cells')
+FIXTURE_FIELDS = os.path.join(config.BASE_DIR, 'fixtures', 'fields')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# (backend, quantize, channels_last)
+CANDIDATES = [
+    ('eager', False, True),
+    ('eager', True, False),
+    ('torchscript', False, False),
+    ('torchscript', False, True),
+    ('torchscript', True, False),
+    ('onnx', False, False),
+    ('onnx', True, False),
+]
+
+def _list_images(folder):
+    if not os.path.isdir(folder): return []
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+def load_reference_crops(crops_dir=None, limit=256):
+    """ชุด crop อ้างอิง: จากโฟลเดอร์ที่ระบุ / fixtures/cells หรือ segment ภาพใน fixtures/fields ด้วย Cellpose"""
+    paths = _list_images(crops_dir or FIXTURE_CROPS)
+    if paths:
+        crops = [cv2.imread(p) for p in paths[:limit]]
+        return [c for c in crops if c is not None]
+
+    from cellpose_segmenter import segment_cells
+    print(f"🔬 No reference crops, segmenting fields in {FIXTURE_FIELDS}...")
+    crops = []
+    for path in _list_images(FIXTURE_FIELDS):
+        img = cv2.imread(path)
+        if img is None: continue
+        crops += [cell.crop for cell in segment_cells(img)]
+        if len(crops) >= limit: break
+    return crops[:limit]
+
+def _batches(tensor, batch_size):
+    return [tensor[i:i + batch_size] for i in range(0, len(tensor), batch_size)]
+
+def _run(model, inputs, batch_size, repeats):
+    """คืนค่า (probs ของทุกภาพ, list ของเวลาต่อ Batch เป็นวินาที)"""
+    batches = _batches(inputs, batch_size)
+    with torch.no_grad():
+        model(batches[0])  # warm-up
+        timings, outputs = [], []
+        for r in range(repeats):
+            for batch in batches:
+                started = time.perf_counter()
+                logits = model(batch)
+                timings.append(time.perf_counter() - started)
+                if r == 0: outputs.append(torch.softmax(logits.float(), dim=1))
+    return torch.cat(outputs), timings
+
+def _summary(name, probs, timings, reference, n_cells, repeats):
+    total = sum(timings)
+    agreement = (probs.argmax(1) == reference.argmax(1)).float().mean().item()
+    return {
+        "backend": name,
+        "batch_ms_p50": round(statistics.median(timings) * 1000, 2),
+        "batch_ms_p95": round(sorted(timings)[int(0.95 * (len(timings) - 1))] * 1000, 2),
+        "cell_ms": round(total / (n_cells * repeats) * 1000, 3),
+        "cells_per_second": round(n_cells * repeats / total, 1) if total > 0 else 0.0,
+        "agreement": round(agreement, 4),
+        "max_prob_diff": round((probs - reference).abs().max().item(), 5)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ResNet inference backend benchmark")
+    parser.add_argument('--crops', help="โฟลเดอร์ crop อ้างอิง (default: fixtures/cells)")
+    parser.add_argument('--limit', type=int, default=256, help="จำนวน crop สูงสุด")
+    parser.add_argument('--batch-size', type=int, default=config.RESNET_BATCH_SIZE)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=config.TORCH_THREADS)
+    parser.add_argument('--min-agreement', type=float, default=None, help="exit 1 ถ้า Backend ใดตรงกับ FP32 น้อยกว่านี้")
+    parser.add_argument('--json', help="บันทึกผลเป็น JSON")
+    args = parser.parse_args(argv)
+
+    if args.threads: torch.set_num_threads(args.threads)
+    fp32, device = load_resnet_model(config.MODEL_PATH, num_classes=len(config.CLASS_NAMES))
+    if fp32 is None: return 2
+
+    crops = load_reference_crops(args.crops, args.limit)
+    if not crops:
+        print("❌ No reference crops found")
+        return 2
+    inputs = torch.stack([RESNET_TRANSFORM(apply_circular_mask(c)) for c in crops]).to(device)
+    print(f"📊 {len(crops)} reference crops, batch size {args.batch_size}, {args.repeats} repeats")
+
+    reference, timings = _run(fp32, inputs, args.batch_size, args.repeats)
+    results = [_summary('eager (fp32)', reference, timings, reference, len(crops), args.repeats)]
+
+    export_dir = tempfile.mkdtemp(prefix='resnet_export_')
+    for backend, quantize, channels_last in CANDIDATES:
+        model, name = build_resnet_backend(copy.deepcopy(fp32), device, backend=backend, quantize=quantize,
+                                           channels_last=channels_last, export_dir=export_dir,
+                                           model_version=build_version(files=(config.MODEL_PATH,)),
+                                           threads=args.threads)
+        requested = backend + ('+int8' if quantize else '') + ('+channels_last' if channels_last else '')
+        if name != requested:
+            print(f"⏭️  {requested}: not available here (fell back to {name})")
+            continue
+        probs, timings = _run(model, inputs, args.batch_size, args.repeats)
+        results.append(_summary(name, probs, timings, reference, len(crops), args.repeats))
+
+    header = f"{'backend':<32}{'p50 ms':>10}{'p95 ms':>10}{'ms/cell':>10}{'cells/s':>10}{'agree':>9}{'max Δp':>10}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['backend']:<32}{r['batch_ms_p50']:>10}{r['batch_ms_p95']:>10}{r['cell_ms']:>10}"
+              f"{r['cells_per_second']:>10}{r['agreement']:>9}{r['max_prob_diff']:>10}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"cells": len(crops), "batch_size": args.batch_size, "results": results}, f, indent=2)
+
+    if args.min_agreement is not None:
+        failing = [r['backend'] for r in results if r['agreement'] < args.min_agreement]
+        if failing:
+            print(f"❌ Below agreement {args.min_agreement}: {failing}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
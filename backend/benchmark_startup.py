@@ -0,0 +1,86 @@
+"""
+วัดเวลา Start ของ Backend: import app จนตอบ /api/health/live ได้ + Module ที่ใช้เวลา import มากที่สุด
+
+    python benchmark_startup.py                    # รัน 3 รอบ รายงานค่ากลาง
+    python benchmark_startup.py --max-seconds 1.0  # exit 1 ถ้าช้ากว่านี้ (ใช้ใน CI)
+
+แต่ละรอบรันใน Process ใหม่ (python -X importtime) ไม่โหลดโมเดล (MALARIAX_MODELS_AUTOLOAD=0)
+เพื่อวัดเฉพาะส่วนที่บล็อกการ Start ของ Flask
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+import config
+
+# รันใน Child Process: เวลาเริ่มนับก่อน import app แล้วเรียก Health Check ผ่าน test_client
+CHILD_SCRIPT = r"""
+import json, sys, time
+started = time.perf_counter()
+import app
+response = app.app.test_client().get('/api/health/live')
+print("STARTUP_RESULT " + json.dumps({
+    "import_seconds": app.STARTUP_SECONDS,
+    "health_seconds": round(time.perf_counter() - started, 3),
+    "status": response.status_code,
+    "heavy_modules": sorted(m for m in ('torch', 'torchvision', 'cellpose', 'ultralytics') if m in sys.modules)
+}))
+"""
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (.*)$')
+
+def _run_once():
+    env = dict(os.environ, MALARIAX_MODELS_AUTOLOAD='0', MALARIAX_PRELOAD_MODELS='0',
+               MALARIAX_RETENTION_ENABLED='0')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT], cwd=config.BASE_DIR,
+                          env=env, capture_output=True, text=True)
+    result = None
+    for line in proc.stdout.splitlines():
+        if line.startswith('STARTUP_RESULT '):
+            result = json.loads(line[len('STARTUP_RESULT '):])
+    if result is None:
+        raise RuntimeError(f"Startup failed (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+
+    # import time: self [us] | cumulative [us] | module (Top-level = ไม่มีช่องว่างนำหน้า)
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and not match.group(3).startswith(' '):
+            cumulative[match.group(3).strip()] = int(match.group(2)) / 1e6
+    result["top_imports"] = sorted(cumulative.items(), key=lambda kv: kv[1], reverse=True)[:15]
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backend startup benchmark")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--max-seconds', type=float, default=None, help="exit 1 ถ้าเวลาถึง Health Check เกินค่านี้")
+    parser.add_argument('--json', help="บันทึกผลเป็น JSON")
+    args = parser.parse_args(argv)
+
+    runs = [_run_once() for _ in range(max(1, args.repeats))]
+    health = statistics.median(r["health_seconds"] for r in runs)
+    imported = statistics.median(r["import_seconds"] for r in runs)
+    last = runs[-1]
+
+    print(f"⏱️ import app: {imported:.3f}s, first /api/health/live: {health:.3f}s (median of {len(runs)})")
+    if last["heavy_modules"]:
+        print(f"⚠️ Heavy modules imported at startup: {last['heavy_modules']}")
+    print(f"{'top-level import':<40}{'cumulative s':>14}")
+    for name, seconds in last["top_imports"]:
+        print(f"{name:<40}{seconds:>14.3f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"import_seconds": imported, "health_seconds": health, "runs": runs}, f, indent=2)
+
+    if args.max_seconds is not None and health > args.max_seconds:
+        print(f"❌ Startup {health:.3f}s exceeds {args.max_seconds}s")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl  # ล็อกไฟล์ข้าม Process (gunicorn Worker) ไม่มีบน Windows -> ล็อกเฉพาะใน Process
+except ImportError:
+    fcntl = None
+
+DEFAULT_PROFILE = 'default'
+
+class DiameterCalibration:
+    """
+    เก็บค่า Diameter ของเซลล์ที่ Cellpose ประมาณได้ แยกตามกล้อง/อุปกรณ์ (Device Profile)
+    กล้องจุลทรรศน์ + กำลังขยายเดิม ขนาด RBC แทบไม่เปลี่ยน จึงไม่ต้องรัน Size Model ทุกภาพ
+
+    - ช่วงเรียนรู้: ยังไม่มีค่าที่นิ่ง -> คืน None (ให้ Cellpose ประมาณเอง) แล้วเก็บค่าที่ได้
+    - นิ่งแล้ว (ตัวอย่าง >= min_samples และค่ากระจาย < tolerance): ใช้ Median ของตัวอย่างล่าสุด
+    - ทุกๆ reestimate_every Request จะให้ประมาณใหม่ 1 ครั้ง ถ้าต่างจากค่าเดิมเกิน drift_tolerance
+      (เช่นเปลี่ยนเลนส์/กล้อง) จะล้างค่าแล้วเริ่มเรียนรู้ใหม่
+    - Profile จำกัดด้วย allowed_profiles (None = ทุกชื่อ) และจำนวนไม่เกิน max_profiles
+      ชื่อที่ไม่อยู่ในรายการ / เกินจำนวนใช้ Profile 'default' แทน (ไฟล์ไม่โตตาม device_id ที่ Client ส่งมา)
+    - บันทึกไฟล์ภายใต้ File Lock: อ่านไฟล์ล่าสุดแล้ว Merge ก่อนเขียน (Worker อื่นไม่ทับค่าของกันและกัน)
+    """
+
+    def __init__(self, path, min_samples=5, window=20, tolerance=0.08,
+                 reestimate_every=25, drift_tolerance=0.15, allowed_profiles=None, max_profiles=32):
+        self.path = path
+        self.min_samples = min_samples
+        self.window = window
+        self.tolerance = tolerance
+        self.reestimate_every = reestimate_every
+        self.drift_tolerance = drift_tolerance
+        self.allowed_profiles = {self.normalize_profile(p) for p in allowed_profiles} if allowed_profiles else None
+        self.max_profiles = max(1, max_profiles)
+        self._lock = threading.Lock()
+        self._profiles = self._load()
+
+    @staticmethod
+    def normalize_profile(profile):
+        """ชื่อ Profile ใช้ได้เฉพาะตัวอักษร/ตัวเลข/._- (ยาวไม่เกิน 64) ไม่งั้นใช้ 'default'"""
+        profile = re.sub(r'[^A-Za-z0-9._-]', '', str(profile or ''))[:64]
+        return profile or 'default'
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _accepts(self, name, profiles):
+        """สร้าง Profile ชื่อนี้เพิ่มใน profiles ได้ไหม (อยู่ใน Allow-list และยังไม่เกิน max_profiles)"""
+        if name in profiles or name == DEFAULT_PROFILE: return True
+        if self.allowed_profiles is not None and name not in self.allowed_profiles: return False
+        return len([p for p in profiles if p != DEFAULT_PROFILE]) < self.max_profiles
+
+    def _save(self, profile):
+        """อ่านไฟล์ล่าสุดภายใต้ Lock แล้ว Merge: Profile ที่เพิ่งบันทึกใช้ค่าของเรา ที่เหลือใช้ค่าที่ updated_at ใหม่กว่า"""
+        folder = os.path.dirname(self.path)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            if folder: os.makedirs(folder, exist_ok=True)
+            with self._file_lock():
+                for name, theirs in self._load().items():
+                    mine = self._profiles.get(name)
+                    if name == profile or not isinstance(theirs, dict): continue
+                    if mine is None:
+                        if self._accepts(name, self._profiles): self._profiles[name] = theirs
+                    elif (theirs.get("updated_at") or 0) > (mine.get("updated_at") or 0):
+                        self._profiles[name] = theirs
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._profiles, f, indent=2)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Cannot save calibration: {e}")
+
+    def _resolve(self, profile):
+        """ชื่อ Profile ที่ใช้จริง (ไม่อยู่ใน Allow-list หรือเกินจำนวน -> 'default')"""
+        profile = self.normalize_profile(profile)
+        return profile if self._accepts(profile, self._profiles) else DEFAULT_PROFILE
+
+    def _profile(self, profile):
+        return self._profiles.setdefault(profile, {
+            "samples": [], "diameter": None, "requests": 0, "updated_at": None
+        })
+
+    def diameter_for(self, profile):
+        """คืนค่า Diameter ที่ Calibrate แล้ว หรือ None ถ้าต้องให้ Cellpose ประมาณเอง (เรียนรู้ / ตรวจ Drift)"""
+        with self._lock:
+            prof = self._profile(self._resolve(profile))
+            prof["requests"] += 1
+            if prof["diameter"] is None: return None
+            if self.reestimate_every and prof["requests"] % self.reestimate_every == 0:
+                return None
+            return prof["diameter"]
+
+    def record(self, profile, estimated_diameter):
+        """บันทึกค่าที่ Cellpose ประมาณได้ แล้วอัปเดตค่าที่นิ่ง"""
+        if not estimated_diameter or estimated_diameter <= 0: return
+        with self._lock:
+            profile = self._resolve(profile)
+            prof = self._profile(profile)
+            current = prof["diameter"]
+
+            if current and abs(estimated_diameter - current) / current > self.drift_tolerance:
+                print(f"📐 Calibration drift on '{profile}': {current:.1f} -> {estimated_diameter:.1f} px (re-learning)")
+                prof["samples"] = []
+                prof["diameter"] = None
+
+            prof["samples"] = (prof["samples"] + [round(float(estimated_diameter), 2)])[-self.window:]
+            samples = np.array(prof["samples"])
+            median = float(np.median(samples))
+            spread = float(samples.std() / median) if median > 0 else 1.0
+
+            if len(samples) >= self.min_samples and spread < self.tolerance:
+                if prof["diameter"] is None:
+                    print(f"📐 Calibration converged on '{profile}': {median:.1f} px")
+                prof["diameter"] = round(median, 2)
+
+            prof["updated_at"] = time.time()
+            self._save(profile)
+
+    def status(self):
+        with self._lock:
+            return {name: {"diameter": p["diameter"], "samples": len(p["samples"]), "requests": p["requests"]}
+                    for name, p in self._profiles.items()}
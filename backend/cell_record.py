@@ -0,0 +1,116 @@
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+import cv2
+import numpy as np
+
+# Atlas: รวม crop ทุกเซลล์ของ Session เป็นภาพเดียว + ตำแหน่งของแต่ละเซลล์ (segmented_cells/<session>/)
+ATLAS_IMAGE = 'atlas.png'
+ATLAS_INDEX = 'atlas.json'
+
+@dataclass
+class CellRecord:
+    """
+    ข้อมูลของเซลล์ 1 เซลล์ที่ส่งต่อกันทุกขั้นตอนของ Pipeline ในหน่วยความจำ
+    (Segmentation -> Filter -> ResNet -> YOLO -> Size/Shape)
+    การบันทึกลง Disk เป็นขั้นตอนแยก (ดู save_cells) ไม่ใช่ส่วนหนึ่งของการวิเคราะห์
+    """
+    id: int
+    crop: np.ndarray            # ภาพเซลล์แบบ Cookie Cutter (BGR)
+    mask: np.ndarray            # Mask ของ Cellpose เฉพาะเซลล์นี้ (uint8 0/1 ขนาดเท่า crop)
+    bbox: dict                  # {"x", "y", "w", "h"} พิกัดในภาพเต็ม
+    origin: tuple = (0, 0)      # (x, y) มุมซ้ายบนของ crop ในภาพเต็ม
+    label: str = "Unknown"
+    confidence: float = 0.0
+    file_path: str = None       # มีค่าเมื่อถูกบันทึกลง Disk แล้วเท่านั้น
+    features: object = None     # CellFeatures (algoritum/cellfeatures.py) คำนวณครั้งเดียวใช้ทุกขั้นตอน
+    mask_features: object = None  # MaskFeatures จาก Label Mask ของ Cellpose (ขนาด/รูปร่าง)
+
+    @property
+    def filename(self):
+        return f"cell_crop_{self.id}.png"
+
+# ================== DISK SINK (Optional) ==================
+
+def save_cells(cells, output_dir):
+    """บันทึก crop ของทุกเซลล์ลงโฟลเดอร์ (เช่น segmented_cells/<session>) แล้วจำ path ไว้ใน record"""
+    os.makedirs(output_dir, exist_ok=True)
+    for cell in cells:
+        output_path = os.path.join(output_dir, cell.filename)
+        cv2.imwrite(output_path, cell.crop)
+        cell.file_path = output_path
+    return cells
+
+def save_sorted_cells(cells, sorted_base_dir):
+    """บันทึกสำเนาแยกตามผล Classification (sorted_by_morphology/<label>/) สำหรับเก็บ Dataset"""
+    for cell in cells:
+        label_dir = os.path.join(sorted_base_dir, cell.label)
+        os.makedirs(label_dir, exist_ok=True)
+        cv2.imwrite(os.path.join(label_dir, cell.filename), cell.crop)
+    return cells
+
+def pack_atlas(cells, padding=2):
+    """
+    วาง crop ทุกเซลล์ลงภาพเดียวแบบ Shelf Packing (เรียงจากสูงไปต่ำ เติมทีละแถว)
+    คืนค่า: (ภาพ Atlas BGR, {filename: [x, y, w, h]})
+    """
+    if not cells: return None, {}
+    sizes = [(c.crop.shape[1], c.crop.shape[0]) for c in cells]
+    total_area = sum((w + padding) * (h + padding) for w, h in sizes)
+    atlas_width = max(max(w for w, _ in sizes) + padding, int(np.sqrt(total_area) * 1.2))
+
+    order = sorted(range(len(cells)), key=lambda i: sizes[i][1], reverse=True)
+    rects = {}
+    x, y, row_height = 0, 0, 0
+    for i in order:
+        w, h = sizes[i]
+        if x + w > atlas_width:
+            x, y, row_height = 0, y + row_height + padding, 0
+        rects[i] = (x, y, w, h)
+        x += w + padding
+        row_height = max(row_height, h)
+
+    atlas = np.full((y + row_height, atlas_width, 3), 255, dtype=np.uint8)
+    index = {}
+    for i, (x, y, w, h) in rects.items():
+        atlas[y:y + h, x:x + w] = cells[i].crop
+        index[cells[i].filename] = [x, y, w, h]
+    return atlas, index
+
+def save_atlas(cells, output_dir):
+    """บันทึก Atlas (Encode ครั้งเดียว) + Index แทนการเขียนไฟล์ทีละเซลล์ คืนค่า (index, ขนาด (w, h))"""
+    atlas, index = pack_atlas(cells)
+    if atlas is None: return {}, (0, 0)
+    os.makedirs(output_dir, exist_ok=True)
+    cv2.imwrite(os.path.join(output_dir, ATLAS_IMAGE), atlas)
+    with open(os.path.join(output_dir, ATLAS_INDEX), 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    return index, (atlas.shape[1], atlas.shape[0])
+
+def _atlas_index(output_dir):
+    try:
+        with open(os.path.join(output_dir, ATLAS_INDEX), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@lru_cache(maxsize=8)
+def _read_atlas(path, mtime):
+    return cv2.imread(path)
+
+def atlas_contains(output_dir, filename):
+    return filename in _atlas_index(output_dir)
+
+def load_atlas_crop(output_dir, filename):
+    """ตัด crop ของเซลล์ 1 เซลล์ออกจาก Atlas (สำหรับ URL แบบเดิม cells/<session>/cell_crop_N.png)"""
+    rect = _atlas_index(output_dir).get(filename)
+    if rect is None: return None
+    path = os.path.join(output_dir, ATLAS_IMAGE)
+    try:
+        atlas = _read_atlas(path, os.path.getmtime(path))
+    except OSError:
+        return None
+    if atlas is None: return None
+    x, y, w, h = rect
+    return atlas[y:y + h, x:x + w]
@@ -1,11 +1,21 @@
 import cv2
 import numpy as np
 import os
+import threading
 import uuid
 from cellpose import models
+from scipy import ndimage
 import traceback 
+import config
+import metrics
+from cell_record import CellRecord, save_cells
+from algoritum.cellfeatures import features_from_labels
 
 cell_model = None
+# model.eval ของ Cellpose instance เดียวกันไม่ Thread-safe (ใช้ Network / Buffer ร่วมกัน)
+# -> ทั้ง Process มี Model เดียว จึงเรียกทีละครั้ง (Request ที่มาพร้อมกันรอคิวกันตรงนี้
+#    ส่วน Torch ใช้หลาย Core ภายใน eval แต่ละครั้งอยู่แล้ว)
+_eval_lock = threading.Lock()
 
 def get_cellpose_model():
     global cell_model
@@ -18,149 +28,331 @@ def get_cellpose_model():
             cell_model = None
     return cell_model
 
+def warm_up_cellpose(model):
+    """
+    รัน Cellpose กับภาพสังเคราะห์ (เซลล์กลมๆ บนพื้นชมพู) 1 ครั้ง
+    ใช้ diameter=None เพื่อให้ทั้ง Size Model และ Segmentation Model ถูก Initialize
+    """
+    dummy = np.full((256, 256, 3), (240, 230, 230), dtype=np.uint8)
+    for cx, cy in [(70, 70), (180, 90), (110, 180)]:
+        cv2.circle(dummy, (cx, cy), 28, (170, 120, 180), -1)
+    with _eval_lock:
+        model.eval(dummy, diameter=None, channels=[0, 0], flow_threshold=config.CELLPOSE_FLOW_THRESHOLD,
+                   cellprob_threshold=config.CELLPOSE_CELLPROB_THRESHOLD)
+
 def segment_and_save_cells(image_path):
     """
-    ตัดภาพเซลล์แบบ 'Cookie Cutter' (แม่พิมพ์ตัดคุ้กกี้):
-    1. สร้างภาพพื้นหลังสีชมพูเปล่าๆ รอไว้ (Canvas)
-    2. ใช้ Mask ของเซลล์เป็นแม่พิมพ์ (ขยายขอบเล็กน้อย)
-    3. 'ปั๊ม' เฉพาะตัวเซลล์จากภาพจริง ลงไปบน Canvas
-    
-    ข้อดี: รับประกัน 100% ว่าเพื่อนข้างบ้าน/ขยะ/เกล็ดเลือด จะไม่มีทางติดมา
-           เพราะเราเลือกก๊อปปี้มาเฉพาะพื้นที่ของเซลล์เท่านั้น
+    อ่านภาพจาก Disk -> segment_cells -> บันทึก crop ลง segmented_cells/<session>
+    เซลล์ที่ไม่ผ่าน filter_bad_cells จะถูกคัดออกก่อนบันทึก (ไม่มีการเขียนแล้วลบทิ้ง)
+    คืนค่าเป็น list ของ dict {"id", "file_path", "bbox", "features"}
+    features คือ MaskFeatures จาก Mask ของ Cellpose (ส่งต่อให้ process_folder_sizes(precomputed=...) ได้)
+    """
+    image_bgr = cv2.imread(image_path)
+    if image_bgr is None: return []
+
+    cells = segment_cells(image_bgr)
+    if not cells: return []
+
+    session_id = str(uuid.uuid4())
+    save_cells(cells, os.path.join('segmented_cells', session_id))
+    return [{"id": c.id, "file_path": c.file_path, "bbox": c.bbox, "features": c.mask_features} for c in cells]
+
+def segment_cells(image_bgr, filter_cells=True, diameter=None):
+    """
+    Segmentation แบบครบขั้นตอนในหน่วยความจำ:
+    Cellpose -> สถิติของทุก Label (ครั้งเดียว) -> ตัดเซลล์ติดขอบ -> filter_bad_cells -> ตัด crop
+    -> ขนาด/รูปร่างจาก Mask (attach_mask_features)
+    """
+    masks, _ = run_cellpose(image_bgr, diameter=diameter)
+    if masks is None: return []
+
+    stats = [s for s in compute_label_stats(masks) if not s['touches_border']]
+    if filter_cells:
+        stats = filter_bad_cells(stats)
+    return attach_mask_features(extract_cells(image_bgr, masks, stats), masks)
+
+def _eval_cellpose(model, image_rgb, diameter=None):
+    """เรียก Cellpose 1 ครั้ง (ภายใต้ _eval_lock) คืนค่า (masks, diameter ที่ใช้จริง)"""
+    with _eval_lock, metrics.time_forward('cellpose', 1):
+        masks, _, _, diams = model.eval(
+            image_rgb,
+            diameter=diameter,
+            channels=[0, 0],
+            flow_threshold=config.CELLPOSE_FLOW_THRESHOLD,
+            cellprob_threshold=config.CELLPOSE_CELLPROB_THRESHOLD
+        )
+    return masks, float(np.atleast_1d(diams)[0]) if diams is not None else diameter
+
+def run_cellpose(image_bgr, tiled=None, diameter=None):
+    """
+    รัน Cellpose บนภาพ BGR
+    tiled: None = ใช้โหมด Tile อัตโนมัติเมื่อภาพใหญ่กว่า config.TILED_MIN_SIZE
+    diameter: ขนาดเซลล์ (px) ที่ Calibrate ไว้แล้ว / None = ให้ Cellpose ประมาณเอง (ช้ากว่า)
+    คืนค่า: (Label Mask (0 = พื้นหลัง, 1..N = เซลล์) หรือ None ถ้าไม่เจอ, diameter ที่ใช้จริง)
     """
     try:
         model = get_cellpose_model() 
-        if model is None: return []
+        if model is None: return None, None
 
-        image_bgr = cv2.imread(image_path)
-        if image_bgr is None: return []
-            
-        image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-        height, width, _ = image_bgr.shape
-        
-        # ใช้ Settings แบบ Auto Diameter เพื่อให้เจอเซลล์ครบทุกขนาด
-        masks, _, _, _ = model.eval(
-            image_rgb, 
-            diameter=None,        
-            channels=[0, 0],    
-            flow_threshold=0.4,   
-            cellprob_threshold=0.0 
-        )
+        height, width = image_bgr.shape[:2]
+        if tiled is None:
+            tiled = max(height, width) > config.TILED_MIN_SIZE
+
+        if tiled:
+            masks, used_diameter = segment_tiled(model, image_bgr, diameter=diameter)
+        else:
+            image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+            # diameter=None -> Auto Diameter เพื่อให้เจอเซลล์ครบทุกขนาด
+            masks, used_diameter = _eval_cellpose(model, image_rgb, diameter=diameter)
 
         num_cells = masks.max()
-        print(f"🔎 Cellpose found: {num_cells} cells") 
-
-        if num_cells == 0: return []
-
-        saved_cells_data = []
-        session_id = str(uuid.uuid4())
-        output_dir = os.path.join('segmented_cells', session_id)
-        os.makedirs(output_dir, exist_ok=True)
-
-        for i in range(1, num_cells + 1):
-            cell_indices = (masks == i)
-            y_indices, x_indices = np.where(cell_indices)
-            if y_indices.size == 0: continue 
-            
-            y_min, y_max = y_indices.min(), y_indices.max()
-            x_min, x_max = x_indices.min(), x_indices.max()
-
-            # Border Check
-            border_margin = 1 
-            if (x_min <= border_margin or y_min <= border_margin or 
-                x_max >= width - border_margin or y_max >= height - border_margin):
-                continue 
-
-            bbox = {
+        print(f"🔎 Cellpose found: {num_cells} cells (diameter={used_diameter})") 
+
+        if num_cells == 0: return None, used_diameter
+        return masks, used_diameter
+    except Exception as e:
+        print(f"Error in segmentation: {e}")
+        traceback.print_exc()
+        return None, None
+
+# ================== TILED SEGMENTATION (ภาพความละเอียดสูง) ==================
+
+def _tile_starts(length, tile, overlap):
+    """
+    จุดเริ่มของแต่ละ Tile ตามแกนเดียว (Tile สุดท้ายชิดขอบภาพพอดี)
+    Overlap ถูกจำกัดไว้ไม่เกินครึ่ง Tile (Overlap >= Tile จะทำให้ Tile ไม่ขยับ)
+    """
+    if length <= tile: return [0]
+    step = tile - min(max(overlap, 0), tile // 2)
+    starts = list(range(0, length - tile + 1, step))
+    if starts[-1] + tile < length:
+        starts.append(length - tile)
+    return starts
+
+def _core_bounds(starts, tile, length):
+    """
+    ขอบเขต 'พื้นที่ของตัวเอง' ของแต่ละ Tile: ตัดครึ่งกลางส่วนที่ซ้อนกับ Tile ข้างเคียง
+    เซลล์จะเป็นของ Tile ที่มี Centroid อยู่ใน Core เท่านั้น (กันนับซ้ำตรงรอยต่อ)
+    """
+    bounds = []
+    for k, start in enumerate(starts):
+        lo = 0 if k == 0 else (start + min(starts[k - 1] + tile, length)) // 2
+        hi = length if k == len(starts) - 1 else (starts[k + 1] + min(start + tile, length)) // 2
+        bounds.append((lo, hi))
+    return bounds
+
+def _segment_tile(model, image_bgr, y0, y1, x0, x1, diameter):
+    tile_rgb = cv2.cvtColor(image_bgr[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+    return _eval_cellpose(model, tile_rgb, diameter=diameter)
+
+def segment_tiled(model, image_bgr, tile_size=None, overlap=None, diameter=None):
+    """
+    Segment ภาพใหญ่แบบแบ่ง Tile ที่ซ้อนกัน (Overlap)
+    - จุดประสงค์คือจำกัดหน่วยความจำ ไม่ใช่ความเร็ว: Cellpose รันทีละ Tile (Model เดียว, _eval_lock)
+      จึงใช้เวลาพอๆ กับ (หรือมากกว่า) การรันทั้งภาพ แต่ Buffer ของ Cellpose มีขนาดแค่ 1 Tile
+    - diameter=None: ประมาณขนาดเซลล์จาก Tile กลางภาพครั้งเดียว แล้วใช้ค่านั้นกับทุก Tile
+    - รวม Label ทุก Tile เป็น Mask เดียว โดยเซลล์ตรงรอยต่อจะถูกเก็บจาก Tile เดียวเท่านั้น
+    คืนค่า: (masks, diameter)
+    """
+    tile_size = tile_size or config.TILE_SIZE
+    overlap = overlap if overlap is not None else config.TILE_OVERLAP
+
+    height, width = image_bgr.shape[:2]
+    ys = _tile_starts(height, tile_size, overlap)
+    xs = _tile_starts(width, tile_size, overlap)
+    y_bounds = _core_bounds(ys, tile_size, height)
+    x_bounds = _core_bounds(xs, tile_size, width)
+
+    tiles = []
+    for iy, y0 in enumerate(ys):
+        for ix, x0 in enumerate(xs):
+            tiles.append((y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width),
+                          y_bounds[iy], x_bounds[ix]))
+    print(f"🧩 Tiled segmentation: {len(tiles)} tiles ({len(ys)}x{len(xs)}), tile={tile_size}, overlap={overlap}")
+
+    # 1. ประมาณ Diameter จาก Tile ที่อยู่กลางภาพ (ให้ทุก Tile ใช้ขนาดเซลล์เดียวกัน)
+    if diameter is None:
+        cy, cx = height // 2, width // 2
+        center = min(tiles, key=lambda t: abs((t[0] + t[1]) // 2 - cy) + abs((t[2] + t[3]) // 2 - cx))
+        _, diameter = _segment_tile(model, image_bgr, *center[:4], diameter=None)
+        print(f"📏 Estimated diameter (center tile): {diameter:.1f} px")
+
+    masks = np.zeros((height, width), dtype=np.int32)
+    next_label = 1
+
+    def merge(tile, tile_masks):
+        nonlocal next_label
+        y0, y1, x0, x1, (cy_lo, cy_hi), (cx_lo, cx_hi) = tile
+        centroids = ndimage.center_of_mass(tile_masks > 0, tile_masks, range(1, tile_masks.max() + 1)) \
+            if tile_masks.max() > 0 else []
+        for label, (slc, (ly, lx)) in enumerate(zip(ndimage.find_objects(tile_masks), centroids), start=1):
+            if slc is None: continue
+            gy, gx = y0 + ly, x0 + lx
+            if not (cy_lo <= gy < cy_hi and cx_lo <= gx < cx_hi): continue  # เป็นของ Tile ข้างเคียง
+
+            local = tile_masks[slc] == label
+            gy_slice = slice(y0 + slc[0].start, y0 + slc[0].stop)
+            gx_slice = slice(x0 + slc[1].start, x0 + slc[1].stop)
+            target = masks[gy_slice, gx_slice]
+            # ไม่เขียนทับเซลล์ที่ถูกวางไว้แล้ว (กรณีขอบเซลล์ซ้อนกันเล็กน้อยตรงรอยต่อ)
+            target[local & (target == 0)] = next_label
+            next_label += 1
+
+    # 2. Segment ทีละ Tile แล้วรวมทันที (ถือ Mask ของ Tile ไว้ครั้งละ 1 ชุด, Label เรียงเหมือนเดิมทุกครั้ง)
+    for tile in tiles:
+        merge(tile, _segment_tile(model, image_bgr, *tile[:4], diameter)[0])
+
+    return masks, diameter
+
+def compute_label_stats(masks, border_margin=1):
+    """
+    คำนวณ bbox, พื้นที่ และสถานะติดขอบภาพ ของทุก Label ในการกวาด Mask รอบเดียว
+    (แทนการทำ masks == i + np.where ทั้งภาพทีละเซลล์ ซึ่งเป็น O(cells x pixels))
+    คืนค่า: list ของ dict {"id", "bbox", "area", "touches_border", "slice"}
+    """
+    height, width = masks.shape[:2]
+    areas = np.bincount(masks.ravel())
+    stats = []
+
+    # find_objects คืน slice ของกรอบสี่เหลี่ยมที่ล้อมแต่ละ Label (index 0 = Label 1)
+    for i, slc in enumerate(ndimage.find_objects(masks), start=1):
+        if slc is None: continue
+        y_slice, x_slice = slc
+        y_min, y_max = y_slice.start, y_slice.stop - 1
+        x_min, x_max = x_slice.start, x_slice.stop - 1
+
+        # Border Check
+        touches_border = (x_min <= border_margin or y_min <= border_margin or 
+                          x_max >= width - border_margin or y_max >= height - border_margin)
+
+        stats.append({
+            "id": i,
+            "bbox": {
                 "x": int(x_min),
                 "y": int(y_min),
                 "w": int(x_max - x_min),
                 "h": int(y_max - y_min)
-            }
-
-            # ---------------------------------------------------------
-            # ✨ เทคนิค Cookie Cutter Strategy
-            # ---------------------------------------------------------
-            
-            padding = 10
-            y_start = max(0, y_min - padding)
-            y_end = min(height, y_max + padding)
-            x_start = max(0, x_min - padding)
-            x_end = min(width, x_max + padding)
-
-            # 1. เตรียมภาพต้นฉบับ (Source) และ Mask ของพื้นที่นี้
-            roi_image = image_bgr[y_start:y_end, x_start:x_end]
-            roi_mask = masks[y_start:y_end, x_start:x_end]
-
-            # 2. คำนวณสีพื้นหลัง (Background Color) เพื่อเตรียมทำกระดาษเปล่า
-            bg_pixels_mask = (roi_mask == 0)
-            if np.sum(bg_pixels_mask) > 0:
-                bg_color = roi_image[bg_pixels_mask].mean(axis=0).astype(np.uint8)
-            else:
-                bg_color = np.array([230, 230, 240], dtype=np.uint8) # สีชมพูมาตรฐาน
-
-            # 3. สร้าง Canvas เปล่าๆ (กระดาษสีชมพู) ขนาดเท่า ROI
-            # เริ่มต้นด้วยการเทสีพื้นหลังให้เต็มแผ่น
-            final_roi = np.full_like(roi_image, bg_color)
-
-            # 4. เตรียมแม่พิมพ์ (Mask) เฉพาะตัวเรา
-            my_cell_mask = (roi_mask == i).astype(np.uint8)
-            
-            # ขยายขอบแม่พิมพ์ (Dilation) เพื่อให้ครอบคลุมขอบเซลล์และเชื้อที่เกาะขอบ
-            # ใช้ค่า 4 เพื่อความปลอดภัยสำหรับ P. vivax
-            mask_expansion = 3
-            kernel = np.ones((3, 3), np.uint8)
-            dilated_mask = cv2.dilate(my_cell_mask, kernel, iterations=mask_expansion)
-
-            # 5. "ปั๊ม" ภาพลงไป (The Stamp) ✨
-            # สั่งว่า: ตรงไหนที่เป็นรูแม่พิมพ์ (dilated_mask == 1) ให้เอาภาพจริงมาใส่
-            # ส่วนตรงไหนที่ไม่ใช่ (เช่น เพื่อนบ้าน) ให้คงสีชมพูของ Canvas ไว้ตามเดิม
-            # หมายเหตุ: [..., None] ใช้เพื่อให้ Dimension ตรงกับภาพสี (3 channels)
-            final_roi = np.where(dilated_mask[..., None] == 1, roi_image, final_roi)
-            
-            # Save
-            output_filename = f"cell_crop_{i}.png" 
-            output_path = os.path.join(output_dir, output_filename)
-            cv2.imwrite(output_path, final_roi)
-            
-            saved_cells_data.append({
-                "id": i,
-                "file_path": output_path,
-                "bbox": bbox
-            })
-
-        return saved_cells_data 
-    except Exception as e:
-        print(f"Error in segmentation: {e}")
-        traceback.print_exc()
-        return []
+            },
+            "area": int(areas[i]),
+            "touches_border": bool(touches_border),
+            "slice": slc
+        })
+
+    return stats
+
+def attach_mask_features(cells, masks):
+    """
+    คำนวณขนาด/รูปร่างของทุกเซลล์จาก Label Mask ในครั้งเดียว แล้วเก็บใน cell.mask_features (พิกัดของ crop)
+    ใช้แทนการ Threshold crop ซ้ำใน findsize / cellree
+    """
+    if not cells: return cells
+    features = features_from_labels(masks, [c.id for c in cells])
+    for cell in cells:
+        feats = features.get(cell.id)
+        cell.mask_features = feats.in_crop(cell.origin) if feats is not None else None
+    return cells
+
+def extract_cells(image_bgr, masks, stats):
+    """
+    ตัดภาพเซลล์แบบ 'Cookie Cutter' (แม่พิมพ์ตัดคุ้กกี้) เฉพาะ Label ที่อยู่ใน stats:
+    1. สร้างภาพพื้นหลังสีชมพูเปล่าๆ รอไว้ (Canvas)
+    2. ใช้ Mask ของเซลล์เป็นแม่พิมพ์ (ขยายขอบเล็กน้อย)
+    3. 'ปั๊ม' เฉพาะตัวเซลล์จากภาพจริง ลงไปบน Canvas
+    
+    ข้อดี: รับประกัน 100% ว่าเพื่อนข้างบ้าน/ขยะ/เกล็ดเลือด จะไม่มีทางติดมา
+           เพราะเราเลือกก๊อปปี้มาเฉพาะพื้นที่ของเซลล์เท่านั้น
+    แต่ละเซลล์จะแตะเฉพาะพื้นที่ ROI ของตัวเองเท่านั้น
+    """
+    height, width = image_bgr.shape[:2]
+    cells = []
+
+    for item in stats:
+        i = item['id']
+        bbox = item['bbox']
+        x_min, y_min = bbox['x'], bbox['y']
+        x_max, y_max = x_min + bbox['w'], y_min + bbox['h']
+
+        # ---------------------------------------------------------
+        # ✨ เทคนิค Cookie Cutter Strategy
+        # ---------------------------------------------------------
+        
+        padding = 10
+        y_start = max(0, y_min - padding)
+        y_end = min(height, y_max + padding)
+        x_start = max(0, x_min - padding)
+        x_end = min(width, x_max + padding)
+
+        # 1. เตรียมภาพต้นฉบับ (Source) และ Mask ของพื้นที่นี้
+        roi_image = image_bgr[y_start:y_end, x_start:x_end]
+        roi_mask = masks[y_start:y_end, x_start:x_end]
+
+        # 2. คำนวณสีพื้นหลัง (Background Color) เพื่อเตรียมทำกระดาษเปล่า
+        bg_pixels_mask = (roi_mask == 0)
+        if np.sum(bg_pixels_mask) > 0:
+            bg_color = roi_image[bg_pixels_mask].mean(axis=0).astype(np.uint8)
+        else:
+            bg_color = np.array([230, 230, 240], dtype=np.uint8) # สีชมพูมาตรฐาน
+
+        # 3. สร้าง Canvas เปล่าๆ (กระดาษสีชมพู) ขนาดเท่า ROI
+        # เริ่มต้นด้วยการเทสีพื้นหลังให้เต็มแผ่น
+        final_roi = np.full_like(roi_image, bg_color)
+
+        # 4. เตรียมแม่พิมพ์ (Mask) เฉพาะตัวเรา
+        my_cell_mask = (roi_mask == i).astype(np.uint8)
+        
+        # ขยายขอบแม่พิมพ์ (Dilation) เพื่อให้ครอบคลุมขอบเซลล์และเชื้อที่เกาะขอบ
+        # ใช้ค่า 4 เพื่อความปลอดภัยสำหรับ P. vivax
+        mask_expansion = 3
+        kernel = np.ones((3, 3), np.uint8)
+        dilated_mask = cv2.dilate(my_cell_mask, kernel, iterations=mask_expansion)
+
+        # 5. "ปั๊ม" ภาพลงไป (The Stamp) ✨
+        # สั่งว่า: ตรงไหนที่เป็นรูแม่พิมพ์ (dilated_mask == 1) ให้เอาภาพจริงมาใส่
+        # ส่วนตรงไหนที่ไม่ใช่ (เช่น เพื่อนบ้าน) ให้คงสีชมพูของ Canvas ไว้ตามเดิม
+        # หมายเหตุ: [..., None] ใช้เพื่อให้ Dimension ตรงกับภาพสี (3 channels)
+        final_roi = np.where(dilated_mask[..., None] == 1, roi_image, final_roi)
+        
+        # เก็บไว้ในหน่วยความจำ (การเขียนไฟล์เป็นหน้าที่ของ save_cells)
+        cells.append(CellRecord(
+            id=i,
+            crop=final_roi,
+            mask=my_cell_mask,
+            bbox=bbox,
+            origin=(int(x_start), int(y_start))
+        ))
+
+    return cells
 
 def filter_bad_cells(cell_data_list):
     """
     คัดกรองเซลล์ (ใช้ Logic เดิมที่ดีอยู่แล้ว)
+    รับได้ทั้ง list ของ CellRecord, list ของ dict แบบเดิม และสถิติจาก compute_label_stats
+    (แนะนำให้กรองจากสถิติก่อนตัด crop เพื่อไม่ต้องสร้างภาพของเซลล์ที่ถูกคัดทิ้ง)
     """
     if not cell_data_list: return []
     valid_data = []
     areas = []
     
     for item in cell_data_list:
-        w = item['bbox']['w']
-        h = item['bbox']['h']
+        bbox = item.bbox if isinstance(item, CellRecord) else item['bbox']
+        w = bbox['w']
+        h = bbox['h']
         areas.append(w * h)
         
     if not areas: return []
     median_area = np.median(areas)
     
     # Range กว้างๆ ไว้ก่อน
-    MIN_LIMIT = median_area * 0.2
-    MAX_LIMIT = median_area * 3.5 
+    MIN_LIMIT = median_area * config.CELL_AREA_MIN_RATIO
+    MAX_LIMIT = median_area * config.CELL_AREA_MAX_RATIO
     
     for i, item in enumerate(cell_data_list):
         area = areas[i]
-        path = item['file_path']
+        path = item.file_path if isinstance(item, CellRecord) else item.get('file_path')
         if area < MIN_LIMIT or area > MAX_LIMIT:
-            try: os.remove(path)
-            except: pass
+            if path:
+                try: os.remove(path)
+                except: pass
             continue
         valid_data.append(item)
     
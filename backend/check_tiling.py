@@ -0,0 +1,54 @@
+"""
+ตรวจว่า Tiled Segmentation นับเซลล์ได้เท่ากับการรัน Cellpose ทั้งภาพ บนชุด Fixture เดียวกับ benchmark_pipeline
+(fixtures/fields + ภาพสังเคราะห์) ใช้ Tile เล็กเพื่อบังคับให้ทุกภาพถูกแบ่งหลาย Tile
+
+    python check_tiling.py                          # Tile 256 px, Overlap 96 px, ต่างกันได้ไม่เกิน 5%
+    python check_tiling.py --tile-size 384 --max-diff 0.03
+
+ทั้งสองแบบใช้ Diameter เดียวกัน (ประมาณจากภาพเต็ม) เพื่อเทียบเฉพาะผลของการแบ่ง / รวม Tile
+exit 1 ถ้าภาพใดนับต่างกันเกิน --max-diff (สัดส่วนของจำนวนเซลล์แบบไม่แบ่ง Tile)
+"""
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+from benchmark_pipeline import load_fields
+from cellpose_segmenter import _eval_cellpose, get_cellpose_model, segment_tiled
+
+def _count(masks):
+    """จำนวน Label ที่เหลืออยู่จริงใน Mask (Label ที่ถูกเซลล์อื่นทับหมดไม่นับ)"""
+    labels = np.unique(masks)
+    return int(np.count_nonzero(labels))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiled vs untiled Cellpose cell counts")
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--overlap', type=int, default=96)
+    parser.add_argument('--max-diff', type=float, default=0.05, help="สัดส่วนที่นับต่างกันได้ต่อภาพ")
+    args = parser.parse_args(argv)
+
+    model = get_cellpose_model()
+    if model is None: return 2
+
+    failed = []
+    print(f"{'field':<48}{'untiled':>9}{'tiled':>9}{'diff':>8}")
+    for name, img in load_fields():
+        full, diameter = _eval_cellpose(model, cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        tiled, _ = segment_tiled(model, img, tile_size=args.tile_size, overlap=args.overlap,
+                                 diameter=diameter)
+        n_full, n_tiled = _count(full), _count(tiled)
+        diff = abs(n_tiled - n_full) / max(n_full, 1)
+        mark = '' if diff <= args.max_diff else '  ❌'
+        print(f"{name[:47]:<48}{n_full:>9}{n_tiled:>9}{diff:>8.1%}{mark}")
+        if mark: failed.append(name)
+
+    if failed:
+        print(f"❌ {len(failed)} field(s) differ by more than {args.max_diff:.0%}: {failed}")
+        return 1
+    print("✅ Tiled segmentation matches untiled cell counts")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import os
+
+# ค่าตั้งค่าของ Backend ทั้งหมดรวมไว้ที่เดียว
+# ทุกค่าสามารถ Override ได้ด้วย Environment Variable (เช่น MALARIAX_JOB_WORKERS=4)
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None: return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ================== FOLDERS ==================
+UPLOAD_FOLDER = 'uploads'
+SEGMENTED_FOLDER = 'segmented_cells'
+PROCESSED_FOLDER = 'processed_results'
+DEBUG_FOLDER = 'debug_crops'  # <--- โฟลเดอร์เก็บรูปที่ตัดแล้ว
+
+# บันทึกไฟล์ภาพ (ต้นฉบับ / crop / viz) ลง Disk เพื่อให้หน้าเว็บเปิดดูได้
+# ถ้าปิด Pipeline ยังทำงานได้ครบ แต่ URL ของรูปภาพจะเป็น None
+SAVE_ARTIFACTS = _env_bool('MALARIAX_SAVE_ARTIFACTS', True)
+# เก็บสำเนา crop แยกตาม Class ไว้ใน sorted_by_morphology (สำหรับทำ Dataset)
+SAVE_SORTED_COPIES = _env_bool('MALARIAX_SAVE_SORTED_COPIES', False)
+# บันทึก crop ทุกเซลล์รวมเป็นภาพ Atlas เดียวต่อ Session (+ Index ตำแหน่งใน JSON) แทน 1 ไฟล์ต่อเซลล์
+# URL แบบเดิม cells/<session>/cell_crop_N.png ยังใช้ได้ (ตัดจาก Atlas ตอนมี Request)
+CROP_ATLAS = _env_bool('MALARIAX_CROP_ATLAS', True)
+
+# ภาพ Visualization (_dist_viz.png / size_visualization):
+#   'lazy'  = เก็บแค่ Geometry แล้ววาดเมื่อหน้าเว็บเปิด /processed/... ครั้งแรก (Cache ไว้ใน VIZ_CACHE_FOLDER)
+#   'eager' = วาดและบันทึกทุกภาพตอนวิเคราะห์ (แบบเดิม)
+#   'off'   = ไม่สร้างเลย (ส่ง viz=0 มากับ Request เพื่อปิดเฉพาะครั้งนั้นได้)
+VIZ_MODE = os.environ.get('MALARIAX_VIZ_MODE', 'lazy')
+VIZ_CACHE_FOLDER = 'viz_cache'
+VIZ_CACHE_MAX_BYTES = _env_int('MALARIAX_VIZ_CACHE_MAX_BYTES', 100 * 1024 * 1024)
+
+# ================== MODELS ==================
+MODEL_PATH = os.path.join(BASE_DIR, 'model', 'best_resnet-50_new_start.pth')
+YOLO_PATH = os.path.join(BASE_DIR, 'model', 'best.pt')
+CLASS_NAMES = ['1chromatin', 'band form', 'basket form', 'nomal_cell', 'schuffner dot']
+RESNET_BATCH_SIZE = _env_int('MALARIAX_RESNET_BATCH_SIZE', 32)  # จำนวนเซลล์ต่อ 1 Forward Pass
+YOLO_BATCH_SIZE = _env_int('MALARIAX_YOLO_BATCH_SIZE', 64)  # เซลล์ 1chromatin ต่อภาพปกติไม่เกินนี้ -> เรียก predict ครั้งเดียว
+# Backend ของ ResNet บน CPU: 'eager' (PyTorch ปกติ) / 'torchscript' / 'onnx' (ต้องติดตั้ง onnxruntime)
+# ตรวจความเร็ว + ความตรงกับ FP32 ก่อนเปลี่ยนด้วย: python benchmark_resnet_backend.py
+RESNET_BACKEND = os.environ.get('MALARIAX_RESNET_BACKEND', 'eager')
+RESNET_QUANTIZE = _env_bool('MALARIAX_RESNET_QUANTIZE', False)  # Dynamic INT8
+RESNET_CHANNELS_LAST = _env_bool('MALARIAX_RESNET_CHANNELS_LAST', False)
+RESNET_EXPORT_DIR = os.path.join(BASE_DIR, 'model', 'exported')  # ไฟล์ TorchScript / ONNX ที่ Export แล้ว
+MODEL_WAIT_TIMEOUT = _env_int('MALARIAX_MODEL_WAIT_TIMEOUT', 120)  # วินาทีที่ Request จะรอโมเดลโหลดเสร็จ ก่อนตอบ 503
+
+# ================== MODEL THRESHOLDS ==================
+# ค่าที่กำหนดผลลัพธ์ของโมเดล (รวมอยู่ใน pipeline.PIPELINE_PARAMETERS -> เปลี่ยนแล้ว Result Cache เก่าใช้ไม่ได้)
+CELLPOSE_FLOW_THRESHOLD = 0.4
+CELLPOSE_CELLPROB_THRESHOLD = 0.0
+# filter_bad_cells: เก็บเฉพาะเซลล์ที่พื้นที่ bbox อยู่ในช่วง Median x [MIN, MAX]
+CELL_AREA_MIN_RATIO = 0.2
+CELL_AREA_MAX_RATIO = 3.5
+AI_CONFIDENCE_THRESHOLD = 85.0  # ResNet มั่นใจน้อยกว่านี้ (%) + Texture เรียบ -> Normal
+TEXTURE_THRESHOLD = 20.0
+YOLO_CONFIDENCE = 0.25  # ความมั่นใจขั้นต่ำของกล่อง Chromatin
+
+# ================== SIZE / SHAPE ANALYSIS ==================
+# วัดขนาด/รูปร่างจาก Label Mask ของ Cellpose โดยตรง (ตรงกับผล Segmentation และไม่ต้อง Threshold crop ซ้ำ)
+# ปิดเพื่อกลับไปใช้ค่าจาก Otsu บน crop (algoritum/cellfeatures.extract_features)
+SIZE_FROM_MASKS = _env_bool('MALARIAX_SIZE_FROM_MASKS', True)
+SIZE_WORKERS = _env_int('MALARIAX_SIZE_WORKERS', max(1, min(8, os.cpu_count() or 1)))  # Thread วัดขนาดเซลล์พร้อมกัน
+
+# ================== TILED SEGMENTATION ==================
+# ภาพที่ด้านยาวเกินค่านี้จะถูกแบ่ง Tile ก่อนส่งเข้า Cellpose (กล้องความละเอียดสูง / Slide Scan)
+TILED_MIN_SIZE = _env_int('MALARIAX_TILED_MIN_SIZE', 2048)
+TILE_SIZE = _env_int('MALARIAX_TILE_SIZE', 1024)
+# Overlap ต้องกว้างกว่าเส้นผ่านศูนย์กลางของเซลล์ใหญ่สุด เพื่อให้ทุกเซลล์อยู่ครบใน Tile ใด Tile หนึ่ง
+# (ไม่เกินครึ่ง Tile: Overlap >= Tile จะทำให้ Tile ไม่ขยับ)
+TILE_OVERLAP = min(max(_env_int('MALARIAX_TILE_OVERLAP', 256), 0), TILE_SIZE // 2)
+
+# ================== DIAMETER CALIBRATION ==================
+# จำขนาดเซลล์ของแต่ละกล้อง (ส่ง device_id มากับ Request) เพื่อข้ามขั้นตอนประมาณขนาดของ Cellpose
+CALIBRATION_ENABLED = _env_bool('MALARIAX_CALIBRATION_ENABLED', True)
+CALIBRATION_FILE = os.path.join('calibration', 'diameters.json')
+CALIBRATION_MIN_SAMPLES = _env_int('MALARIAX_CALIBRATION_MIN_SAMPLES', 5)
+CALIBRATION_REESTIMATE_EVERY = _env_int('MALARIAX_CALIBRATION_REESTIMATE_EVERY', 25)  # ตรวจ Drift ทุกๆ N ภาพ
+# device_id ที่ Calibrate แยกได้ (คั่นด้วย , เช่น "scope-a,scope-b,live" ว่าง = ทุกชื่อ แต่ไม่เกิน MAX_PROFILES)
+# ชื่ออื่นใช้ Profile 'default' ร่วมกัน
+CALIBRATION_PROFILES = [p.strip() for p in os.environ.get('MALARIAX_CALIBRATION_PROFILES', '').split(',') if p.strip()]
+CALIBRATION_MAX_PROFILES = _env_int('MALARIAX_CALIBRATION_MAX_PROFILES', 32)
+
+# ================== ASYNC JOBS ==================
+JOB_WORKERS = _env_int('MALARIAX_JOB_WORKERS', 2)  # จำนวน Pipeline ที่รันพร้อมกันได้
+JOB_QUEUE_LIMIT = _env_int('MALARIAX_JOB_QUEUE_LIMIT', 16)  # งานที่รอ + กำลังรันได้สูงสุด (เกินนี้ตอบ 503)
+JOB_TTL_SECONDS = _env_int('MALARIAX_JOB_TTL_SECONDS', 3600)  # เก็บผลของงานที่เสร็จแล้วไว้นานเท่าไร
+JOB_MAX_FINISHED = _env_int('MALARIAX_JOB_MAX_FINISHED', 64)  # จำนวนงานที่จบแล้วที่เก็บผลไว้ในหน่วยความจำ
+
+# ================== RESULT CACHE ==================
+# ภาพเดิม (Byte ตรงกันทุกตัว) + โมเดล/Config เดิม -> ส่งผลลัพธ์เดิมกลับทันทีโดยไม่รัน Pipeline ซ้ำ
+CACHE_ENABLED = _env_bool('MALARIAX_CACHE_ENABLED', True)
+CACHE_FOLDER = 'result_cache'
+CACHE_MAX_ENTRIES = _env_int('MALARIAX_CACHE_MAX_ENTRIES', 500)
+CACHE_MAX_BYTES = _env_int('MALARIAX_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+
+# ================== RETENTION ==================
+# ลบไฟล์ของ Session เก่าใน uploads / debug_crops / segmented_cells / processed_results / viz_cache
+RETENTION_ENABLED = _env_bool('MALARIAX_RETENTION_ENABLED', True)
+RETENTION_SESSION_TTL = _env_int('MALARIAX_RETENTION_SESSION_TTL', 24 * 3600)  # อายุสูงสุดของ Session (วินาที)
+RETENTION_MAX_BYTES = _env_int('MALARIAX_RETENTION_MAX_BYTES', 2 * 1024 * 1024 * 1024)  # โควตารวมทุกโฟลเดอร์
+RETENTION_INTERVAL = _env_int('MALARIAX_RETENTION_INTERVAL', 600)  # Sweep ทุกกี่วินาที
+RETENTION_GRACE = _env_int('MALARIAX_RETENTION_GRACE', 300)  # Session ที่อายุน้อยกว่านี้จะไม่ถูกลบ
+
+# ================== PROFILING ==================
+# Profile ราย Request: POST /api/analyze?profile=1 (หรือ profile=sample / cprofile, Header X-Profile)
+# ไฟล์เก็บใน processed_results/<session>/ ดาวน์โหลดที่ GET /api/profile/<session>/<folded|prof|txt>
+PROFILING_ENABLED = _env_bool('MALARIAX_PROFILING_ENABLED', False)
+PROFILING_MODE = os.environ.get('MALARIAX_PROFILING_MODE', 'sample')  # ค่าเริ่มต้นเมื่อส่ง profile=1
+PROFILING_INTERVAL_MS = _env_int('MALARIAX_PROFILING_INTERVAL_MS', 5)  # ความถี่ของ Sampling Profiler
+# ถ้าตั้งไว้ Client ต้องส่ง Header X-Profile-Token ให้ตรง (ทั้งตอนวิเคราะห์และดาวน์โหลด)
+PROFILING_TOKEN = os.environ.get('MALARIAX_PROFILING_TOKEN')
+
+# ================== LIVE STREAM ==================
+# วิเคราะห์เฟรมจากกล้องแบบต่อเนื่อง: รับเฟรมผ่าน WebSocket (/api/live/ws ต้องติดตั้ง flask-sock),
+# POST /api/live/frame หรือ Socket ภายในเครื่อง (LIVE_SOCKET_PORT) แล้วเผยแพร่ผลล่าสุดที่ /api/live/latest, /api/live/events
+# เก็บเฉพาะเฟรมล่าสุด 1 เฟรม ระหว่างวิเคราะห์เฟรมใหม่ที่เข้ามาจะแทนที่เฟรมที่รออยู่ (เฟรมเก่าถูกทิ้ง)
+# ปิดไว้เป็นค่าเริ่มต้น (เปิดเฉพาะเครื่องที่ต่อกล้อง: MALARIAX_LIVE_ENABLED=1)
+LIVE_ENABLED = _env_bool('MALARIAX_LIVE_ENABLED', False)
+LIVE_SOCKET_HOST = os.environ.get('MALARIAX_LIVE_SOCKET_HOST', '127.0.0.1')
+LIVE_SOCKET_PORT = _env_int('MALARIAX_LIVE_SOCKET_PORT', 0)  # 0 = ไม่เปิด Socket (ใช้ WebSocket / HTTP)
+# ขนาดสูงสุดของ 1 เฟรม (bytes ของภาพหลังถอด base64) ใช้กับทุกช่องทาง รวมถึง Header ความยาวของ Socket
+LIVE_MAX_FRAME_BYTES = _env_int('MALARIAX_LIVE_MAX_FRAME_BYTES', 8 * 1024 * 1024)
+# /api/live/events ปิด Stream เมื่อเปิดครบเวลานี้ หรือไม่มีผลใหม่นานเท่านี้ (วินาที)
+# เพื่อคืน Thread ของ Worker (EventSource ของ Browser ต่อใหม่เองอัตโนมัติ)
+LIVE_EVENTS_MAX_SECONDS = _env_int('MALARIAX_LIVE_EVENTS_MAX_SECONDS', 300)
+LIVE_EVENTS_IDLE_SECONDS = _env_int('MALARIAX_LIVE_EVENTS_IDLE_SECONDS', 60)
+
+# ================== PRODUCTION SERVING (gunicorn) ==================
+# โหลดโมเดลแบบ Synchronous ตอน import app (ใช้ใน Master Process ก่อน fork, ดู wsgi.py)
+PRELOAD_MODELS = _env_bool('MALARIAX_PRELOAD_MODELS', False)
+# เริ่มโหลดโมเดลใน Background ทันทีที่ import app
+# (False = โหลดเมื่อมี Request วิเคราะห์หรือ /api/health/ready ครั้งแรก เช่นตอนรัน Script / Test)
+MODELS_AUTOLOAD = _env_bool('MALARIAX_MODELS_AUTOLOAD', True)
+SERVER_BIND = os.environ.get('MALARIAX_BIND', '0.0.0.0:5001')
+SERVER_WORKERS = _env_int('MALARIAX_WORKERS', 2)
+SERVER_THREADS = _env_int('MALARIAX_THREADS', 4)  # Thread ต่อ Worker (รองรับ SSE / Health Check ระหว่างวิเคราะห์)
+SERVER_TIMEOUT = _env_int('MALARIAX_TIMEOUT', 300)
+# บีบอัดผลลัพธ์ JSON / msgpack ด้วย gzip ทุก Request ที่ส่ง Accept-Encoding: gzip
+# (False = เฉพาะ Request ที่ขอด้วย ?compress=1 / Header X-Compress: 1)
+RESPONSE_GZIP = _env_bool('MALARIAX_RESPONSE_GZIP', False)
+# ขนาดสูงสุดของ Request Body (Flask MAX_CONTENT_LENGTH เกินแล้วตอบ 413)
+MAX_CONTENT_LENGTH = _env_int('MALARIAX_MAX_CONTENT_LENGTH', 64 * 1024 * 1024)
+# Thread ของ Torch ต่อ Worker (0 = แบ่ง CPU ทั้งหมดเท่าๆ กันตามจำนวน Worker)
+TORCH_THREADS = _env_int('MALARIAX_TORCH_THREADS', 0)
+
+def resnet_options():
+    """ตัวเลือกของ inference_backend.build_resnet_backend ตามค่าตั้งค่าด้านบน"""
+    return {
+        "backend": RESNET_BACKEND,
+        "quantize": RESNET_QUANTIZE,
+        "channels_last": RESNET_CHANNELS_LAST,
+        "export_dir": RESNET_EXPORT_DIR,
+        "threads": TORCH_THREADS
+    }
@@ -0,0 +1,49 @@
+"""
+ค่าตั้งค่า gunicorn สำหรับรัน Backend แบบหลาย Process (ดู wsgi.py)
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+- preload_app: โหลดโมเดลครั้งเดียวใน Master แล้ว fork (Weights แชร์แบบ Copy-on-Write / Shared Memory)
+- post_fork: จำกัด Thread ของ Torch/OpenCV ต่อ Worker ไม่ให้ N Worker แย่ง CPU กันเกินจำนวน Core
+  แล้ว Warm-up โมเดลใน Worker นั้นก่อนเริ่มรับ Request และเริ่ม Retention Sweeper Thread
+"""
+import gc
+import os
+
+import config
+
+bind = config.SERVER_BIND
+workers = config.SERVER_WORKERS
+# gthread: 1 Worker รับได้หลาย Request พร้อมกัน (SSE / Health Check ไม่ต้องรอการวิเคราะห์)
+worker_class = 'gthread'
+threads = config.SERVER_THREADS
+timeout = config.SERVER_TIMEOUT
+preload_app = True
+
+def _torch_threads_per_worker():
+    if config.TORCH_THREADS > 0:
+        return config.TORCH_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, config.SERVER_WORKERS))
+
+def when_ready(server):
+    # โหลดโมเดลเสร็จแล้ว: ย้าย Object ทั้งหมดไป Permanent Generation ของ GC
+    # เพื่อไม่ให้ GC ใน Worker ไปเขียน Header ของ Object (ซึ่งจะทำให้หน้า Memory ถูก Copy)
+    gc.freeze()
+    server.log.info("Models preloaded in master, GC frozen before fork")
+
+def post_fork(server, worker):
+    import cv2
+    import torch
+    from app import models, retention
+
+    n_threads = _torch_threads_per_worker()
+    torch.set_num_threads(n_threads)
+    cv2.setNumThreads(n_threads)
+    server.log.info(f"Worker {worker.pid}: torch/opencv threads = {n_threads}")
+
+    # Warm-up หลัง fork (Thread Pool ของ Torch ใน Master ใช้ต่อใน Child ไม่ได้อย่างปลอดภัย)
+    models.warm_up()
+
+    # Thread ที่สร้างใน Master ไม่ตามมาหลัง fork -> เริ่ม Sweeper ในแต่ละ Worker (Lock File กันการ Sweep ซ้อน)
+    if retention is not None:
+        retention.start()
@@ -18,7 +18,14 @@ def preprocess_image_with_mask(image_path):
         except:
             return None
 
-    h, w, c = img.shape
+    return apply_circular_mask(img)
+
+def apply_circular_mask(img):
+    """
+    ทำ Circular Masking กับภาพ BGR ที่อยู่ในหน่วยความจำแล้ว (ไม่ต้องอ่าน/เขียนไฟล์)
+    คืนค่าเป็น PIL Image (RGB) พร้อมส่งเข้า ResNet
+    """
+    h, w = img.shape[:2]
     
     # 2. สร้างหน้ากากวงกลม (Circular Mask)
     mask = np.zeros((h, w), dtype=np.uint8)
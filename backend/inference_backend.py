@@ -0,0 +1,150 @@
+import copy
+import os
+import re
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+try:
+    import onnxruntime  # Optional: pip install onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# Backend ที่เลือกได้สำหรับ ResNet (ตั้งค่าผ่าน config.RESNET_BACKEND)
+BACKENDS = ('eager', 'torchscript', 'onnx')
+INPUT_SHAPE = (1, 3, 224, 224)
+
+class ChannelsLast(nn.Module):
+    """
+    แปลง Input เป็น channels_last ก่อนส่งเข้าโมเดล (Convolution บน CPU เร็วขึ้นด้วย oneDNN)
+    แปลง Weights ของสำเนา (deepcopy) โมเดลที่ส่งมาจึงไม่ถูกแก้
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = copy.deepcopy(model).to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+class OnnxResNet:
+    """
+    รัน ResNet ที่ Export เป็น ONNX ด้วย onnxruntime
+    เรียกใช้เหมือน nn.Module: model(batch_tensor) -> logits tensor (predict_batch / warm_up_resnet ใช้ได้ทันที)
+    """
+
+    def __init__(self, path, threads=0):
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads: options.intra_op_num_threads = threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        outputs = self.session.run(None, {self.input_name: x.detach().cpu().numpy().astype(np.float32)})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+def _export_path(export_dir, model_version, backend, quantize, channels_last, ext):
+    """
+    ชื่อไฟล์ Export ผูกกับ model_version ของ Weights ต้นฉบับ + ตัวเลือก + เวอร์ชันของ torch
+    (เปลี่ยน Weights -> ผู้เรียกส่ง model_version ใหม่ -> Export ใหม่อัตโนมัติ)
+    """
+    tag = re.sub(r'[^A-Za-z0-9.-]', '-', f"{model_version or 'unversioned'}_torch{torch.__version__}")
+    options = ('_int8' if quantize else '') + ('_cl' if channels_last else '')
+    return os.path.join(export_dir, f"resnet50_{backend}{options}_{tag}{ext}")
+
+def _quantize_dynamic(model):
+    """Dynamic INT8: Weights ของ nn.Linear เป็น int8 (Conv ยังเป็น FP32 เพราะ Dynamic Quantization ไม่รองรับ)"""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+def _tmp_path(path):
+    """ไฟล์ชั่วคราวข้างไฟล์ปลายทาง (นามสกุลเดิม) เขียนเสร็จแล้วค่อย os.replace: Process อื่นไม่เห็นไฟล์ที่เขียนไม่ครบ"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}.tmp{ext}"
+
+def _remove(path):
+    try: os.remove(path)
+    except OSError: pass
+
+def _torchscript(model, path, channels_last):
+    if os.path.exists(path):
+        print(f"📦 Loading TorchScript ResNet: {path}")
+        return torch.jit.load(path, map_location='cpu')
+
+    example = torch.zeros(INPUT_SHAPE)
+    if channels_last: example = example.contiguous(memory_format=torch.channels_last)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(model, example).eval())
+    tmp_path = _tmp_path(path)
+    try:
+        torch.jit.save(scripted, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        _remove(tmp_path)
+    print(f"📦 Exported TorchScript ResNet: {path}")
+    return scripted
+
+def _onnx(model, path, quantize, threads):
+    if not os.path.exists(path):
+        tmp_path = _tmp_path(path)
+        fp32_path = tmp_path if not quantize else _tmp_path(path.replace('.onnx', '.fp32.onnx'))
+        try:
+            torch.onnx.export(model, torch.zeros(INPUT_SHAPE), fp32_path, input_names=['input'],
+                              output_names=['logits'], dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+                              opset_version=17)
+            if quantize:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, path)
+        finally:
+            _remove(fp32_path)
+            _remove(tmp_path)
+        print(f"📦 Exported ONNX ResNet: {path}")
+    return OnnxResNet(path, threads=threads)
+
+def build_resnet_backend(model, device, backend='eager', quantize=False, channels_last=False,
+                         export_dir=None, model_version=None, threads=0):
+    """
+    ห่อ ResNet FP32 (จาก load_resnet_model) ด้วย Backend ที่เลือก คืนค่า (model, ชื่อ Backend ที่ใช้จริง)
+    model_version: Version ของ Weights (เช่น result_cache.build_version(files=(path,))) ใช้ตั้งชื่อไฟล์ Export
+    - eager:       PyTorch ปกติ (+ Dynamic INT8 / channels_last ถ้าเลือก)
+    - torchscript: trace + freeze แล้ว Cache ไฟล์ .pt ไว้ใน export_dir
+    - onnx:        Export .onnx (+ Dynamic INT8 ของ onnxruntime) แล้วรันด้วย onnxruntime
+    ตัวเลือกที่ใช้ไม่ได้ (GPU / ไม่มี onnxruntime / Export ล้มเหลว) จะถอยกลับไปใช้ eager พร้อมแจ้งเตือน
+    """
+    if model is None: return None, None
+    if backend not in BACKENDS:
+        print(f"⚠️ Unknown ResNet backend '{backend}', using eager")
+        backend = 'eager'
+    if device is not None and device.type != 'cpu':
+        # ทุก Backend ด้านล่างออกแบบมาสำหรับ CPU (ไม่มี GPU)
+        return model, 'eager'
+
+    name = backend + ('+int8' if quantize else '') + ('+channels_last' if channels_last and backend != 'onnx' else '')
+    try:
+        if backend == 'onnx':
+            if onnxruntime is None:
+                print("⚠️ onnxruntime is not installed, using eager ResNet")
+                return model, 'eager'
+            os.makedirs(export_dir, exist_ok=True)
+            path = _export_path(export_dir, model_version, backend, quantize, False, '.onnx')
+            return _onnx(model, path, quantize, threads), name
+
+        optimized = _quantize_dynamic(model) if quantize else model
+        if channels_last: optimized = ChannelsLast(optimized)
+        optimized.eval()
+
+        if backend == 'torchscript':
+            os.makedirs(export_dir, exist_ok=True)
+            path = _export_path(export_dir, model_version, backend, quantize, channels_last, '.pt')
+            optimized = _torchscript(optimized, path, channels_last)
+        return optimized, name
+
+    except Exception as e:
+        print(f"⚠️ Cannot build ResNet backend '{name}' ({e}), using eager")
+        return model, 'eager'
@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Event ย่อยระหว่างขั้นตอน (ผลรายเซลล์) ไม่เปลี่ยน stage และไม่แสดงใน stages ของ to_dict()
+PROGRESS_EVENTS = ('cell',)
+
+class Job:
+    """งานวิเคราะห์ 1 งาน เก็บสถานะ ขั้นตอนปัจจุบัน เหตุการณ์ทั้งหมด และผลลัพธ์สุดท้าย"""
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"     # queued -> running -> done / failed
+        self.stage = None
+        self.events = []           # [{"seq", "stage", "data", "time"}, ...]
+        self.result = None
+        self.http_status = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.streams = 0           # จำนวน Stream ที่กำลังอ่าน events อยู่
+        self.cond = threading.Condition(threading.RLock())
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def add_event(self, stage, data=None):
+        with self.cond:
+            if stage not in PROGRESS_EVENTS: self.stage = stage
+            self.events.append({
+                "seq": len(self.events),
+                "stage": stage,
+                "data": data or {},
+                "time": round(time.time() - self.created_at, 3)
+            })
+            self.cond.notify_all()
+
+    def start(self):
+        with self.cond:
+            self.status = "running"
+
+    def open_stream(self):
+        with self.cond:
+            self.streams += 1
+
+    def close_stream(self):
+        """
+        Stream อ่านจบ / Client ปิด: ถ้างานจบแล้วและไม่มี Stream อื่นอ่านอยู่
+        ทิ้ง Event รายเซลล์ (ผลครบอยู่ใน result แล้ว) เหลือเฉพาะ Event ของขั้นตอน
+        """
+        with self.cond:
+            self.streams -= 1
+            if self.finished and self.streams == 0:
+                self.events = [e for e in self.events if e["stage"] not in PROGRESS_EVENTS]
+
+    def finish(self, status, data=None):
+        """ปิดงาน: เปลี่ยนสถานะและเพิ่ม Event สุดท้ายพร้อมกัน (SSE จะไม่พลาด Event ปิดท้าย)"""
+        with self.cond:
+            self.status = status
+            self.finished_at = time.time()
+            self.add_event(status, data)
+
+    def to_dict(self, include_result=True):
+        with self.cond:
+            info = {
+                "job_id": self.id,
+                "status": self.status,
+                "stage": self.stage,
+                "stages": [{"stage": e["stage"], "time": e["time"]} for e in self.events
+                           if e["stage"] not in PROGRESS_EVENTS],
+                "error": self.error
+            }
+            if include_result and self.status == "done":
+                info["result"] = self.result
+                info["http_status"] = self.http_status
+            return info
+
+class JobManager:
+    """
+    รัน Pipeline แบบ Async ด้วย Worker Pool ขนาดจำกัด
+    - submit() คืน Job ทันที (หรือ None ถ้าคิวเต็ม) แล้วให้ Worker รันเบื้องหลัง
+    - Client ติดตามผลด้วย get() หรือ stream_events() (Server-Sent Events)
+    - งานที่จบแล้วเก็บไว้ไม่เกิน ttl_seconds และไม่เกิน max_finished งาน (เกินแล้วลบงานที่ไม่ได้เปิดดูนานที่สุดก่อน)
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, ttl_seconds=3600, max_finished=64):
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._jobs = OrderedDict()   # ลำดับ = ใช้ล่าสุดอยู่ท้าย (LRU)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        fn จะถูกเรียกเป็น fn(*args, on_stage=..., **kwargs) และต้องคืนค่า (payload, http_status)
+        """
+        with self._lock:
+            self._purge_expired()
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                return None
+            job = Job(str(uuid.uuid4()))
+            self._jobs[job.id] = job
+
+        job.add_event("queued")
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge_expired()
+            job = self._jobs.get(job_id)
+            if job is not None: self._jobs.move_to_end(job_id)
+            return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.start()
+        try:
+            payload, http_status = fn(*args, on_stage=job.add_event, **kwargs)
+            job.result, job.http_status = payload, http_status
+            job.finish("done", {"success": bool(payload.get("success", False)), "http_status": http_status})
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.finish("failed", {"error": str(e)})
+
+    def _purge_expired(self):
+        """ลบงานที่จบแล้วเกิน TTL แล้วตัดงานที่จบแล้วให้เหลือไม่เกิน max_finished (เรียกภายใต้ self._lock)"""
+        now = time.time()
+        finished = [jid for jid, j in self._jobs.items() if j.finished]
+        expired = [jid for jid in finished if now - self._jobs[jid].finished_at > self.ttl_seconds]
+        for jid in expired:
+            del self._jobs[jid]
+        finished = [jid for jid in finished if jid in self._jobs]
+        for jid in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[jid]
+
+    def _iter_events(self, job, heartbeat):
+        """ทุก Event ตั้งแต่ต้นจนงานจบ (Event 'done' แนบผลลัพธ์) คืนค่า None เมื่อถึงเวลาส่ง Keep-alive"""
+        sent = 0
+        job.open_stream()
+        try:
+            while True:
+                with job.cond:
+                    if sent >= len(job.events) and not job.finished:
+                        job.cond.wait(timeout=heartbeat)
+                    new_events = job.events[sent:]
+                    finished = job.finished
+
+                if not new_events:
+                    if finished: break
+                    yield None
+                    continue
+
+                for event in new_events:
+                    data = dict(event)
+                    if event["stage"] == "done":
+                        data["result"] = job.result
+                    yield data
+                sent += len(new_events)
+
+                if finished and sent >= len(job.events):
+                    break
+        finally:
+            job.close_stream()
+
+    def stream_events(self, job, heartbeat=15.0):
+        """
+        Generator สำหรับ SSE: ส่งทุก Event ตั้งแต่ต้น แล้วรอ Event ใหม่จนงานจบ
+        (ส่ง comment ': keep-alive' เป็นระยะ เพื่อไม่ให้ Proxy ตัดการเชื่อมต่อ)
+        """
+        for data in self._iter_events(job, heartbeat):
+            if data is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"id: {data['seq']}\nevent: {data['stage']}\ndata: {json.dumps(data)}\n\n"
+
+    def stream_ndjson(self, job, heartbeat=15.0):
+        """Generator แบบ NDJSON: 1 Event ต่อ 1 บรรทัด (Keep-alive เป็นบรรทัดว่าง)"""
+        for data in self._iter_events(job, heartbeat):
+            yield "\n" if data is None else json.dumps(data, ensure_ascii=False) + "\n"
@@ -0,0 +1,215 @@
+"""
+วิเคราะห์ภาพจากกล้องแบบ Live (เลื่อน Slide แล้วเห็นผลตรวจจับอัปเดตต่อเนื่อง)
+- เก็บเฟรมที่รอวิเคราะห์ไว้ช่องเดียว (Latest-frame Slot): เฟรมใหม่แทนที่เฟรมที่ยังรออยู่ -> ไม่มีคิวสะสม
+- Worker Thread 1 ตัววิเคราะห์เฟรมล่าสุดทีละเฟรม แล้วเผยแพร่ผลล่าสุด (latest() / stream_events())
+- รับเฟรมได้ทั้ง bytes ของ JPEG/PNG และ Data URL / base64 แบบที่ Raspberry Pi ส่งเข้า streams/stream1
+
+หมายเหตุ gunicorn: สถานะเป็นของแต่ละ Process ให้ส่งเฟรมและอ่านผลจาก Worker เดียวกัน
+(ใช้ Socket ภายในเครื่อง / WebSocket ต่อเนื่อง หรือรัน Live Mode ด้วย Worker เดียว)
+"""
+import base64
+import binascii
+import json
+import socketserver
+import struct
+import threading
+import time
+import traceback
+
+import metrics
+
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG', b'BM', b'RIFF')
+
+def decode_frame(data):
+    """bytes ของภาพ หรือ Data URL / base64 -> bytes ของภาพ (None ถ้าอ่านไม่ได้)"""
+    if not data: return None
+    if isinstance(data, str):
+        data = data.encode('ascii', 'ignore')
+    if data.startswith(IMAGE_SIGNATURES):
+        return data
+    if data.startswith(b'data:'):
+        data = data.split(b',', 1)[-1]
+    try:
+        return base64.b64decode(data.strip(), validate=False) or None
+    except (binascii.Error, ValueError):
+        return None
+
+def _live_result(payload):
+    """ผลลัพธ์ย่อสำหรับ Live (ข้อมูลที่ใช้วาดกรอบบนเฟรม ไม่มี URL ของ Artifact)"""
+    if not payload.get('success'):
+        return {key: payload.get(key) for key in ('success', 'message', 'error')}
+    return {
+        "success": True,
+        "overall_diagnosis": payload.get('overall_diagnosis'),
+        "total_cells_segmented": payload.get('total_cells_segmented'),
+        "summary": payload.get('summary'),
+        "amoeboid_count": payload.get('amoeboid_count'),
+        "crop_box": payload.get('crop_box'),
+        "cells": [{"bbox": item.get('bbox'), "characteristic": item.get('characteristic'),
+                   "confidence": item.get('confidence'), "chromatin_count": item.get('chromatin_count')}
+                  for item in payload.get('vit_characteristics', [])]
+    }
+
+class LiveAnalyzer:
+    """
+    analyze: fn(frame_bytes) -> (payload, http_status) เช่น run_analysis แบบไม่บันทึก Artifact
+    submit() คืนค่าทันทีเสมอ (ไม่บล็อกผู้ส่งเฟรม) ถ้ากำลังวิเคราะห์อยู่เฟรมจะรอในช่องเดียว
+    """
+
+    def __init__(self, analyze, max_frame_bytes=8 * 1024 * 1024):
+        self.analyze = analyze
+        self.max_frame_bytes = max_frame_bytes
+        self.version = 0
+        self.busy = False
+        self.counts = {"received": 0, "analyzed": 0, "dropped": 0, "invalid": 0, "failed": 0}
+        self._pending = None   # (frame_id, bytes, received_at, source)
+        self._latest = None
+        self._frame_seq = 0
+        self.streams = 0   # จำนวน SSE Stream ที่เปิดอยู่
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, data, source='http'):
+        """รับเฟรมใหม่ คืนค่า frame_id (None ถ้าเฟรมใช้ไม่ได้)"""
+        frame = decode_frame(data)
+        if frame is None or len(frame) > self.max_frame_bytes:
+            with self._cond: self.counts["invalid"] += 1
+            metrics.LIVE_FRAMES.inc(outcome='invalid')
+            return None
+
+        with self._cond:
+            self._frame_seq += 1
+            self.counts["received"] += 1
+            if self._pending is not None:
+                # ยังไม่ได้วิเคราะห์เฟรมก่อนหน้า -> ทิ้งไป ใช้เฟรมล่าสุดแทน
+                self.counts["dropped"] += 1
+                metrics.LIVE_FRAMES.inc(outcome='dropped')
+            self._pending = (self._frame_seq, frame, time.time(), source)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="live-analyzer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return self._frame_seq
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                frame_id, frame, received_at, source = self._pending
+                self._pending = None
+                self.busy = True
+
+            started = time.time()
+            try:
+                payload, status = self.analyze(frame)
+            except Exception as e:
+                traceback.print_exc()
+                payload, status = {'error': str(e), 'success': False}, 500
+            finished = time.time()
+
+            outcome = "analyzed" if status == 200 else "failed"
+            metrics.LIVE_FRAMES.inc(outcome=outcome)
+            with self._cond:
+                self.busy = False
+                self.counts[outcome] += 1
+                self.version += 1
+                self._latest = {
+                    "version": self.version,
+                    "frame_id": frame_id,
+                    "source": source,
+                    "received_at": received_at,
+                    "analyzed_at": finished,
+                    "analysis_seconds": round(finished - started, 3),
+                    "latency_seconds": round(finished - received_at, 3),
+                    "http_status": status,
+                    "result": _live_result(payload)
+                }
+                self._cond.notify_all()
+
+    def latest(self):
+        with self._cond:
+            return self._latest
+
+    def wait_newer(self, version, timeout=None):
+        """รอผลที่ใหม่กว่า version (None ถ้าหมดเวลา)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > version, timeout)
+            return self._latest if self.version > version else None
+
+    def stream_events(self, heartbeat=15.0, max_seconds=None, idle_seconds=None, retry_ms=3000):
+        """
+        Generator สำหรับ SSE: ส่งผลล่าสุดทันที แล้วส่งผลใหม่ทุกครั้งที่วิเคราะห์เฟรมเสร็จ
+        จบ Stream (event: end) เมื่อเปิดครบ max_seconds หรือไม่มีผลใหม่นาน idle_seconds
+        -> คืน Thread ของ Worker แล้ว EventSource ของ Browser ต่อใหม่เองหลัง retry_ms
+        Client ที่ปิดไปแล้ว: เขียน Heartbeat ไม่สำเร็จ -> Server ปิด Generator (ค้างไม่เกิน heartbeat วินาที)
+        """
+        started = last_result = time.monotonic()
+        sent = 0
+        with self._cond: self.streams += 1
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            while True:
+                now = time.monotonic()
+                deadlines = {"heartbeat": heartbeat}
+                if max_seconds: deadlines["max_duration"] = started + max_seconds - now
+                if idle_seconds: deadlines["idle"] = last_result + idle_seconds - now
+                reason, timeout = min(deadlines.items(), key=lambda kv: kv[1])
+                if reason != "heartbeat" and timeout <= 0:
+                    yield f"event: end\ndata: {json.dumps({'reason': reason})}\n\n"
+                    return
+
+                latest = self.wait_newer(sent, timeout=timeout)
+                if latest is None:
+                    if reason == "heartbeat": yield ": keep-alive\n\n"
+                    continue
+                sent = latest["version"]
+                last_result = time.monotonic()
+                yield f"id: {sent}\nevent: result\ndata: {json.dumps(latest)}\n\n"
+        finally:
+            with self._cond: self.streams -= 1
+
+    def stats(self):
+        with self._cond:
+            latest = self._latest
+            return dict(self.counts, busy=self.busy, pending=self._pending is not None, version=self.version,
+                        event_streams=self.streams,
+                        last_latency_seconds=latest["latency_seconds"] if latest else None,
+                        last_analysis_seconds=latest["analysis_seconds"] if latest else None)
+
+# ---------------- Local Socket (แทน WebSocket ภายในเครื่อง) ----------------
+# Protocol: [ความยาว 4 Byte แบบ Big-endian][bytes ของภาพ JPEG/PNG] ต่อกันไปเรื่อยๆ ใน Connection เดียว
+# ความยาวเกิน analyzer.max_frame_bytes (config.LIVE_MAX_FRAME_BYTES) -> ปิด Connection ทันทีโดยไม่อ่าน Body
+
+class _FrameHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        analyzer = self.server.analyzer
+        while True:
+            header = self.rfile.read(4)
+            if len(header) < 4: return
+            (size,) = struct.unpack('>I', header)
+            if size > analyzer.max_frame_bytes:
+                print(f"⚠️ Live socket frame too large ({size} bytes), closing connection")
+                return
+            data = self.rfile.read(size)
+            if len(data) < size: return
+            analyzer.submit(data, source='socket')
+
+class FrameSocketServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, analyzer):
+        super().__init__(address, _FrameHandler)
+        self.analyzer = analyzer
+
+def start_socket_server(analyzer, host, port):
+    """เปิด Socket รับเฟรมใน Background Thread (คืนค่า None ถ้า Bind ไม่ได้ เช่น Port ถูกใช้อยู่)"""
+    try:
+        server = FrameSocketServer((host, port), analyzer)
+    except OSError as e:
+        print(f"⚠️ Cannot start live frame socket on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="live-socket", daemon=True).start()
+    print(f"📡 Live frame socket listening on {host}:{port}")
+    return server
@@ -0,0 +1,177 @@
+"""
+Metrics แบบ Prometheus (Text Exposition Format) ไม่ต้องติดตั้ง Library เพิ่ม
+- Counter / Histogram พร้อม Label, ปลอดภัยเมื่อเรียกจากหลาย Thread
+- render() คืนข้อความสำหรับ GET /metrics
+
+หมายเหตุ gunicorn: แต่ละ Worker มี Registry ของตัวเอง (ค่าที่ Scrape ได้คือของ Worker ที่ตอบ Request นั้น)
+จึงใส่ Label pid ใน malariax_process_info ไว้ให้แยกได้
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket ของเวลา (วินาที) ครอบตั้งแต่งานเล็กๆ (filter) ถึง Cellpose บนภาพใหญ่
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400, 800)
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs: return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'): return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(entry[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {entry[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text=''):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text='', buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        lines = ["# HELP malariax_process_info Worker process serving this scrape",
+                 "# TYPE malariax_process_info gauge",
+                 f'malariax_process_info{{pid="{os.getpid()}"}} 1',
+                 "# HELP malariax_process_start_time_seconds Start time of the process",
+                 "# TYPE malariax_process_start_time_seconds gauge",
+                 f"malariax_process_start_time_seconds {self.started_at}"]
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# ================== METRICS ของ MalariaX ==================
+
+REQUESTS = REGISTRY.counter('malariax_requests_total', 'HTTP analysis requests by endpoint and status')
+REQUEST_SECONDS = REGISTRY.histogram('malariax_request_seconds', 'End-to-end analysis request latency')
+STAGE_SECONDS = REGISTRY.histogram('malariax_stage_seconds', 'Pipeline stage latency')
+FORWARD_SECONDS = REGISTRY.histogram('malariax_model_forward_seconds', 'Model forward pass latency per batch')
+FORWARD_BATCH = REGISTRY.histogram('malariax_model_batch_size', 'Items per model forward pass', buckets=COUNT_BUCKETS)
+DISK_WRITE_SECONDS = REGISTRY.histogram('malariax_disk_write_seconds', 'Artifact / cache write latency')
+DISK_WRITE_BYTES = REGISTRY.counter('malariax_disk_write_bytes_total', 'Bytes written to disk by kind')
+CELLS_PER_REQUEST = REGISTRY.histogram('malariax_cells_per_request', 'Cells analysed per request', buckets=COUNT_BUCKETS)
+CELLS = REGISTRY.counter('malariax_cells_total', 'Classified cells by class')
+CACHE_LOOKUPS = REGISTRY.counter('malariax_cache_lookups_total', 'Result cache lookups by outcome')
+LIVE_FRAMES = REGISTRY.counter('malariax_live_frames_total', 'Live stream frames by outcome (analyzed / dropped / invalid)')
+
+def time_forward(model, n_items):
+    """with time_forward('resnet', len(batch)): ... -> เวลา + ขนาด Batch ของ Forward Pass"""
+    FORWARD_BATCH.observe(n_items, model=model)
+    return FORWARD_SECONDS.time(model=model)
+
+@contextmanager
+def time_write(kind, path=None):
+    """จับเวลาการเขียนไฟล์ แล้วนับ Byte จากขนาดไฟล์ที่เขียนเสร็จ"""
+    with DISK_WRITE_SECONDS.time(kind=kind):
+        yield
+    if path is not None:
+        try: DISK_WRITE_BYTES.inc(os.path.getsize(path), kind=kind)
+        except OSError: pass
+
+class StageTimer:
+    """จับเวลาของแต่ละขั้นตอน: enter(stage) ปิดขั้นตอนก่อนหน้าแล้วเริ่มนับขั้นตอนใหม่"""
+
+    def __init__(self, histogram=STAGE_SECONDS):
+        self.histogram = histogram
+        self.stage = None
+        self.started = None
+        self.durations = {}
+
+    def enter(self, stage):
+        self.finish()
+        self.stage, self.started = stage, time.perf_counter()
+
+    def finish(self):
+        if self.stage is None: return
+        elapsed = time.perf_counter() - self.started
+        self.durations[self.stage] = round(elapsed, 4)
+        self.histogram.observe(elapsed, stage=self.stage)
+        self.stage = None
+
+def render():
+    return REGISTRY.render()
@@ -6,6 +6,22 @@ import os
 import cv2
 import numpy as np
 
+import config
+import metrics
+
+# ชื่อ Class ตามที่คุณกำหนด
+CLASS_NAMES = ['1chromatin', 'band form', 'basket form', 'nomal_cell', 'schuffner dot']
+NORMAL_CLASS = 'nomal_cell'
+AI_CONFIDENCE_THRESHOLD = config.AI_CONFIDENCE_THRESHOLD
+TEXTURE_THRESHOLD = config.TEXTURE_THRESHOLD
+
+# สร้าง Transform ครั้งเดียวแล้วใช้ซ้ำทุกเซลล์
+RESNET_TRANSFORM = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+])
+
 # --- 1. ฟังก์ชันโหลดโมเดล (คงเดิม) ---
 def load_resnet_model(model_path, num_classes):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -35,7 +51,18 @@ def load_resnet_model(model_path, num_classes):
         print(f"❌ Error loading model: {e}")
         return None, device
 
+def warm_up_resnet(model, device, batch_size=1):
+    """รัน Forward Pass ด้วยภาพสังเคราะห์ 1 ครั้ง เพื่อให้ Request แรกไม่ต้องจ่ายค่า Initialize"""
+    dummy = torch.zeros((batch_size, 3, 224, 224), device=device)
+    with torch.no_grad():
+        model(dummy)
+
 # --- 2. ✨ ฟังก์ชันใหม่: เช็คว่าเซลล์ "เรียบเนียน" เกินไปไหม ---
+def texture_score(gray_img):
+    """คำนวณค่าเบี่ยงเบนมาตรฐาน (Standard Deviation) ของภาพขาวดำ"""
+    mean, std_dev = cv2.meanStdDev(gray_img)
+    return std_dev[0][0]
+
 def is_cell_too_smooth(image_path):
     """
     ใช้ OpenCV เช็ค Texture ของภาพ
@@ -46,62 +73,113 @@ def is_cell_too_smooth(image_path):
         img = cv2.imread(image_path, 0) 
         if img is None: return False
         
-        # คำนวณค่าเบี่ยงเบนมาตรฐาน (Standard Deviation) ของสีในภาพ
         # ค่าต่ำ = ภาพเรียบๆ (เซลล์ปกติ)
         # ค่าสูง = ภาพมีจุดตัดกันชัดเจน (น่าจะมีเชื้อ)
-        mean, std_dev = cv2.meanStdDev(img)
-        score = std_dev[0][0]
+        score = texture_score(img)
         
         print(f"🔍 Texture Score for {os.path.basename(image_path)}: {score:.2f}")
         
         # ⚠️ เกณฑ์ตัดสิน: ถ้า Score ต่ำกว่า 20 แสดงว่าภาพเรียบมาก ไม่น่าใช่เชื้อ
         # (คุณอาจต้องปรับค่า 20 ขึ้นลงนิดหน่อยตามแสงของกล้องจุลทรรศน์)
-        return score < 20.0 
+        return score < TEXTURE_THRESHOLD
         
     except Exception as e:
         print(f"Warning in texture check: {e}")
         return False
 
+def is_image_too_smooth(img_pil):
+    """เหมือน is_cell_too_smooth แต่รับภาพ PIL ในหน่วยความจำ (ไม่ต้องอ่านไฟล์)"""
+    try:
+        gray = cv2.cvtColor(np.asarray(img_pil.convert('RGB')), cv2.COLOR_RGB2GRAY)
+        return texture_score(gray) < TEXTURE_THRESHOLD
+    except Exception as e:
+        print(f"Warning in texture check: {e}")
+        return False
+
 # --- 3. ฟังก์ชันทำนายผล (แก้ไขเพิ่ม Logic) ---
-def predict_image_file(model, device, image_path):
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    
-    # ชื่อ Class ตามที่คุณกำหนด
-    class_names = ['1chromatin', 'band form', 'basket form', 'nomal_cell', 'schuffner dot']
-    NORMAL_CLASS = 'nomal_cell'
+def _apply_guards(predicted_class, confidence, too_smooth):
+    """
+    ด่านป้องกันผลบวกปลอม (ใช้ร่วมกันทั้งแบบทีละภาพและแบบ Batch)
+    too_smooth: ฟังก์ชันที่เรียกเมื่อจำเป็นต้องเช็ค Texture เท่านั้น
+    """
+    # B. 🛡️ ด่านป้องกันที่ 1: Confidence Threshold
+    # ถ้า AI ไม่มั่นใจ (ต่ำกว่า 85%) ปัดตกทันที
+    if predicted_class != NORMAL_CLASS and confidence < AI_CONFIDENCE_THRESHOLD:
+        print(f"🛡️ AI Unsure ({confidence:.2f}%). Reverting {predicted_class} -> Normal.")
+        return NORMAL_CLASS, confidence
+
+    # C. 🛡️ ด่านป้องกันที่ 2: Texture Check (เฉพาะเคสที่เป็นเชื้อโรค)
+    # ถ้า AI บอกว่าเป็นเชื้อ แต่ภาพดูเรียบเนียนผิดปกติ -> เชื่อ OpenCV ดีกว่า
+    if predicted_class != NORMAL_CLASS:
+        if too_smooth():
+            print(f"🛡️ Image too smooth. Reverting {predicted_class} -> Normal (Texture Check).")
+            return NORMAL_CLASS, confidence
+
+    return predicted_class, confidence
 
+def predict_image_file(model, device, image_path):
     try:
         # A. ให้ AI ทำนายก่อน
         img_pil = Image.open(image_path).convert('RGB')
-        img_tensor = transform(img_pil).unsqueeze(0).to(device)
+        img_tensor = RESNET_TRANSFORM(img_pil).unsqueeze(0).to(device)
         
         with torch.no_grad():
-            outputs = model(img_tensor)
+            with metrics.time_forward('resnet', 1):
+                outputs = model(img_tensor)
             probs = torch.nn.functional.softmax(outputs, dim=1)
             top_p, top_class = probs.topk(1, dim=1)
             
             confidence = top_p.item() * 100
-            predicted_class = class_names[top_class.item()]
-
-        # B. 🛡️ ด่านป้องกันที่ 1: Confidence Threshold
-        # ถ้า AI ไม่มั่นใจ (ต่ำกว่า 85%) ปัดตกทันที
-        if predicted_class != NORMAL_CLASS and confidence < 85.0:
-            print(f"🛡️ AI Unsure ({confidence:.2f}%). Reverting {predicted_class} -> Normal.")
-            return NORMAL_CLASS, confidence
-
-        # C. 🛡️ ด่านป้องกันที่ 2: Texture Check (เฉพาะเคสที่เป็นเชื้อโรค)
-        # ถ้า AI บอกว่าเป็นเชื้อ แต่ภาพดูเรียบเนียนผิดปกติ -> เชื่อ OpenCV ดีกว่า
-        if predicted_class != NORMAL_CLASS:
-            if is_cell_too_smooth(image_path):
-                print(f"🛡️ Image too smooth. Reverting {predicted_class} -> Normal (Texture Check).")
-                return NORMAL_CLASS, confidence
+            predicted_class = CLASS_NAMES[top_class.item()]
 
-        return predicted_class, confidence
+        return _apply_guards(predicted_class, confidence,
+                             lambda: is_cell_too_smooth(image_path))
 
     except Exception as e:
         print(f"⚠️ Prediction Error: {e}")
-        return "Unknown", 0.0
\ No newline at end of file
+        return "Unknown", 0.0
+
+# --- 4. ทำนายทีละหลายเซลล์ (Batch) ---
+def predict_batch(model, device, images, batch_size=32, on_batch=None):
+    """
+    ทำนายหลายเซลล์ในครั้งเดียว (รับภาพในหน่วยความจำ ไม่อ่าน/เขียนไฟล์)
+    images: list ของ PIL Image (RGB) หรือ numpy array (BGR แบบ OpenCV)
+    on_batch: callback(start, results ของ Batch นั้น) เรียกทันทีที่แต่ละ Batch เสร็จ (ใช้ Stream ผลรายเซลล์)
+    คืนค่า: list ของ (label, confidence) เรียงตามลำดับ input
+            ใช้เกณฑ์ 85% + Texture Check เหมือน predict_image_file ทุกประการ
+    """
+    results = []
+    if not images: return results
+
+    pil_images = []
+    for img in images:
+        if isinstance(img, np.ndarray):
+            img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        pil_images.append(img.convert('RGB'))
+
+    batch_size = max(1, int(batch_size))
+    for start in range(0, len(pil_images), batch_size):
+        chunk = pil_images[start:start + batch_size]
+        try:
+            batch_tensor = torch.stack([RESNET_TRANSFORM(img) for img in chunk]).to(device)
+
+            with torch.no_grad():
+                with metrics.time_forward('resnet', len(chunk)):
+                    outputs = model(batch_tensor)
+                probs = torch.nn.functional.softmax(outputs, dim=1)
+                top_p, top_class = probs.topk(1, dim=1)
+
+            confidences = (top_p[:, 0] * 100).tolist()
+            class_ids = top_class[:, 0].tolist()
+
+            for img, class_id, confidence in zip(chunk, class_ids, confidences):
+                results.append(_apply_guards(CLASS_NAMES[class_id], confidence,
+                                             lambda img=img: is_image_too_smooth(img)))
+
+        except Exception as e:
+            print(f"⚠️ Batch Prediction Error: {e}")
+            results.extend([("Unknown", 0.0)] * len(chunk))
+
+        if on_batch is not None: on_batch(start, results[start:])
+
+    return results
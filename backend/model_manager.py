@@ -0,0 +1,220 @@
+import importlib
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from result_cache import build_version
+
+# torch / cellpose / ultralytics ถูก import ใน Background Thread ตอนเริ่มโหลดโมเดล
+# import ไฟล์นี้จึงไม่เสียเวลาหลายวินาที -> Flask เริ่มตอบ Health Check / Static Route ได้ทันที
+
+# Module ของแต่ละโมเดล import ทีละตัวใน Thread เดียวก่อนโหลดแบบขนาน
+# (torch / cellpose / ultralytics import ซ้อนกันข้าม Thread เสี่ยง Import Lock Deadlock)
+MODEL_MODULES = (('cellpose', 'cellpose_segmenter'), ('resnet', 'model_loader'),
+                 ('resnet', 'inference_backend'), ('yolo', 'algoritum.yolo_counter'))
+
+class ModelManager:
+    """
+    โหลดโมเดลทั้งหมด (Cellpose / ResNet / YOLO) ตั้งแต่ตอน Start Server แบบขนาน
+    แล้วรัน Warm-up Inference ด้วยภาพสังเคราะห์ เพื่อให้ Request แรกเร็วเท่า Request ถัดๆ ไป
+    สถานะใช้ตอบ /api/health/ready ให้ Load Balancer รู้ว่าพร้อมรับงานแล้วหรือยัง
+    """
+
+    # โมเดลที่ต้องโหลดสำเร็จถึงจะถือว่า "พร้อม" (YOLO ไม่มีก็ยังวิเคราะห์ได้ นับ Chromatin = 1)
+    REQUIRED_MODELS = ('cellpose', 'resnet')
+
+    def __init__(self, resnet_path, yolo_path, num_classes, resnet_options=None):
+        self.resnet_path = resnet_path
+        self.yolo_path = yolo_path
+        self.num_classes = num_classes
+        # ตัวเลือกของ build_resnet_backend (backend / quantize / channels_last / export_dir)
+        self.resnet_options = dict(resnet_options or {})
+
+        self.resnet = None
+        self.resnet_backend = None
+        self.device = None
+        self.yolo = None
+        self.cellpose = None
+
+        self.status = {name: "pending" for name in ('cellpose', 'resnet', 'yolo')}
+        self.timings = {}
+        self._done = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._warm_up_enabled = True
+        self._modules = {}
+
+    # ---------------- Loading ----------------
+
+    def start(self):
+        """เริ่มโหลดโมเดลใน Background Thread (ไม่บล็อกการ Start ของ Flask)"""
+        with self._lock:
+            if self._thread is None and not self._done.is_set():
+                self._thread = threading.Thread(target=self.load_all, name="model-loader", daemon=True)
+                self._thread.start()
+        return self
+
+    def load_all(self, warm_up=True):
+        """
+        โหลด + Warm-up ทุกโมเดลพร้อมกัน แล้วรอจนเสร็จ
+        warm_up=False ใช้ตอนโหลดใน Master Process ก่อน fork (ให้แต่ละ Worker warm-up เองหลัง fork)
+        """
+        print("🚀 Loading models (parallel)...")
+        started = time.perf_counter()
+        self._warm_up_enabled = warm_up
+        self._import_modules()
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="model-load") as pool:
+            futures = [
+                pool.submit(self._run_step, 'cellpose', self._load_cellpose),
+                pool.submit(self._run_step, 'resnet', self._load_resnet),
+                pool.submit(self._run_step, 'yolo', self._load_yolo),
+            ]
+            for f in futures: f.result()
+
+        self.timings['total'] = round(time.perf_counter() - started, 3)
+        self._done.set()
+        print(f"✅ Models ready={self.is_ready()} in {self.timings['total']:.2f}s -> {self.status}")
+        return self.is_ready()
+
+    def _run_step(self, name, loader):
+        started = time.perf_counter()
+        self.status[name] = "loading"
+        try:
+            self.status[name] = "ready" if loader() else "failed"
+        except Exception as e:
+            print(f"❌ Error preparing {name}: {e}")
+            traceback.print_exc()
+            self.status[name] = "failed"
+        self.timings[name] = round(time.perf_counter() - started, 3)
+
+    def _import_modules(self):
+        """
+        import Module ของทุกโมเดลตามลำดับใน Thread นี้ แล้วเก็บเวลาไว้ใน timings['<name>_import']
+        Module ที่ import ไม่ได้จะไม่อยู่ใน self._modules (Loader ของโมเดลนั้นคืนค่า False)
+        """
+        for name, module_name in MODEL_MODULES:
+            if module_name in self._modules: continue
+            started = time.perf_counter()
+            try:
+                self._modules[module_name] = importlib.import_module(module_name)
+            except Exception as e:
+                print(f"❌ Cannot import {module_name} for {name}: {e}")
+                traceback.print_exc()
+            key = f'{name}_import'
+            self.timings[key] = round(self.timings.get(key, 0) + time.perf_counter() - started, 3)
+
+    def _module(self, module_name):
+        module = self._modules.get(module_name)
+        if module is None: raise ImportError(f"{module_name} is not available")
+        return module
+
+    def _load_cellpose(self):
+        segmenter = self._module('cellpose_segmenter')
+        self.cellpose = segmenter.get_cellpose_model()
+        if self.cellpose is None: return False
+        if self._warm_up_enabled:
+            self.status['cellpose'] = "warming_up"
+            segmenter.warm_up_cellpose(self.cellpose)
+        return True
+
+    def _load_resnet(self):
+        loader = self._module('model_loader')
+        backends = self._module('inference_backend')
+        model, self.device = loader.load_resnet_model(self.resnet_path, num_classes=self.num_classes)
+        if model is None: return False
+        version = build_version(files=(self.resnet_path,))
+        self.resnet, self.resnet_backend = backends.build_resnet_backend(model, self.device, model_version=version,
+                                                                         **self.resnet_options)
+        print(f"🧠 ResNet backend: {self.resnet_backend}")
+        if self._warm_up_enabled:
+            self.status['resnet'] = "warming_up"
+            loader.warm_up_resnet(self.resnet, self.device)
+        return True
+
+    def _load_yolo(self):
+        counter = self._module('algoritum.yolo_counter')
+        self.yolo = counter.load_yolo_model(self.yolo_path)
+        if self.yolo is None: return False
+        if self._warm_up_enabled:
+            self.status['yolo'] = "warming_up"
+            counter.warm_up_yolo(self.yolo)
+        return True
+
+    def warm_up(self):
+        """รัน Warm-up ให้ทุกโมเดลที่โหลดแล้ว (เรียกใน Worker หลัง fork เมื่อโหลดด้วย warm_up=False)"""
+        started = time.perf_counter()
+        steps = [('cellpose', self.cellpose,
+                  lambda: importlib.import_module('cellpose_segmenter').warm_up_cellpose(self.cellpose)),
+                 ('resnet', self.resnet,
+                  lambda: importlib.import_module('model_loader').warm_up_resnet(self.resnet, self.device)),
+                 ('yolo', self.yolo,
+                  lambda: importlib.import_module('algoritum.yolo_counter').warm_up_yolo(self.yolo))]
+        for name, model, fn in steps:
+            if model is None: continue
+            try:
+                fn()
+            except Exception as e:
+                print(f"⚠️ Warm-up failed for {name}: {e}")
+        self.timings['warm_up'] = round(time.perf_counter() - started, 3)
+
+    def torch_modules(self):
+        """รวม nn.Module ทั้งหมดที่มี Weights อยู่ (ResNet, YOLO, Cellpose)"""
+        import torch
+        candidates = [self.resnet, getattr(self.yolo, 'model', None)]
+        if self.cellpose is not None:
+            # Cellpose เก็บ Network ไว้ใน .cp.net (Segmentation) และ .sz.cp.net (Size Model)
+            cp = getattr(self.cellpose, 'cp', None)
+            sz = getattr(self.cellpose, 'sz', None)
+            candidates += [getattr(cp, 'net', None), getattr(getattr(sz, 'cp', None), 'net', None)]
+        modules = []
+        for m in candidates:
+            if isinstance(m, torch.nn.Module) and all(m is not seen for seen in modules):
+                modules.append(m)
+        return modules
+
+    def share_memory(self):
+        """
+        ย้าย Weights ไปไว้ใน Shared Memory ก่อน fork
+        ทุก Worker จะอ้างถึง Tensor ชุดเดียวกัน แทนที่จะมีสำเนาของตัวเองคนละชุด
+        """
+        shared = []
+        for module in self.torch_modules():
+            try:
+                module.share_memory()
+                shared.append(type(module).__name__)
+            except Exception as e:
+                print(f"⚠️ share_memory failed for {type(module).__name__}: {e}")
+        print(f"🔗 Shared model weights: {shared}")
+        return shared
+
+    # ---------------- Readiness ----------------
+
+    def is_ready(self):
+        return self._done.is_set() and all(self.status[m] == "ready" for m in self.REQUIRED_MODELS)
+
+    def wait_loaded(self, timeout=None):
+        """รอให้ขั้นตอนโหลดจบ (สำเร็จหรือไม่ก็ตาม) คืนค่า False ถ้าหมดเวลา (ยังไม่เริ่มโหลด -> เริ่มเลย)"""
+        self.start()
+        return self._done.wait(timeout)
+
+    def wait_ready(self, timeout=None):
+        """รอให้โหลดเสร็จ (คืนค่า True ถ้าพร้อมใช้งาน)"""
+        self.start()
+        self._done.wait(timeout)
+        return self.is_ready()
+
+    def health(self):
+        """
+        สถานะสำหรับ /api/health/ready (ไม่เริ่มโหลดเอง)
+        ตอน MALARIAX_MODELS_AUTOLOAD=0 ผู้เรียก Readiness Probe ต้อง start() ก่อน ไม่งั้นไม่มีวันพร้อม
+        """
+        return {
+            "ready": self.is_ready(),
+            "loading_started": self._thread is not None or self._done.is_set(),
+            "loading_finished": self._done.is_set(),
+            "models": dict(self.status),
+            "resnet_backend": self.resnet_backend,
+            "load_seconds": dict(self.timings)
+        }
+
@@ -0,0 +1,410 @@
+import os
+import uuid
+import cv2
+import numpy as np
+from collections import Counter
+
+import config
+import metrics
+from config import (UPLOAD_FOLDER, SEGMENTED_FOLDER, PROCESSED_FOLDER, DEBUG_FOLDER,
+                    RESNET_BATCH_SIZE, YOLO_BATCH_SIZE)
+
+# --- Import Pipeline ---
+# cellpose_segmenter / model_loader / yolo_counter (torch, cellpose, ultralytics) import ตอนวิเคราะห์ครั้งแรก
+# ใน _run_analysis -> import app ได้เร็ว (ModelManager import ให้แล้วใน Background ระหว่างโหลดโมเดล)
+from cell_record import (save_cells, save_sorted_cells, save_atlas, load_atlas_crop, atlas_contains,
+                         ATLAS_IMAGE)
+from image_processor import apply_circular_mask
+
+# Import Algorithms
+from algoritum.findsize import process_cell_sizes, amoeboid_label, SIZE_THRESHOLDS
+from algoritum.diastant import calculate_marginal_ratios
+from algoritum.cellfeatures import PREPROCESS, AMOEBOID_CIRCULARITY
+from algoritum import removebg  # <--- เรียกใช้ไฟล์ตัดพื้นหลัง
+from viz_renderer import distance_spec, size_spec, write_viz_index
+from result_cache import build_version
+
+# เกณฑ์ของ Pipeline เอง (Classification / Overall Diagnosis)
+CONFIDENCE_THRESHOLD = 90.0   # ResNet มั่นใจน้อยกว่านี้ (%) -> ไม่ใช่ Class ที่ทำนาย
+AMOEBOID_DIAGNOSIS_MIN = 2    # Amoeboid มากกว่านี้ในภาพปกติ -> Potential P. vivax
+
+# ค่าที่กำหนดผลลัพธ์ของการวิเคราะห์ (Preprocess ของ Feature + เกณฑ์ของโมเดล / Segmentation / Size ทั้งหมด)
+# เปลี่ยนค่าใดก็ตาม -> PIPELINE_VERSION เปลี่ยนเอง -> Result Cache เก่าใช้ไม่ได้โดยไม่ต้องจำเลขเวอร์ชัน
+# (Backend ของ ResNet / ไฟล์โมเดล / device_profile อยู่ใน Key ของ Cache ที่ app.py)
+PIPELINE_PARAMETERS = {
+    "preprocess": PREPROCESS,
+    "amoeboid_circularity": AMOEBOID_CIRCULARITY,
+    "size": SIZE_THRESHOLDS,
+    "confidence_threshold": CONFIDENCE_THRESHOLD,
+    "amoeboid_diagnosis_min": AMOEBOID_DIAGNOSIS_MIN,
+    "cellpose": (config.CELLPOSE_FLOW_THRESHOLD, config.CELLPOSE_CELLPROB_THRESHOLD),
+    "cell_area_ratio": (config.CELL_AREA_MIN_RATIO, config.CELL_AREA_MAX_RATIO),
+    "resnet": (config.AI_CONFIDENCE_THRESHOLD, config.TEXTURE_THRESHOLD),
+    "yolo_confidence": config.YOLO_CONFIDENCE,
+    "tiling": (config.TILED_MIN_SIZE, config.TILE_SIZE, config.TILE_OVERLAP),
+    "crop_atlas": config.CROP_ATLAS,
+    "calibration_enabled": config.CALIBRATION_ENABLED,
+}
+# เพิ่มเลขนี้เฉพาะเมื่อ Logic หรือรูปแบบผลลัพธ์เปลี่ยนโดยที่ค่าใน PIPELINE_PARAMETERS ไม่เปลี่ยน
+PIPELINE_SCHEMA = 5
+PIPELINE_VERSION = f"{PIPELINE_SCHEMA}-{build_version(sorted(PIPELINE_PARAMETERS.items()))}"
+
+# URL prefix ที่ส่งให้หน้าเว็บ -> โฟลเดอร์จริงบน Disk
+ARTIFACT_ROUTES = {
+    'uploads': UPLOAD_FOLDER,
+    'debug_crops': DEBUG_FOLDER,
+    'cells': SEGMENTED_FOLDER,
+    'processed': PROCESSED_FOLDER,
+}
+
+def artifact_path(url):
+    """แปลง URL ในผลลัพธ์ (เช่น cells/<session>/cell_crop_1.png) เป็น path ของไฟล์บน Disk"""
+    prefix, _, rel = url.partition('/')
+    folder = ARTIFACT_ROUTES.get(prefix)
+    if folder is None or not rel: return None
+    return os.path.join(folder, rel)
+
+def load_artifact_image(url):
+    """อ่านภาพตาม URL ในผลลัพธ์ (crop ที่อยู่ใน Atlas จะถูกตัดออกมาให้) คืนค่า None ถ้าไม่มี"""
+    path = artifact_path(url)
+    if path is None: return None
+    if os.path.exists(path): return cv2.imread(path)
+    if url.startswith('cells/'):
+        return load_atlas_crop(os.path.dirname(path), os.path.basename(path))
+    return None
+
+def artifact_available(url):
+    """มีไฟล์บน Disk หรือมีอยู่ใน Atlas ของ Session"""
+    path = artifact_path(url)
+    if path is None: return False
+    if os.path.exists(path): return True
+    return url.startswith('cells/') and atlas_contains(os.path.dirname(path), os.path.basename(path))
+
+def artifacts_exist(payload, can_render=None):
+    """
+    ตรวจว่าไฟล์ภาพทั้งหมดที่ผลลัพธ์อ้างถึงยังอยู่บน Disk
+    can_render(rel_path): ภาพใน processed/ ที่ยังไม่ถูกวาด (Lazy Viz) ถือว่าใช้ได้ถ้ายังวาดได้
+    """
+    urls = [payload.get('original_image_url'), (payload.get('crop_atlas') or {}).get('url')]
+    for item in payload.get('vit_characteristics', []):
+        urls += [item.get('url'), item.get('distance_viz_url')]
+    for item in payload.get('size_analysis', []):
+        urls.append(item.get('visualization_url'))
+
+    for url in urls:
+        if not url: continue
+        if artifact_available(url): continue
+        prefix, _, rel = url.partition('/')
+        if prefix == 'processed' and can_render is not None and can_render(rel): continue
+        return False
+    return True
+
+# ลำดับขั้นตอนของ Pipeline (ใช้รายงานความคืบหน้าให้ Client)
+STAGES = ['preprocess', 'segmentation', 'filtering', 'classification', 'chromatin', 'size_analysis', 'done']
+
+def run_analysis(file_bytes, filename, models, on_stage=None, session_id=None, save_artifacts=None,
+                 calibration=None, device_profile=None, viz=None, on_cell=None):
+    """
+    Pipeline วิเคราะห์ภาพ 1 ภาพแบบครบขั้นตอน (ใช้ร่วมกันทั้ง /api/analyze และ Job แบบ Async)
+    file_bytes: ข้อมูลไฟล์ภาพที่อัปโหลด, filename: ชื่อไฟล์เดิม (ใช้เอานามสกุล)
+    models: ModelManager ที่โหลดเสร็จแล้ว
+    on_stage: callback(stage, data) เรียกทุกครั้งที่เข้าขั้นตอนใหม่ พร้อมผลลัพธ์บางส่วน
+    save_artifacts: บันทึกไฟล์ภาพลง Disk หรือไม่ (None = ใช้ค่าจาก config)
+    calibration / device_profile: DiameterCalibration และชื่อกล้อง (ข้ามการประมาณขนาดเซลล์เมื่อ Calibrate แล้ว)
+    viz: False = ไม่สร้างภาพ Visualization เลย (Batch / Automated Caller), None = ตาม config.VIZ_MODE
+    on_cell: callback(ผลของ 1 เซลล์ แบบเดียวกับ vit_characteristics) เรียกทันทีที่เซลล์นั้นได้ผลครบ
+    คืนค่า: (payload dict, HTTP status code)
+    """
+    timer = metrics.StageTimer()
+    try:
+        payload, status = _run_analysis(file_bytes, filename, models, on_stage, session_id, save_artifacts,
+                                        calibration, device_profile, viz, on_cell, timer)
+    finally:
+        timer.finish()
+
+    if status == 200 and payload.get('success'):
+        metrics.CELLS_PER_REQUEST.observe(payload.get('total_cells_segmented', 0))
+        for label, n in payload.get('summary', {}).items():
+            metrics.CELLS.inc(n, cls=label)
+    return payload, status
+
+def _run_analysis(file_bytes, filename, models, on_stage, session_id, save_artifacts,
+                  calibration, device_profile, viz, on_cell, timer):
+    from cellpose_segmenter import (run_cellpose, compute_label_stats, extract_cells, filter_bad_cells,
+                                    attach_mask_features)
+    from model_loader import predict_batch
+    from algoritum.yolo_counter import count_chromatin_batch
+
+    def report(stage, **data):
+        timer.enter(stage)
+        if on_stage is not None:
+            on_stage(stage, data)
+
+    if save_artifacts is None:
+        save_artifacts = config.SAVE_ARTIFACTS
+    # 'lazy' เก็บแค่ Geometry (viz_index.json) ให้ VizRenderer วาดเมื่อมีคนเปิดดู, 'eager' วาดทันที
+    viz_mode = config.VIZ_MODE if save_artifacts and viz is not False else 'off'
+    viz_specs = {}
+    resnet_model, device, yolo_model = models.resnet, models.device, models.yolo
+
+    if session_id is None:
+        session_id = str(uuid.uuid4())
+    # เก็บชื่อไฟล์ดั้งเดิมไว้
+    original_filename = session_id + os.path.splitext(filename)[1]
+
+    # อ่านภาพจาก Request ตรงๆ ในหน่วยความจำ (ไม่ต้องเขียนแล้วอ่านกลับ)
+    image_bgr = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image_bgr is None: return {'error': 'Invalid image file'}, 400
+
+    final_image_url = None
+    if save_artifacts:
+        upload_path = os.path.join(UPLOAD_FOLDER, original_filename)
+        with metrics.time_write('upload', upload_path), open(upload_path, 'wb') as f:
+            f.write(file_bytes)
+        # ตั้งค่า Default URL เป็นรูปต้นฉบับก่อน (เผื่อ Crop ไม่ผ่าน)
+        final_image_url = f"uploads/{original_filename}"
+
+    # ==================================================================================
+    # 0️⃣ Step 0: Remove Background / Crop Square
+    # ==================================================================================
+    print("0️⃣ Preprocessing: Cropping Inner Square...")
+    report('preprocess')
+    crop_box = None
+
+    try:
+        # 1. ส่งรูปเข้า Algorithm ตัดให้เหลือแค่สี่เหลี่ยมด้านใน
+        cleaned_img_bgr, crop_box = removebg.process_image_with_box(image_bgr)
+
+        # 2. [สำคัญมาก] ให้ Pipeline ไปใช้รูปที่ตัดแล้วทำงานต่อ
+        image_bgr = cleaned_img_bgr
+
+        if save_artifacts:
+            # 3. ตั้งชื่อไฟล์ใหม่ (เติม crop_ ข้างหน้า) แล้วบันทึกลง debug_crops
+            cleaned_filename = "crop_" + original_filename
+            cleaned_filepath = os.path.join(DEBUG_FOLDER, cleaned_filename)
+            with metrics.time_write('debug_crop', cleaned_filepath):
+                cv2.imwrite(cleaned_filepath, cleaned_img_bgr)
+            print(f"✅ Image cropped. Saved at: {cleaned_filepath}")
+
+            # 4. [สำคัญมาก] เปลี่ยน URL ที่จะส่งกลับหน้าเว็บ ให้เป็นรูปที่ตัดแล้ว
+            # เพื่อให้พิกัด Bounding Box ตรงกับภาพที่แสดง
+            final_image_url = f"debug_crops/{cleaned_filename}"
+
+    except Exception as e:
+        print(f"⚠️ Cropping failed (using original image instead): {e}")
+        # ถ้า Error ก็ใช้ภาพเดิมทำงานต่อ
+    # ==================================================================================
+
+    # 1. Segmentation (ทำบนรูปที่ Crop แล้ว)
+    print(f"1️⃣ Running Cellpose Segmentation...")
+    report('segmentation', image_url=final_image_url)
+    calibrated_diameter = calibration.diameter_for(device_profile) if calibration is not None else None
+    masks, used_diameter = run_cellpose(image_bgr, diameter=calibrated_diameter)
+    if masks is None: return {'message': 'No cells found.', 'success': False}, 200
+
+    # Diameter มาจาก Cellpose ประมาณเอง -> ส่งเข้า Calibration (เรียนรู้ / ตรวจ Drift)
+    if calibration is not None and calibrated_diameter is None:
+        calibration.record(device_profile, used_diameter)
+
+    # สถิติของทุกเซลล์จากการกวาด Mask รอบเดียว (ตัดเซลล์ที่ติดขอบภาพออก)
+    cell_stats = [s for s in compute_label_stats(masks) if not s['touches_border']]
+    if not cell_stats: return {'message': 'No cells found.', 'success': False}, 200
+
+    # 2. Filtering (กรองจากสถิติก่อน แล้วค่อยตัด crop เฉพาะเซลล์ที่ผ่าน)
+    print(f"2️⃣ Filtering cells...")
+    report('filtering', cells_segmented=len(cell_stats))
+    cell_stats = filter_bad_cells(cell_stats)
+    if not cell_stats: return {'message': 'All cells filtered.', 'success': False}, 200
+    valid_cells = extract_cells(image_bgr, masks, cell_stats)
+    if config.SIZE_FROM_MASKS:
+        # ขนาด/รูปร่างของทุกเซลล์จาก Mask ของ Cellpose ในครั้งเดียว (ใช้ใน Size Analysis)
+        attach_mask_features(valid_cells, masks)
+
+    # Prepare folders
+    sorted_base_dir = os.path.join(PROCESSED_FOLDER, session_id, 'sorted_by_morphology')
+
+    # 3. Classification
+    print(f"3️⃣ Classifying {len(valid_cells)} cells...")
+    report('classification', total_cells=len(valid_cells), bboxes=[cell.bbox for cell in valid_cells])
+
+    # Preprocess for ResNet (ทำในหน่วยความจำ ไม่ต้องเขียน _temp_mask.png)
+    masked_images = [apply_circular_mask(cell.crop) for cell in valid_cells]
+
+    results_by_id = {}
+
+    def finish_cell(cell):
+        """ผลลัพธ์สุดท้ายของเซลล์ (ได้ผล ResNet / YOLO / Marginal Ratio ครบแล้ว) -> ส่งให้ on_cell ทันที"""
+        marginal_ratio = 0.0
+        chromatin_count = 0
+        chromatin_bboxes = []
+        distance_viz_url = None
+
+        if cell.label == '1chromatin':
+            # B1. ผลวัดระยะห่าง
+            if cell.id in ratio_results:
+                marginal_ratio = ratio_results[cell.id]
+                dist_viz_filename = cell.filename.replace(".png", "_dist_viz.png")
+                dist_viz_rel = f"sorted_by_morphology/{cell.label}/{dist_viz_filename}"
+                if viz_mode == 'eager' or dist_viz_rel in viz_specs:
+                    distance_viz_url = f"processed/{session_id}/{dist_viz_rel}"
+
+            # B2. ผลนับจำนวนจาก YOLO (ถ้าไม่เจอเลยถือว่ามีอย่างน้อย 1 จุด)
+            count, bboxes = yolo_results.get(cell.id, (0, []))
+            chromatin_count = count
+            chromatin_bboxes = bboxes
+            if chromatin_count == 0: chromatin_count = 1
+
+        entry = {
+            "cell": cell.filename,
+            "characteristic": cell.label,
+            "confidence": f"{cell.confidence:.2f}%",
+            "marginal_ratio": marginal_ratio,
+            "chromatin_count": chromatin_count,
+            "chromatin_bboxes": chromatin_bboxes,
+            "distance_viz_url": distance_viz_url,
+            "url": f"cells/{session_id}/{cell.filename}" if save_artifacts else None,
+            "bbox": cell.bbox
+        }
+        results_by_id[cell.id] = entry
+        if on_cell is not None: on_cell(entry)
+
+    def classified(start, batch):
+        for cell, (predicted_label, confidence) in zip(valid_cells[start:start + len(batch)], batch):
+            if resnet_model is not None:
+                if predicted_label != 'nomal_cell' and confidence < CONFIDENCE_THRESHOLD:
+                    predicted_label = 'nomal_cell'
+
+            cell.label = predicted_label
+            cell.confidence = confidence
+            # เซลล์ที่ไม่ใช่ 1chromatin ได้ผลครบแล้ว ไม่ต้องรอ YOLO / Marginal Ratio
+            if predicted_label != '1chromatin': finish_cell(cell)
+
+    # Predict ResNet ทีละ Batch (ส่งผลของแต่ละ Batch ออกไปทันทีที่เสร็จ)
+    ratio_results, yolo_results = {}, {}
+    if resnet_model is not None:
+        predict_batch(resnet_model, device, masked_images, batch_size=RESNET_BATCH_SIZE, on_batch=classified)
+    else:
+        classified(0, [("Unknown", 0.0)] * len(valid_cells))
+
+    report('chromatin', summary=dict(Counter(cell.label for cell in valid_cells)))
+    chromatin_cells = [cell for cell in valid_cells if cell.label == '1chromatin']
+
+    # B1. วัดระยะห่าง (Marginal Ratio) ของทุกเซลล์ 1chromatin ในครั้งเดียว
+    # Preprocess ครั้งเดียว เก็บ CellFeatures ไว้ใน record ให้ Size Analysis ใช้ต่อ
+    if chromatin_cells:
+        dist_viz_paths = [None] * len(chromatin_cells)
+        if viz_mode == 'eager':
+            viz_dir = os.path.join(sorted_base_dir, '1chromatin')
+            os.makedirs(viz_dir, exist_ok=True)
+            dist_viz_paths = [os.path.join(viz_dir, cell.filename.replace(".png", "_dist_viz.png"))
+                              for cell in chromatin_cells]
+        # เซลล์ที่คำนวณไม่สำเร็จได้ Ratio = None -> ไม่ใส่ใน ratio_results (ใช้ค่าเริ่มต้นเหมือนเดิม)
+        ratios, features = calculate_marginal_ratios([cell.crop for cell in chromatin_cells],
+                                                     save_viz_paths=dist_viz_paths)
+        for cell, ratio, feats in zip(chromatin_cells, ratios, features):
+            cell.features = feats
+            if ratio is None: continue
+            ratio_results[cell.id] = ratio
+            if viz_mode == 'lazy' and feats is not None and feats.radial_hull is not None:
+                dist_viz_filename = cell.filename.replace(".png", "_dist_viz.png")
+                viz_specs[f"sorted_by_morphology/1chromatin/{dist_viz_filename}"] = distance_spec(feats)
+
+    # B2. นับจำนวน Chromatin ด้วย YOLO ทั้ง Batch (เซลล์ของแต่ละ Chunk เสร็จแล้วส่งออกทันที)
+    def counted(start, batch):
+        for cell, res in zip(chromatin_cells[start:start + len(batch)], batch):
+            yolo_results[cell.id] = res
+            finish_cell(cell)
+
+    if yolo_model is not None and chromatin_cells:
+        # count_chromatin_batch แบ่ง Chunk ภายในเอง: วัดรวมทั้งชุดของ Request นี้
+        with metrics.time_forward('yolo', len(chromatin_cells)):
+            count_chromatin_batch(yolo_model, [cell.crop for cell in chromatin_cells],
+                                  batch_size=YOLO_BATCH_SIZE, on_chunk=counted)
+    for cell in chromatin_cells:
+        if cell.id not in results_by_id: finish_cell(cell)
+
+    analysis_results = [results_by_id[cell.id] for cell in valid_cells]
+    counts = Counter(entry["characteristic"] for entry in analysis_results)
+
+    # Disk Sink: บันทึก crop ไว้ให้หน้าเว็บเปิดดู (แยกจากการวิเคราะห์)
+    crop_atlas = None
+    if save_artifacts:
+        cells_dir = os.path.join(SEGMENTED_FOLDER, session_id)
+        if config.CROP_ATLAS:
+            # Encode ครั้งเดียว + หน้าเว็บโหลดภาพเดียวต่อ Session
+            with metrics.time_write('atlas', os.path.join(cells_dir, ATLAS_IMAGE)):
+                atlas_index, (atlas_w, atlas_h) = save_atlas(valid_cells, cells_dir)
+            crop_atlas = {"url": f"cells/{session_id}/{ATLAS_IMAGE}", "width": atlas_w, "height": atlas_h,
+                          "cells": atlas_index}
+        else:
+            with metrics.time_write('cells'):
+                save_cells(valid_cells, cells_dir)
+        if config.SAVE_SORTED_COPIES:
+            with metrics.time_write('sorted_copies'):
+                save_sorted_cells(valid_cells, sorted_base_dir)
+
+    # 4. Size Analysis
+    print(f"4️⃣ Analyzing Sizes...")
+    # Stream รายเซลล์ (on_cell) ส่งผลทุกเซลล์ไปแล้ว ไม่ต้องส่งซ้ำ
+    report('size_analysis', **({} if on_cell is not None else {"vit_characteristics": analysis_results}))
+    size_viz_root = os.path.join(sorted_base_dir, "size_visualization") if viz_mode == 'eager' else None
+    size_data_raw, amoeboid_count = process_cell_sizes(valid_cells, viz_root=size_viz_root,
+                                                       workers=config.SIZE_WORKERS)
+
+    size_analysis_for_web = []
+    cells_by_name = {cell.filename: cell for cell in valid_cells}
+    if size_data_raw:
+        for fname, details in size_data_raw.items():
+            viz_url = None
+            if details.get('viz_image'):
+                rel_path = os.path.relpath(details['viz_image'], PROCESSED_FOLDER).replace("\\", "/")
+                viz_url = f"processed/{rel_path}"
+            elif viz_mode == 'lazy' and fname in cells_by_name:
+                cell = cells_by_name[fname]
+                feats = cell.mask_features if cell.mask_features is not None else cell.features
+                viz_rel = f"sorted_by_morphology/size_visualization/{details['folder']}/{fname}"
+                label = amoeboid_label(details.get('circularity', 0), details.get('shape_status'))
+                viz_specs[viz_rel] = size_spec(f"cells/{session_id}/{fname}", feats, label)
+                viz_url = f"processed/{session_id}/{viz_rel}"
+
+            size_analysis_for_web.append({
+                "filename": fname,
+                "folder": details['folder'],
+                "size_px": details['size_px'],
+                "ratio": details['ratio'],
+                "status": details.get('size_status', 'Unknown'),
+                "shape": details.get('shape_status', 'Unknown'),
+                "circularity": details.get('circularity', 0),
+                "visualization_url": viz_url 
+            })
+
+    # Geometry ของ Lazy Viz (crop ต้นทางถูกบันทึกไว้แล้วใน Disk Sink ด้านบน)
+    if viz_specs:
+        with metrics.time_write('viz_index'):
+            write_viz_index(os.path.join(PROCESSED_FOLDER, session_id), viz_specs)
+
+    # Overall Diagnosis
+    overall_diagnosis = "Normal / No Parasite Detected"
+    if counts['schuffner dot'] > 0: overall_diagnosis = "P. vivax Detected"
+    elif counts['band form'] > 0 or counts['basket form'] > 0: overall_diagnosis = "P. malariae Detected"
+    elif counts['1chromatin'] > 0: overall_diagnosis = "P. falciparum Detected"
+
+    if amoeboid_count > AMOEBOID_DIAGNOSIS_MIN and overall_diagnosis == "Normal / No Parasite Detected":
+        overall_diagnosis = "Potential P. vivax (Amoeboid forms observed)"
+
+    return {
+        "session_id": session_id,
+        # ส่ง URL ของภาพที่ Crop แล้วกลับไปให้หน้าเว็บแสดงผล (เพื่อให้กรอบแดงตรงตำแหน่ง)
+        "original_image_url": final_image_url, 
+        "overall_diagnosis": overall_diagnosis,
+        "total_cells_segmented": len(valid_cells),
+        "vit_characteristics": analysis_results, 
+        "crop_atlas": crop_atlas,
+        # ตำแหน่งของภาพที่วิเคราะห์ในภาพที่อัปโหลด [x1, y1, x2, y2] (None = ใช้ภาพเต็ม) สำหรับแปลง bbox กลับ
+        "crop_box": [int(v) for v in crop_box] if crop_box is not None else None,
+        "size_analysis": size_analysis_for_web, 
+        "amoeboid_count": amoeboid_count,
+        "summary": dict(counts),
+        "success": True
+    }, 200
+
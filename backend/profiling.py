@@ -0,0 +1,135 @@
+"""
+Profiling ราย Request (เปิดด้วย ?profile=1 หรือ Header X-Profile เมื่อ config.PROFILING_ENABLED)
+- 'sample':   Sampling Profiler สุ่มดู Stack ของ Thread ที่รัน Request ทุก N ms -> profile.folded
+              (Collapsed Stack: เปิดด้วย speedscope.app หรือ flamegraph.pl ได้ทันที)
+- 'cprofile': cProfile ทุก Function Call -> profile.prof (snakeviz / pstats) + profile.txt (Top Functions)
+ไฟล์เก็บไว้ใน processed_results/<session>/ (ถูกลบพร้อม Session โดย Retention)
+
+หมายเหตุ: วัดเฉพาะ Thread ของ Request งานที่ส่งไป ThreadPoolExecutor (findsize / Tile ของ Cellpose)
+จะเห็นเป็นเวลาที่รอผลใน Thread หลัก
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+MODES = ('sample', 'cprofile')
+PROFILE_FILES = {'folded': 'profile.folded', 'prof': 'profile.prof', 'txt': 'profile.txt'}
+
+# Profile ได้ครั้งละ 1 Request ต่อ Process (cProfile ซ้อนกันไม่ได้ และไม่ให้ Overhead สะสม)
+_active = threading.Lock()
+
+def _frame_label(frame):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ',')
+
+class SamplingProfiler:
+    """สุ่มอ่าน Stack ของ Thread เป้าหมายด้วย sys._current_frames() แล้วนับจำนวนครั้งต่อ Stack"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='malariax-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write_folded(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+class RequestProfile:
+    """with RequestProfile(...): run_analysis(...) แล้วเขียนไฟล์ลง out_dir ตอนออกจาก Block"""
+
+    def __init__(self, mode, out_dir, interval=0.005):
+        self.mode = mode
+        self.out_dir = out_dir
+        self.interval = interval
+        self.files = {}
+        self.duration = None
+        self.samples = None
+        self._profiler = None
+
+    def __enter__(self):
+        if self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+        else:
+            self._profiler = SamplingProfiler(threading.get_ident(), self.interval)
+        self._started = time.perf_counter()
+        if self.mode == 'cprofile':
+            self._profiler.enable()
+        else:
+            self._profiler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.mode == 'cprofile':
+                self._profiler.disable()
+            else:
+                self._profiler.stop()
+            self.duration = round(time.perf_counter() - self._started, 3)
+            self._write()
+        except OSError as e:
+            print(f"⚠️ Cannot write profile: {e}")
+        finally:
+            _active.release()
+        return False
+
+    def _write(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self.mode == 'cprofile':
+            self._profiler.dump_stats(os.path.join(self.out_dir, PROFILE_FILES['prof']))
+            text = io.StringIO()
+            pstats.Stats(self._profiler, stream=text).sort_stats('cumulative').print_stats(40)
+            with open(os.path.join(self.out_dir, PROFILE_FILES['txt']), 'w', encoding='utf-8') as f:
+                f.write(text.getvalue())
+            self.files = {kind: PROFILE_FILES[kind] for kind in ('prof', 'txt')}
+        else:
+            self._profiler.write_folded(os.path.join(self.out_dir, PROFILE_FILES['folded']))
+            self.samples = sum(self._profiler.samples.values())
+            self.files = {'folded': PROFILE_FILES['folded']}
+        print(f"🔍 Profile ({self.mode}, {self.duration}s) saved to {self.out_dir}")
+
+    def summary(self, session_id):
+        return {
+            "mode": self.mode,
+            "duration_seconds": self.duration,
+            "samples": self.samples,
+            "files": {kind: f"api/profile/{session_id}/{kind}" for kind in self.files}
+        }
+
+def acquire(mode, out_dir, interval=0.005):
+    """คืนค่า RequestProfile หรือ None ถ้ามี Request อื่นกำลังถูก Profile อยู่ใน Process นี้"""
+    if mode not in MODES: mode = 'sample'
+    if not _active.acquire(blocking=False): return None
+    return RequestProfile(mode, out_dir, interval)
+
+def profile_path(processed_folder, session_id, kind):
+    """Path ของไฟล์ Profile ที่ดาวน์โหลดได้ (None ถ้าไม่มี)"""
+    name = PROFILE_FILES.get(kind)
+    if name is None: return None
+    path = os.path.join(processed_folder, session_id, name)
+    return path if os.path.isfile(path) else None
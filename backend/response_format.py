@@ -0,0 +1,113 @@
+import gzip
+import json
+
+try:
+    import msgpack  # Optional: pip install msgpack
+except ImportError:
+    msgpack = None
+
+# ผลลัพธ์แบบย่อ (Compact): ข้อมูลรายเซลล์เป็น Column (1 list ต่อ 1 Field) แทน list ของ dict
+# รวม vit_characteristics + size_analysis เป็นตารางเดียว (ไม่ซ้ำข้อมูลของเซลล์เดียวกัน 2 ที่)
+COMPACT_FORMAT_VERSION = 1
+
+MSGPACK_MIME = 'application/msgpack'
+GZIP_MIN_BYTES = 1024  # Response เล็กกว่านี้ไม่คุ้มที่จะบีบอัด
+
+def _confidence(value):
+    """'97.12%' -> 97.12"""
+    if isinstance(value, (int, float)): return float(value)
+    try: return float(str(value).rstrip('%'))
+    except ValueError: return 0.0
+
+def _strip(url, prefix):
+    """ตัด prefix ของ Session ออกจาก URL (เหลือ path สั้นๆ) ถ้าไม่ตรง prefix คืนค่าเดิม"""
+    if not url: return None
+    return url[len(prefix):] if url.startswith(prefix) else url
+
+def compact_payload(payload, offset=0, limit=None):
+    """
+    แปลงผลลัพธ์ของ run_analysis เป็นแบบ Compact
+    - confidence เป็นตัวเลข, bbox เป็น [x, y, w, h], chromatin_bboxes เป็นจำนวนเต็ม
+    - URL รายเซลล์เก็บแค่ path หลัง url_prefix ของแต่ละ Route (cells / processed)
+    - offset / limit: แบ่งหน้าข้อมูลรายเซลล์ (ภาพที่มีเซลล์หนาแน่นมาก)
+    """
+    if not payload.get('success'):
+        return payload
+
+    session_id = payload.get('session_id')
+    prefixes = {"cells": f"cells/{session_id}/", "processed": f"processed/{session_id}/"}
+    sizes = {item.get('filename'): item for item in payload.get('size_analysis', [])}
+
+    cells = payload.get('vit_characteristics', [])
+    total = len(cells)
+    offset = max(0, int(offset or 0))
+    end = total if limit is None else min(total, offset + max(0, int(limit)))
+    page = cells[offset:end]
+
+    columns = {name: [] for name in (
+        "cell", "characteristic", "confidence", "bbox", "marginal_ratio", "chromatin_count",
+        "chromatin_bboxes", "url", "distance_viz", "size_px", "size_ratio", "size_status",
+        "shape", "circularity", "size_viz")}
+
+    for item in page:
+        bbox = item.get('bbox') or {}
+        size = sizes.get(item.get('cell')) or {}
+        columns["cell"].append(item.get('cell'))
+        columns["characteristic"].append(item.get('characteristic'))
+        columns["confidence"].append(round(_confidence(item.get('confidence')), 2))
+        columns["bbox"].append([bbox.get('x'), bbox.get('y'), bbox.get('w'), bbox.get('h')])
+        columns["marginal_ratio"].append(item.get('marginal_ratio'))
+        columns["chromatin_count"].append(item.get('chromatin_count'))
+        columns["chromatin_bboxes"].append([[int(round(v)) for v in box] for box in item.get('chromatin_bboxes') or []])
+        columns["url"].append(_strip(item.get('url'), prefixes["cells"]))
+        columns["distance_viz"].append(_strip(item.get('distance_viz_url'), prefixes["processed"]))
+        columns["size_px"].append(size.get('size_px'))
+        columns["size_ratio"].append(size.get('ratio'))
+        columns["size_status"].append(size.get('status'))
+        columns["shape"].append(size.get('shape'))
+        columns["circularity"].append(size.get('circularity'))
+        columns["size_viz"].append(_strip(size.get('visualization_url'), prefixes["processed"]))
+
+    compact = {key: value for key, value in payload.items()
+               if key not in ('vit_characteristics', 'size_analysis', 'crop_atlas')}
+    atlas = payload.get('crop_atlas')
+    if atlas:
+        # Index ของ Atlas เรียงตามลำดับเซลล์ในหน้านี้ (ไม่ต้องส่งชื่อไฟล์ซ้ำ)
+        compact["crop_atlas"] = {"url": atlas.get('url'), "width": atlas.get('width'), "height": atlas.get('height'),
+                                 "rects": [atlas.get('cells', {}).get(name) for name in columns["cell"]]}
+    compact.update({
+        "format": "compact",
+        "format_version": COMPACT_FORMAT_VERSION,
+        "url_prefix": prefixes,
+        "cells": columns,
+        "page": {"offset": offset, "limit": limit, "count": len(page), "total": total,
+                 "next_offset": end if end < total else None}
+    })
+    return compact
+
+# Header ที่ใช้เลือกรูปแบบ Response (ใส่ใน Vary ของทุก Response ที่ผ่าน negotiate)
+VARY = 'Accept, Accept-Encoding'
+
+def negotiate(accept, accept_encoding, compress=False):
+    """
+    เลือกรูปแบบ (json / msgpack) และการบีบอัด (gzip / None) จาก Header ของ Request
+    compress: gzip เฉพาะเมื่อขอไว้ (?compress=1 หรือ config.RESPONSE_GZIP) และ Client รับ gzip ได้
+    ค่าเริ่มต้นจึงเป็น JSON แบบไม่บีบอัดเหมือนเดิม
+    """
+    accept = (accept or '').lower()
+    wants_gzip = compress and 'gzip' in (accept_encoding or '').lower()
+    fmt = 'msgpack' if msgpack is not None and (MSGPACK_MIME in accept or 'x-msgpack' in accept) else 'json'
+    return fmt, ('gzip' if wants_gzip else None)
+
+def encode(data, fmt='json', encoding=None):
+    """คืนค่า (body bytes, mimetype, headers)"""
+    if fmt == 'msgpack' and msgpack is not None:
+        body, mimetype = msgpack.packb(data, use_bin_type=True), MSGPACK_MIME
+    else:
+        body, mimetype = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 'application/json'
+
+    headers = {'Vary': VARY}
+    if encoding == 'gzip' and len(body) >= GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    return body, mimetype, headers
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import metrics
+
+def build_version(*parts, files=()):
+    """
+    สร้าง Version String ของ Cache จากค่าตั้งค่าของ Pipeline + ข้อมูลไฟล์โมเดล (ขนาด / เวลาแก้ไข)
+    ถ้าเปลี่ยนโมเดลหรือ Config ผลลัพธ์เก่าใน Cache จะใช้ไม่ได้อัตโนมัติ
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(repr(part).encode('utf-8'))
+    for path in files:
+        try:
+            st = os.stat(path)
+            h.update(f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}".encode('utf-8'))
+        except OSError:
+            h.update(f"{os.path.basename(path)}:missing".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+class ResultCache:
+    """
+    Cache ผลลัพธ์ JSON ของ /api/analyze โดยใช้ Hash ของไฟล์ที่อัปโหลด + Version ของโมเดล/Config เป็น Key
+    - เก็บบน Disk (1 ไฟล์ต่อ 1 Entry) ใช้ร่วมกันได้ทุก Worker Process
+    - LRU: ทุกครั้งที่ Hit จะอัปเดต mtime แล้วลบ Entry ที่เก่าที่สุดเมื่อเกินจำนวนหรือขนาดที่กำหนด
+    - validate(payload): ตรวจว่าไฟล์ภาพที่ payload อ้างถึงยังอยู่ครบ (ถ้าถูกลบไปแล้วถือว่า Miss)
+    """
+
+    def __init__(self, cache_dir, version, max_entries=500, max_bytes=200 * 1024 * 1024, validate=None):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key_for(self, file_bytes, variant=''):
+        """variant: ตัวเลือกของ Request ที่ทำให้ผลลัพธ์ต่างกัน (เช่นปิด Visualization)"""
+        h = hashlib.sha256()
+        h.update(self.version.encode('utf-8'))
+        h.update(variant.encode('utf-8'))
+        h.update(file_bytes)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+
+        if self.validate is not None and not self.validate(payload):
+            # ภาพที่ผลลัพธ์อ้างถึงหายไปแล้ว (เช่นถูก Retention ลบ) -> ต้องวิเคราะห์ใหม่
+            self._remove(path)
+            self._count(hit=False)
+            return None
+
+        try: os.utime(path, None)  # ขยับเป็น "ใช้ล่าสุด" สำหรับ LRU
+        except OSError: pass
+        self._count(hit=True)
+        return payload
+
+    def put(self, key, payload):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with metrics.time_write('result_cache', tmp_path), open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Cache write failed: {e}")
+            self._remove(tmp_path)
+            return
+        self._evict()
+
+    def _evict(self):
+        """ลบ Entry ที่ไม่ได้ใช้นานที่สุด จนกว่าจะอยู่ในขอบเขตทั้งจำนวนและขนาดรวม"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'): continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, name = entries.pop(0)
+            if self._remove(os.path.join(self.cache_dir, name)):
+                total_bytes -= size
+                with self._lock:
+                    self.evictions += 1
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def _count(self, hit):
+        with self._lock:
+            if hit: self.hits += 1
+            else: self.misses += 1
+
+    def stats(self):
+        entries, total_bytes = 0, 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                entries += 1
+                try: total_bytes += os.path.getsize(os.path.join(self.cache_dir, name))
+                except OSError: pass
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "timestamp": time.time()
+            }
@@ -0,0 +1,198 @@
+import os
+import re
+import shutil
+import threading
+import time
+
+# ทุก Request ใช้ uuid เดียวกันทั้งชื่อไฟล์อัปโหลด, crop_<id> และโฟลเดอร์ Session
+_SESSION_RE = re.compile(r'^(?:crop_)?([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(?:\.[A-Za-z0-9]+)?$')
+
+def _session_of(name):
+    match = _SESSION_RE.match(name)
+    return match.group(1) if match else None
+
+def _size_of(path):
+    """คืนค่า (bytes, จำนวนไฟล์) ของไฟล์หรือโฟลเดอร์"""
+    if not os.path.isdir(path):
+        try: return os.path.getsize(path), 1
+        except OSError: return 0, 0
+    total, count = 0, 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try: total += os.path.getsize(os.path.join(root, name))
+            except OSError: continue
+            count += 1
+    return total, count
+
+class RetentionManager:
+    """
+    ลบไฟล์ของ Session เก่าออกจากโฟลเดอร์ทำงาน (uploads / debug_crops / segmented_cells / processed_results / viz_cache)
+    - TTL: Session ที่ไม่มีการเขียนไฟล์ใหม่นานกว่า session_ttl วินาทีจะถูกลบ
+    - Quota: ถ้าขนาดรวมเกิน max_bytes จะลบ Session ที่เก่าที่สุดก่อน จนกว่าจะอยู่ในโควตา
+    - Session ที่อายุน้อยกว่า grace วินาทีจะไม่ถูกลบเลย (กำลังวิเคราะห์อยู่ / เพิ่งส่งผลให้หน้าเว็บ)
+    - Sweeper Thread ทำงานทุก interval วินาที ถ้ามีหลาย Process จะ Sweep ได้ทีละ Process (Lock File)
+    ไฟล์ที่ชื่อไม่ใช่ uuid ของ Session จะไม่ถูกแตะ
+    """
+
+    def __init__(self, folders, session_ttl=86400, max_bytes=2 * 1024 * 1024 * 1024,
+                 interval=600, grace=300, lock_path=None):
+        self.folders = list(folders)
+        self.session_ttl = session_ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.grace = grace
+        self.lock_path = lock_path
+        self.sweeps = 0
+        self.total_sessions_removed = 0
+        self.total_bytes_reclaimed = 0
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ================== SCAN ==================
+
+    def scan(self):
+        """รวมไฟล์/โฟลเดอร์ของแต่ละ Session จากทุกโฟลเดอร์ คืนค่า {session_id: {"paths", "bytes", "files", "mtime"}}"""
+        sessions = {}
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                session_id = _session_of(entry.name)
+                if session_id is None: continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                size, files = _size_of(entry.path)
+                info = sessions.setdefault(session_id, {"paths": [], "bytes": 0, "files": 0, "mtime": 0})
+                info["paths"].append(entry.path)
+                info["bytes"] += size
+                info["files"] += files
+                info["mtime"] = max(info["mtime"], mtime)
+        return sessions
+
+    # ================== SWEEP ==================
+
+    def sweep(self):
+        """ลบ Session ที่หมดอายุ แล้วลบ Session เก่าสุดจนอยู่ในโควตา คืนค่ารายงานสิ่งที่ลบไป"""
+        started = time.time()
+        if not self._acquire():
+            return {"skipped": True, "reason": "another process is sweeping"}
+
+        try:
+            sessions = self.scan()
+            total_bytes = sum(s["bytes"] for s in sessions.values())
+            now = time.time()
+            removable = sorted(((s["mtime"], sid) for sid, s in sessions.items() if now - s["mtime"] > self.grace))
+
+            expired, evicted = [], []
+            for mtime, sid in removable:
+                if self.session_ttl and now - mtime > self.session_ttl:
+                    expired.append(sid)
+                elif self.max_bytes and total_bytes > self.max_bytes:
+                    evicted.append(sid)
+                else:
+                    continue
+                total_bytes -= sessions[sid]["bytes"]
+
+            bytes_reclaimed, files_removed = 0, 0
+            for sid in expired + evicted:
+                info = sessions[sid]
+                for path in info["paths"]:
+                    self._remove(path)
+                bytes_reclaimed += info["bytes"]
+                files_removed += info["files"]
+        finally:
+            self._release()
+
+        report = {
+            "sessions_scanned": len(sessions),
+            "expired": len(expired),
+            "evicted": len(evicted),
+            "files_removed": files_removed,
+            "bytes_reclaimed": bytes_reclaimed,
+            "bytes_remaining": total_bytes,
+            "duration": round(time.time() - started, 3),
+            "timestamp": started
+        }
+        with self._lock:
+            self.sweeps += 1
+            self.total_sessions_removed += len(expired) + len(evicted)
+            self.total_bytes_reclaimed += bytes_reclaimed
+            self.last_report = report
+
+        if expired or evicted:
+            print(f"🧹 Retention: removed {len(expired)} expired + {len(evicted)} over-quota sessions "
+                  f"({files_removed} files, {bytes_reclaimed / 1024 / 1024:.1f} MB)")
+        return report
+
+    def _remove(self, path):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except OSError as e:
+            print(f"⚠️ Retention cannot remove {path}: {e}")
+
+    def _acquire(self):
+        """Lock File ข้าม Process (gunicorn หลาย Worker) ถ้าค้างนานเกิน 2 รอบถือว่า Process เดิมตายไปแล้ว"""
+        if not self.lock_path: return True
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode('utf-8'))
+                os.close(fd)
+                return True
+            except FileExistsError:
+                try:
+                    stale = time.time() - os.path.getmtime(self.lock_path) > max(self.interval * 2, 60)
+                    if not stale: return False
+                    os.remove(self.lock_path)
+                except OSError:
+                    return False
+            except OSError:
+                return False
+        return False
+
+    def _release(self):
+        if not self.lock_path: return
+        try: os.remove(self.lock_path)
+        except OSError: pass
+
+    # ================== BACKGROUND THREAD ==================
+
+    def start(self):
+        """เริ่ม Sweeper Thread (เรียกซ้ำได้ ต้องเรียกหลัง fork ในโหมด gunicorn, ดู gunicorn.conf.py)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive(): return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="retention-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ Retention sweep failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "session_ttl": self.session_ttl,
+                "max_bytes": self.max_bytes,
+                "interval": self.interval,
+                "running": self._thread is not None and self._thread.is_alive(),
+                "sweeps": self.sweeps,
+                "total_sessions_removed": self.total_sessions_removed,
+                "total_bytes_reclaimed": self.total_bytes_reclaimed,
+                "last_report": self.last_report
+            }
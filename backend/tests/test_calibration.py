@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# เพิ่ม Path เพื่อหา calibration.py (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from calibration import DiameterCalibration
+except ImportError:  # ต้องติดตั้ง numpy
+    DiameterCalibration = None
+
+@unittest.skipIf(DiameterCalibration is None, "calibration ต้องใช้ numpy")
+class DiameterCalibrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'calibration.json')
+
+    def _calibration(self, **kwargs):
+        kwargs.setdefault('min_samples', 3)
+        kwargs.setdefault('reestimate_every', 0)
+        return DiameterCalibration(self.path, **kwargs)
+
+    def test_converges_after_stable_samples(self):
+        cal = self._calibration()
+        self.assertIsNone(cal.diameter_for('scope-1'))
+        for diameter in (30.0, 30.5, 29.8):
+            cal.record('scope-1', diameter)
+        self.assertEqual(cal.diameter_for('scope-1'), 30.0)
+        # Profile อื่นยังต้องเรียนรู้เอง
+        self.assertIsNone(cal.diameter_for('scope-2'))
+
+    def test_noisy_samples_do_not_converge(self):
+        cal = self._calibration()
+        for diameter in (20.0, 30.0, 40.0):
+            cal.record('scope-1', diameter)
+        self.assertIsNone(cal.diameter_for('scope-1'))
+
+    def test_drift_restarts_learning(self):
+        cal = self._calibration()
+        for diameter in (30.0, 30.0, 30.0):
+            cal.record('scope-1', diameter)
+        self.assertEqual(cal.diameter_for('scope-1'), 30.0)
+
+        cal.record('scope-1', 45.0)  # เปลี่ยนเลนส์ -> ต่างเกิน drift_tolerance
+        self.assertIsNone(cal.diameter_for('scope-1'))
+        for diameter in (45.0, 45.0):
+            cal.record('scope-1', diameter)
+        self.assertEqual(cal.diameter_for('scope-1'), 45.0)
+
+    def test_reestimates_periodically(self):
+        cal = self._calibration(reestimate_every=3)
+        for diameter in (30.0, 30.0, 30.0):
+            cal.record('scope-1', diameter)
+        answers = [cal.diameter_for('scope-1') for _ in range(3)]
+        self.assertEqual(answers, [30.0, 30.0, None])
+
+    def test_persists_and_limits_profiles(self):
+        cal = self._calibration(allowed_profiles=['scope-1'])
+        for diameter in (30.0, 30.0, 30.0):
+            cal.record('scope-1', diameter)
+        cal.record('unknown', 50.0)  # ไม่อยู่ใน Allow-list -> บันทึกเป็น default
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        self.assertEqual(set(saved), {'scope-1', 'default'})
+        self.assertEqual(self._calibration().diameter_for('scope-1'), 30.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import random
+import sys
+import unittest
+
+# เพิ่ม Path เพื่อหา algoritum/ (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import numpy as np
+    from algoritum.cellfeatures import find_edge_point, find_edge_points
+except ImportError:  # ต้องติดตั้ง numpy / opencv
+    np = None
+
+def _hull(rng, n):
+    """Hull สุ่ม n จุด รูปแบบเดียวกับ cv2.convexHull (n, 1, 2)"""
+    return np.array([[[rng.randint(0, 100), rng.randint(0, 100)]] for _ in range(n)], dtype=np.int32)
+
+@unittest.skipIf(np is None, "cellfeatures ต้องใช้ numpy / opencv")
+class FindEdgePointsTest(unittest.TestCase):
+
+    def test_batch_matches_per_cell(self):
+        rng = random.Random(0)
+        hulls, centers, targets = [], [], []
+        for _ in range(50):
+            hulls.append(_hull(rng, rng.randint(3, 30)))
+            centers.append((rng.randint(30, 70), rng.randint(30, 70)))
+            targets.append((rng.randint(0, 100), rng.randint(0, 100)))
+
+        expected = [find_edge_point(h, cx, cy, px, py) for h, (cx, cy), (px, py) in zip(hulls, centers, targets)]
+        self.assertEqual(find_edge_points(hulls, centers, targets), expected)
+
+    def test_ties_pick_first_hull_point(self):
+        # จุดที่ 0 และ 1 อยู่ในทิศเดียวกันพอดี -> ทั้งสองแบบต้องเลือกจุดแรก
+        hull = np.array([[[60, 50]], [[80, 50]], [[50, 80]]], dtype=np.int32)
+        self.assertEqual(find_edge_point(hull, 50, 50, 55, 50), (60, 50))
+        self.assertEqual(find_edge_points([hull], [(50, 50)], [(55, 50)]), [(60, 50)])
+
+    def test_empty_inputs(self):
+        self.assertEqual(find_edge_points([], [], []), [])
+        empty = np.zeros((0, 1, 2), dtype=np.int32)
+        self.assertEqual(find_edge_point(empty, 5, 5, 7, 8), (7, 8))
+        self.assertEqual(find_edge_points([empty], [(5, 5)], [(7, 8)]), [(7, 8)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+# เพิ่ม Path เพื่อหา jobs.py (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import JobManager
+
+def _analyze(on_stage=None, cells=0):
+    """Pipeline จำลอง: ส่ง Event รายเซลล์ตามจำนวน cells แล้วคืนผล"""
+    on_stage("segment", {})
+    for i in range(cells):
+        on_stage("cell", {"cell_id": i})
+    return {'success': True, 'cells': cells}, 200
+
+class JobManagerTest(unittest.TestCase):
+
+    def _wait(self, manager, job):
+        """อ่าน Stream จนจบ = รอให้งานเสร็จ"""
+        return list(manager._iter_events(job, heartbeat=5))
+
+    def test_finished_jobs_are_capped_lru(self):
+        manager = JobManager(max_workers=1, max_finished=2)
+        done = []
+        for _ in range(3):
+            job = manager.submit(_analyze)
+            self._wait(manager, job)
+            done.append(job.id)
+            if len(done) == 2:
+                # เปิดดูงานแรก -> งานที่สองกลายเป็นงานที่ไม่ได้ใช้นานที่สุด
+                self.assertIsNotNone(manager.get(done[0]))
+
+        self.assertIsNotNone(manager.get(done[0]))
+        self.assertIsNone(manager.get(done[1]))
+        self.assertIsNotNone(manager.get(done[2]))
+
+    def test_expired_jobs_are_purged_on_get(self):
+        manager = JobManager(max_workers=1, ttl_seconds=0)
+        job = manager.submit(_analyze)
+        self._wait(manager, job)
+        job.finished_at -= 1
+        self.assertIsNone(manager.get(job.id))
+
+    def test_drained_stream_releases_cell_events(self):
+        manager = JobManager(max_workers=1)
+        job = manager.submit(_analyze, cells=5)
+        events = self._wait(manager, job)
+        self.assertEqual(sum(e["stage"] == "cell" for e in events), 5)
+        self.assertEqual(events[-1]["result"]["cells"], 5)
+
+        # หลังอ่านจบเหลือเฉพาะ Event ของขั้นตอน ผลยังอยู่ครบ
+        self.assertFalse(any(e["stage"] == "cell" for e in job.events))
+        stages = [s["stage"] for s in job.to_dict()["stages"]]
+        self.assertEqual(stages, ["queued", "segment", "done"])
+        self.assertEqual(job.to_dict()["result"]["cells"], 5)
+
+if __name__ == '__main__':
+    unittest.main()
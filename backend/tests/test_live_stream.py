@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+import unittest
+
+# เพิ่ม Path เพื่อหา live_stream.py (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from live_stream import LiveAnalyzer
+
+def _frame(n):
+    """bytes ที่ขึ้นต้นด้วย Signature ของ PNG (decode_frame รับเป็นภาพโดยไม่ถอด base64)"""
+    return b'\x89PNG' + str(n).encode()
+
+class BlockingAnalyze:
+    """analyze ที่ค้างจนกว่าจะ release() เพื่อจำลองเฟรมที่กำลังวิเคราะห์อยู่"""
+
+    def __init__(self):
+        self.seen = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, frame):
+        self.seen.append(frame)
+        self.started.set()
+        self.release.wait(5)
+        return {'success': True}, 200
+
+class LiveAnalyzerTest(unittest.TestCase):
+
+    def test_newer_frame_replaces_pending_frame(self):
+        analyze = BlockingAnalyze()
+        live = LiveAnalyzer(analyze)
+
+        first = live.submit(_frame(1))
+        self.assertTrue(analyze.started.wait(5))
+        # ระหว่างวิเคราะห์เฟรมแรก: เฟรม 2 รออยู่ในช่อง แล้วถูกเฟรม 3 แทนที่
+        live.submit(_frame(2))
+        third = live.submit(_frame(3))
+        self.assertEqual(live.stats()['dropped'], 1)
+        self.assertTrue(live.stats()['pending'])
+
+        analyze.release.set()
+        latest = live.wait_newer(1, timeout=5)
+        self.assertIsNotNone(latest)
+        self.assertEqual(analyze.seen, [_frame(1), _frame(3)])
+        self.assertEqual(latest['frame_id'], third)
+        self.assertGreater(third, first)
+
+        stats = live.stats()
+        self.assertEqual((stats['received'], stats['analyzed'], stats['dropped']), (3, 2, 1))
+        self.assertFalse(stats['pending'])
+
+    def test_submit_does_not_block_while_analyzing(self):
+        analyze = BlockingAnalyze()
+        live = LiveAnalyzer(analyze)
+        live.submit(_frame(1))
+        self.assertTrue(analyze.started.wait(5))
+
+        done = threading.Event()
+        threading.Thread(target=lambda: (live.submit(_frame(2)), done.set()), daemon=True).start()
+        self.assertTrue(done.wait(1))
+        analyze.release.set()
+
+    def test_rejects_invalid_and_oversized_frames(self):
+        live = LiveAnalyzer(lambda frame: ({'success': True}, 200), max_frame_bytes=8)
+        self.assertIsNone(live.submit(b''))
+        self.assertIsNone(live.submit(b'\x89PNG' + b'x' * 16))
+        self.assertEqual(live.stats()['invalid'], 2)
+        self.assertEqual(live.stats()['received'], 0)
+
+    def test_event_stream_ends_when_idle(self):
+        live = LiveAnalyzer(lambda frame: ({'success': True}, 200))
+        events = list(live.stream_events(heartbeat=5, idle_seconds=0.05))
+        self.assertTrue(events[0].startswith('retry:'))
+        self.assertIn('"idle"', events[-1])
+        self.assertEqual(live.stats()['event_streams'], 0)
+
+    def test_event_stream_ends_after_max_duration(self):
+        live = LiveAnalyzer(lambda frame: ({'success': True}, 200))
+        live.submit(_frame(1))
+        events = list(live.stream_events(heartbeat=5, max_seconds=0.2))
+        self.assertTrue(any(e.startswith('id: 1\nevent: result') for e in events))
+        self.assertIn('"max_duration"', events[-1])
+
+    def test_closed_stream_is_released(self):
+        live = LiveAnalyzer(lambda frame: ({'success': True}, 200))
+        stream = live.stream_events(heartbeat=5)
+        next(stream)
+        self.assertEqual(live.stats()['event_streams'], 1)
+        # Client ปิด Connection -> Server เรียก close() ของ Generator
+        stream.close()
+        self.assertEqual(live.stats()['event_streams'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+# เพิ่ม Path เพื่อหา metrics.py (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Registry
+
+class RegistryTest(unittest.TestCase):
+
+    def test_counter_renders_labels(self):
+        registry = Registry()
+        requests = registry.counter('test_requests_total', 'Requests')
+        requests.inc(endpoint='analyze', status=200)
+        requests.inc(2, endpoint='analyze', status=200)
+        requests.inc(endpoint='jobs', status=503)
+
+        text = registry.render()
+        self.assertIn('# TYPE test_requests_total counter', text)
+        self.assertIn('test_requests_total{endpoint="analyze",status="200"} 3', text)
+        self.assertIn('test_requests_total{endpoint="jobs",status="503"} 1', text)
+        self.assertTrue(text.endswith('\n'))
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        latency = registry.histogram('test_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            latency.observe(value, stage='segment')
+
+        lines = registry.render().splitlines()
+        self.assertIn('test_seconds_bucket{stage="segment",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="segment",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="segment",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{stage="segment"} 5.55', lines)
+        self.assertIn('test_seconds_count{stage="segment"} 3', lines)
+
+    def test_label_values_are_escaped(self):
+        registry = Registry()
+        registry.counter('test_total').inc(name='a "b"\\c\nd')
+        self.assertIn('test_total{name="a \\"b\\"\\\\c d"} 1', registry.render())
+
+    def test_same_name_returns_same_metric(self):
+        registry = Registry()
+        self.assertIs(registry.counter('test_total'), registry.counter('test_total'))
+        self.assertIn('malariax_process_info', registry.render())
+
+if __name__ == '__main__':
+    unittest.main()
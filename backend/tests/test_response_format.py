@@ -0,0 +1,70 @@
+import os
+import sys
+import unittest
+
+# เพิ่ม Path เพื่อหา response_format.py (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_format import compact_payload
+
+SESSION = 'abc'
+
+def _payload(n):
+    """ผลลัพธ์ของ run_analysis แบบย่อ: n เซลล์ พร้อมผล Size Analysis ของทุกเซลล์"""
+    cells = [{
+        "cell": f"cell_{i}.png",
+        "characteristic": "1chromatin",
+        "confidence": "97.50%",
+        "bbox": {"x": i, "y": i, "w": 10, "h": 12},
+        "marginal_ratio": 0.5,
+        "chromatin_count": 1,
+        "chromatin_bboxes": [[1.4, 2.6, 3.0, 4.0]],
+        "url": f"cells/{SESSION}/cell_{i}.png",
+        "distance_viz_url": f"processed/{SESSION}/dist_{i}.png"
+    } for i in range(n)]
+    sizes = [{"filename": f"cell_{i}.png", "size_px": 40 + i, "ratio": 1.0, "status": "normal"} for i in range(n)]
+    return {"success": True, "session_id": SESSION, "vit_characteristics": cells, "size_analysis": sizes}
+
+class CompactPayloadTest(unittest.TestCase):
+
+    def test_pages_through_cells(self):
+        payload = _payload(5)
+        first = compact_payload(payload, offset=0, limit=2)
+        self.assertEqual(first["cells"]["cell"], ["cell_0.png", "cell_1.png"])
+        self.assertEqual(first["page"], {"offset": 0, "limit": 2, "count": 2, "total": 5, "next_offset": 2})
+
+        last = compact_payload(payload, offset=4, limit=2)
+        self.assertEqual(last["cells"]["cell"], ["cell_4.png"])
+        self.assertIsNone(last["page"]["next_offset"])
+
+        # ต่อทุกหน้าแล้วได้เซลล์ครบตามลำดับเดิม
+        seen, offset = [], 0
+        while offset is not None:
+            page = compact_payload(payload, offset=offset, limit=2)
+            seen += page["cells"]["cell"]
+            offset = page["page"]["next_offset"]
+        self.assertEqual(seen, [c["cell"] for c in payload["vit_characteristics"]])
+
+    def test_offset_past_end_is_empty(self):
+        page = compact_payload(_payload(3), offset=10, limit=5)
+        self.assertEqual(page["page"]["count"], 0)
+        self.assertIsNone(page["page"]["next_offset"])
+
+    def test_columns_are_compacted(self):
+        compact = compact_payload(_payload(1))
+        cells = compact["cells"]
+        self.assertEqual(cells["confidence"], [97.5])
+        self.assertEqual(cells["bbox"], [[0, 0, 10, 12]])
+        self.assertEqual(cells["chromatin_bboxes"], [[[1, 3, 3, 4]]])
+        self.assertEqual(cells["url"], ["cell_0.png"])
+        self.assertEqual(cells["distance_viz"], ["dist_0.png"])
+        self.assertEqual(cells["size_px"], [40])
+        self.assertNotIn("vit_characteristics", compact)
+        self.assertEqual(compact["page"]["next_offset"], None)
+
+    def test_failed_payload_is_unchanged(self):
+        payload = {"success": False, "error": "boom"}
+        self.assertIs(compact_payload(payload), payload)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# เพิ่ม Path เพื่อหา result_cache.py (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_cache import ResultCache, build_version
+
+def _age(cache, key, seconds):
+    """ย้อน mtime ของ Entry (LRU ใช้ mtime ตัดสินว่าใช้ล่าสุดเมื่อไร)"""
+    past = time.time() - seconds
+    os.utime(cache._path(key), (past, past))
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_put_then_get(self):
+        cache = ResultCache(self.tmp.name, 'v1')
+        key = cache.key_for(b'image', variant='no-viz')
+        self.assertIsNone(cache.get(key))
+        cache.put(key, {'success': True, 'cells': 3})
+        self.assertEqual(cache.get(key), {'success': True, 'cells': 3})
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+    def test_key_depends_on_version_and_variant(self):
+        v1, v2 = ResultCache(self.tmp.name, 'v1'), ResultCache(self.tmp.name, 'v2')
+        self.assertNotEqual(v1.key_for(b'image'), v2.key_for(b'image'))
+        self.assertNotEqual(v1.key_for(b'image'), v1.key_for(b'image', variant='no-viz'))
+        self.assertEqual(v1.key_for(b'image'), ResultCache(self.tmp.name, 'v1').key_for(b'image'))
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(self.tmp.name, 'v1', max_entries=2)
+        a, b, c = (cache.key_for(name) for name in (b'a', b'b', b'c'))
+        cache.put(a, {'id': 'a'})
+        cache.put(b, {'id': 'b'})
+        _age(cache, a, 20)
+        _age(cache, b, 10)
+
+        # เปิด a -> b กลายเป็น Entry ที่ไม่ได้ใช้นานที่สุด
+        self.assertIsNotNone(cache.get(a))
+        cache.put(c, {'id': 'c'})
+        self.assertIsNotNone(cache.get(a))
+        self.assertIsNone(cache.get(b))
+        self.assertIsNotNone(cache.get(c))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_invalid_payload_is_a_miss(self):
+        cache = ResultCache(self.tmp.name, 'v1', validate=lambda payload: payload.get('ok'))
+        key = cache.key_for(b'image')
+        cache.put(key, {'ok': False})
+        self.assertIsNone(cache.get(key))
+        self.assertFalse(os.path.exists(cache._path(key)))
+
+    def test_build_version_tracks_parts_and_files(self):
+        path = os.path.join(self.tmp.name, 'weights.pth')
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        before = build_version('a', 1, files=(path,))
+        self.assertEqual(before, build_version('a', 1, files=(path,)))
+        self.assertNotEqual(before, build_version('a', 2, files=(path,)))
+        with open(path, 'wb') as f:
+            f.write(b'xy')
+        self.assertNotEqual(before, build_version('a', 1, files=(path,)))
+
+if __name__ == '__main__':
+    unittest.main()
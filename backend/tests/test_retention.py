@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+
+# เพิ่ม Path เพื่อหา retention.py (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retention import RetentionManager
+
+class RetentionManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.uploads = os.path.join(self.tmp.name, 'uploads')
+        self.processed = os.path.join(self.tmp.name, 'processed_results')
+        os.makedirs(self.uploads)
+        os.makedirs(self.processed)
+
+    def _session(self, age, size=100):
+        """สร้างไฟล์อัปโหลด + โฟลเดอร์ผลลัพธ์ของ Session ที่เขียนครั้งล่าสุดเมื่อ age วินาทีก่อน"""
+        sid = str(uuid.uuid4())
+        upload = os.path.join(self.uploads, f"{sid}.png")
+        folder = os.path.join(self.processed, sid)
+        os.makedirs(folder)
+        for path in (upload, os.path.join(folder, 'result.png')):
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+        past = time.time() - age
+        for path in (upload, folder):
+            os.utime(path, (past, past))
+        return sid
+
+    def _exists(self, sid):
+        return os.path.exists(os.path.join(self.processed, sid))
+
+    def _manager(self, **kwargs):
+        return RetentionManager([self.uploads, self.processed], grace=60, **kwargs)
+
+    def test_expired_sessions_are_removed(self):
+        old, fresh = self._session(age=7200), self._session(age=120)
+        report = self._manager(session_ttl=3600, max_bytes=0).sweep()
+        self.assertEqual(report['expired'], 1)
+        self.assertFalse(self._exists(old))
+        self.assertFalse(os.path.exists(os.path.join(self.uploads, f"{old}.png")))
+        self.assertTrue(self._exists(fresh))
+
+    def test_quota_removes_oldest_first(self):
+        oldest, middle, newest = self._session(age=900), self._session(age=600), self._session(age=300)
+        # 3 Session x 200 bytes เกินโควตา 450 -> ลบ Session เก่าสุดแค่ 1 อันก็พอ
+        report = self._manager(session_ttl=0, max_bytes=450).sweep()
+        self.assertEqual((report['expired'], report['evicted']), (0, 1))
+        self.assertFalse(self._exists(oldest))
+        self.assertTrue(self._exists(middle))
+        self.assertTrue(self._exists(newest))
+        self.assertEqual(report['bytes_remaining'], 400)
+
+    def test_sessions_within_grace_are_kept(self):
+        recent = self._session(age=10)
+        report = self._manager(session_ttl=1, max_bytes=1).sweep()
+        self.assertEqual((report['expired'], report['evicted']), (0, 0))
+        self.assertTrue(self._exists(recent))
+
+    def test_unrelated_files_are_ignored(self):
+        other = os.path.join(self.uploads, 'README.txt')
+        with open(other, 'w') as f:
+            f.write('keep')
+        past = time.time() - 7200
+        os.utime(other, (past, past))
+        self._manager(session_ttl=3600).sweep()
+        self.assertTrue(os.path.exists(other))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+# เพิ่ม Path เพื่อหา cellpose_segmenter.py (backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from cellpose_segmenter import _core_bounds, _tile_starts
+except ImportError:  # ต้องติดตั้ง cellpose / opencv / scipy
+    _tile_starts = None
+
+@unittest.skipIf(_tile_starts is None, "cellpose_segmenter ต้องใช้ cellpose / opencv / scipy")
+class TileBoundsTest(unittest.TestCase):
+
+    def test_tiles_cover_image(self):
+        for length, tile, overlap in [(1000, 400, 100), (4096, 1024, 256), (1500, 1024, 256), (777, 256, 96)]:
+            starts = _tile_starts(length, tile, overlap)
+            self.assertEqual(starts[0], 0)
+            self.assertEqual(starts[-1] + tile, length)  # Tile สุดท้ายชิดขอบภาพพอดี
+            for prev, start in zip(starts, starts[1:]):
+                self.assertGreater(start, prev)
+                self.assertGreaterEqual(prev + tile - start, min(overlap, tile // 2))
+
+    def test_small_image_is_one_tile(self):
+        self.assertEqual(_tile_starts(500, 1024, 256), [0])
+        self.assertEqual(_core_bounds([0], 1024, 500), [(0, 500)])
+
+    def test_overlap_not_smaller_than_tile(self):
+        # Overlap >= Tile ถูกจำกัดไว้ที่ครึ่ง Tile (ไม่ให้ step <= 0)
+        for overlap in (256, 300):
+            starts = _tile_starts(1000, 256, overlap)
+            self.assertEqual(starts, _tile_starts(1000, 256, 128))
+            self.assertEqual(starts[-1] + 256, 1000)
+
+    def test_core_bounds_partition_image(self):
+        for length, tile, overlap in [(1000, 400, 100), (4096, 1024, 256), (777, 256, 96)]:
+            starts = _tile_starts(length, tile, overlap)
+            bounds = _core_bounds(starts, tile, length)
+            self.assertEqual(bounds[0][0], 0)
+            self.assertEqual(bounds[-1][1], length)
+            for (lo, hi), (next_lo, _) in zip(bounds, bounds[1:]):
+                self.assertEqual(hi, next_lo)  # ไม่ซ้อน / ไม่มีช่องว่าง -> ทุกเซลล์มีเจ้าของ Tile เดียว
+            for start, (lo, hi) in zip(starts, bounds):
+                # Core อยู่ภายใน Tile ของตัวเอง
+                self.assertLessEqual(start, lo)
+                self.assertLessEqual(hi, min(start + tile, length))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+from werkzeug.utils import safe_join
+
+import metrics
+
+from algoritum.diastant import draw_distance_viz
+from algoritum.findsize import draw_size_viz
+
+# ไฟล์เก็บ Geometry ของภาพ Visualization ในแต่ละ Session (processed_results/<session>/viz_index.json)
+VIZ_INDEX = 'viz_index.json'
+
+def _points(array):
+    return np.asarray(array, dtype=np.int32).reshape(-1, 2).tolist()
+
+def distance_spec(features):
+    """Geometry สำหรับวาด _dist_viz.png (Hull + Centroid + Chromatin + Edge) จาก CellFeatures"""
+    return {
+        "kind": "distance",
+        "shape": list(features.image_shape),
+        "hull": _points(features.radial_hull),
+        "centroid": list(features.centroid),
+        "chromatin": list(features.chromatin_point),
+        "edge": list(features.edge_point)
+    }
+
+def size_spec(source_url, features, label=None):
+    """Geometry สำหรับวาดภาพ Size Visualization (Hull บนภาพ crop ที่ source_url)"""
+    return {
+        "kind": "size",
+        "source": source_url,
+        "hull": _points(features.hull) if features is not None and features.hull is not None else None,
+        "label": label
+    }
+
+def write_viz_index(session_dir, specs):
+    """บันทึก {path ภายใน session: spec} ลง viz_index.json (ไม่วาดภาพจริงจนกว่าจะมีคนเปิดดู)"""
+    if not specs: return
+    os.makedirs(session_dir, exist_ok=True)
+    path = os.path.join(session_dir, VIZ_INDEX)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(specs, f)
+    os.replace(tmp_path, path)
+
+# ลบ Cache จนเหลือสัดส่วนนี้ของ max_bytes (เผื่อที่ว่างไว้ ไม่ต้องสแกนใหม่ทุกภาพที่วาดเพิ่ม)
+EVICT_TARGET = 0.9
+
+class VizRenderer:
+    """
+    วาดภาพ Visualization แบบ Lazy: ตอนวิเคราะห์เก็บแค่ Geometry ลง viz_index.json
+    แล้ววาดจริงเมื่อมี Request มาที่ /processed/... ครั้งแรก จากนั้น Cache ไฟล์ที่วาดแล้วบน Disk
+    - Cache จำกัดขนาดรวม (max_bytes) ลบไฟล์ที่ไม่ได้เปิดนานที่สุดก่อน (LRU ตาม mtime)
+      นับขนาดรวมสะสมไว้ในหน่วยความจำ แล้วสแกน Disk เฉพาะตอนเกิน max_bytes (ลบจนเหลือ EVICT_TARGET ของ max_bytes)
+    - load_source(url) / source_exists(url): อ่าน / ตรวจภาพ crop ต้นทาง (cells/...) ดู pipeline.load_artifact_image
+    """
+
+    def __init__(self, processed_folder, cache_dir, load_source, source_exists, max_bytes=100 * 1024 * 1024):
+        self.processed_folder = processed_folder
+        self.cache_dir = cache_dir
+        self.load_source = load_source
+        self.source_exists = source_exists
+        self.max_bytes = max_bytes
+        self.rendered = 0
+        self.hits = 0
+        self.evictions = 0
+        self._cache_bytes = None   # ขนาดรวมของ Cache (None = ยังไม่ได้สแกน)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _spec(self, rel_path):
+        session, _, inner = rel_path.replace("\\", "/").partition('/')
+        if not session or not inner: return None
+        index_path = safe_join(self.processed_folder, session, VIZ_INDEX)
+        if index_path is None: return None
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get(inner)
+        except (OSError, ValueError):
+            return None
+
+    def can_render(self, rel_path):
+        """มี Geometry ให้วาดภาพนี้ได้หรือไม่ (ใช้ตรวจ Cache ของผลลัพธ์ว่า URL ยังใช้ได้)"""
+        spec = self._spec(rel_path)
+        if spec is None: return False
+        if spec.get('kind') == 'size':
+            return self.source_exists(spec.get('source') or '')
+        return True
+
+    def render(self, rel_path):
+        """คืน path ของภาพที่วาดแล้ว (วาดใหม่ถ้ายังไม่อยู่ใน Cache) หรือ None ถ้าไม่มี Geometry"""
+        out_path = safe_join(self.cache_dir, rel_path)
+        if out_path is None: return None
+
+        if os.path.exists(out_path):
+            try: os.utime(out_path, None)  # ขยับเป็น "ใช้ล่าสุด" สำหรับ LRU
+            except OSError: pass
+            with self._lock: self.hits += 1
+            return out_path
+
+        spec = self._spec(rel_path)
+        if spec is None: return None
+        img = self._draw(spec)
+        if img is None: return None
+
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        ext = os.path.splitext(out_path)[1] or '.png'
+        ok, buf = cv2.imencode(ext, img)
+        if not ok: return None
+        tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with metrics.time_write('viz_render'), open(tmp_path, 'wb') as f:
+                f.write(buf.tobytes())
+            metrics.DISK_WRITE_BYTES.inc(len(buf), kind='viz_render')
+            os.replace(tmp_path, out_path)
+        except OSError as e:
+            print(f"⚠️ Viz cache write failed: {e}")
+            return None
+
+        with self._lock:
+            self.rendered += 1
+            if self._cache_bytes is not None: self._cache_bytes += len(buf)
+            over = self._cache_bytes is None or self._cache_bytes > self.max_bytes
+        if over: self._evict(keep=out_path)
+        return out_path
+
+    def _draw(self, spec):
+        hull = np.array(spec['hull'], dtype=np.int32).reshape(-1, 1, 2) if spec.get('hull') else None
+
+        if spec.get('kind') == 'distance':
+            feats = SimpleNamespace(image_shape=tuple(spec['shape']), radial_hull=hull,
+                                    centroid=tuple(spec['centroid']), chromatin_point=tuple(spec['chromatin']),
+                                    edge_point=tuple(spec['edge']))
+            return draw_distance_viz(feats)
+
+        if spec.get('kind') == 'size':
+            img = self.load_source(spec.get('source') or '')
+            if img is None: return None
+            if hull is None: return img
+            return draw_size_viz(img, SimpleNamespace(hull=hull), spec.get('label'))
+        return None
+
+    def _evict(self, keep=None):
+        """
+        สแกน Cache บน Disk (รวมไฟล์ที่ Process อื่นวาดไว้) แล้วลบภาพที่ไม่ได้เปิดนานที่สุด
+        ถ้าขนาดรวมเกิน max_bytes ลบจนเหลือไม่เกิน EVICT_TARGET * max_bytes แล้วบันทึกขนาดที่เหลือ
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICT_TARGET if total_bytes > self.max_bytes else total_bytes
+        while entries and total_bytes > target:
+            _, size, path = entries.pop(0)
+            if path == keep: continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            with self._lock: self.evictions += 1
+        with self._lock: self._cache_bytes = total_bytes
+
+    def stats(self):
+        with self._lock:
+            return {"rendered": self.rendered, "hits": self.hits, "evictions": self.evictions,
+                    "max_bytes": self.max_bytes}
@@ -0,0 +1,17 @@
+"""
+Entry Point สำหรับ Production (gunicorn แบบ Prefork)
+
+    cd backend
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Master Process จะ import ไฟล์นี้ครั้งเดียว (preload_app) -> โหลด ResNet / YOLO / Cellpose
+แล้วย้าย Weights ไปไว้ใน Shared Memory ก่อน fork ทุก Worker จึงใช้ Weights ชุดเดียวกัน
+"""
+import os
+
+# ต้องตั้งก่อน import app เพื่อให้โหลดโมเดลแบบ Synchronous (ห้ามมี Thread โหลดค้างอยู่ตอน fork)
+os.environ.setdefault('MALARIAX_PRELOAD_MODELS', '1')
+
+from app import app  # noqa: E402
+
+application = app
@@ -55,11 +55,40 @@ const dataURLtoFile = (dataurl, filename) => {
     return new File([u8arr], filename, {type:mime});
 }
 
+// วิเคราะห์แบบ Stream (NDJSON): onEvent ได้รับ Event ระหว่างทาง (classification / cell / ...) คืนค่าผลลัพธ์เต็มตอนจบ
+const streamAnalyze = async (file, onEvent) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    const response = await fetch(`${BACKEND_URL}/api/analyze/stream?format=ndjson`, { method: 'POST', body: formData });
+    if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+            if (!line.trim()) continue; // keep-alive
+            const event = JSON.parse(line);
+            if (event.stage === 'done') result = event.result;
+            else if (event.stage === 'failed') throw new Error(event.data?.error || 'Analysis failed');
+            else onEvent(event);
+        }
+    }
+    if (!result) throw new Error('Stream ended without result');
+    return result;
+};
+
 // ==============================
 // 2. COMPONENTS
 // ==============================
 
-const InteractiveImage = ({ imageUrl, cells, onCellClick }) => {
+const InteractiveImage = ({ imageUrl, cells, onCellClick, pending = [] }) => {
     const [imgSize, setImgSize] = useState({ w: 0, h: 0 });
     const imgRef = useRef(null);
 
@@ -73,6 +102,12 @@ const InteractiveImage = ({ imageUrl, cells, onCellClick }) => {
                 ref={imgRef} src={imageUrl} alt="Analyzed Slide" 
                 onLoad={handleImageLoad} style={{ width: '100%', display: 'block' }} 
             />
+            {/* ระหว่าง Stream: กรอบของทุกเซลล์ที่ Segment ได้ (ยังไม่มีผล Classification) */}
+            {imgSize.w > 0 && pending.map((bbox, index) => (
+                <div key={`pending-${index}`} className="interactive-box pending"
+                    style={{ position: 'absolute', left: `${(bbox.x / imgSize.w) * 100}%`, top: `${(bbox.y / imgSize.h) * 100}%`,
+                             width: `${(bbox.w / imgSize.w) * 100}%`, height: `${(bbox.h / imgSize.h) * 100}%` }} />
+            ))}
             {imgSize.w > 0 && cells.map((cell, index) => {
                 if (!cell.bbox) return null;
                 // คำนวณตำแหน่ง % เทียบกับขนาดรูปจริงที่โหลดมา (ซึ่งตอนนี้จะเป็นรูปสี่เหลี่ยมแล้ว)
@@ -92,8 +127,20 @@ const InteractiveImage = ({ imageUrl, cells, onCellClick }) => {
     );
 };
 
+// ภาพเซลล์จาก Atlas (ภาพเดียวต่อ Session) ถ้าไม่มีใช้ URL ของเซลล์แบบเดิม
+const CellCrop = ({ atlas, item, alt }) => {
+    const rect = atlas?.cells?.[item.cell];
+    if (!rect) return <img src={`${BACKEND_URL}/${item.url}`} alt={alt} />;
+    const [x, y, w, h] = rect;
+    return (
+        <svg viewBox={`${x} ${y} ${w} ${h}`} preserveAspectRatio="xMidYMid slice" role="img" aria-label={alt}>
+            <image href={`${BACKEND_URL}/${atlas.url}`} width={atlas.width} height={atlas.height} />
+        </svg>
+    );
+};
+
 // Galleries
-const ImageGallery = ({ title, images, onClose }) => (
+const ImageGallery = ({ title, images, atlas, onClose }) => (
     <div className="modal-overlay" onClick={onClose}>
         <div className="modal-content" onClick={(e) => e.stopPropagation()}>
             <div className="modal-header">
@@ -103,7 +150,7 @@ const ImageGallery = ({ title, images, onClose }) => (
             <div className="abnormal-cells-grid">
                 {images.map((item, index) => (
                     <div key={index} className="abnormal-cell-item">
-                        <img src={`${BACKEND_URL}/${item.url}`} alt={`Cell ${index + 1}`} />
+                        <CellCrop atlas={atlas} item={item} alt={`Cell ${index + 1}`} />
                         <p>{item.characteristic}</p>
                     </div>
                 ))}
@@ -196,6 +243,8 @@ function AnalysisPage() {
   const [res, setRes] = useState(null); 
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  // ผลระหว่าง Stream: { imageUrl, bboxes, cells } (null = ไม่ได้กำลัง Stream)
+  const [progress, setProgress] = useState(null);
   
   // Camera State
   const [liveImage, setLiveImage] = useState(null);
@@ -227,6 +276,28 @@ function AnalysisPage() {
     }
   }, [inputMode, res]);
 
+  // --- ANALYSIS ---
+  // ใช้ /api/analyze/stream เพื่อวาดกรอบทีละเซลล์ระหว่างรอ ถ้า Stream ไม่สำเร็จกลับไปใช้ /api/analyze แบบเดิม
+  const runAnalysis = async (file) => {
+      setProgress({ imageUrl: null, bboxes: [], cells: [] });
+      try {
+          const result = await streamAnalyze(file, ({ stage, data }) => {
+              if (stage === 'segmentation') setProgress(p => ({ ...p, imageUrl: data.image_url }));
+              else if (stage === 'classification') setProgress(p => ({ ...p, bboxes: data.bboxes || [] }));
+              else if (stage === 'cell') setProgress(p => ({ ...p, cells: [...p.cells, data] }));
+          });
+          setRes(result);
+      } catch (streamErr) {
+          console.warn("Stream ไม่สำเร็จ ใช้ /api/analyze แทน:", streamErr);
+          const formData = new FormData();
+          formData.append('file', file);
+          const response = await axios.post(`${BACKEND_URL}/api/analyze`, formData);
+          setRes(response.data);
+      } finally {
+          setProgress(null);
+      }
+  };
+
   // --- HANDLERS ---
   const handleFileChange = (event) => {
     const file = event.target.files[0];
@@ -261,12 +332,8 @@ function AnalysisPage() {
           console.error("บันทึกลง Firebase ไม่สำเร็จ:", dbError);
       }
       
-      const formData = new FormData();
-      formData.append('file', file);
-      
       try {
-        const response = await axios.post(`${BACKEND_URL}/api/analyze`, formData);
-        setRes(response.data);
+        await runAnalysis(file);
       } catch (err) {
         console.error(err);
         setError("เกิดข้อผิดพลาด: Backend ไม่ตอบสนอง");
@@ -278,11 +345,8 @@ function AnalysisPage() {
   const handleSubmit = async () => { 
     if (!selectedFile) return setError('กรุณาเลือกไฟล์ก่อน');
     setLoading(true); setError(''); setRes(null); 
-    const formData = new FormData(); 
-    formData.append('file', selectedFile);
     try {
-      const response = await axios.post(`${BACKEND_URL}/api/analyze`, formData);
-      setRes(response.data);
+      await runAnalysis(selectedFile);
     } catch (err) {
       console.error(err);
       setError("เกิดข้อผิดพลาด: Backend ไม่ตอบสนอง"); 
@@ -409,6 +473,17 @@ function AnalysisPage() {
               <div className="loader"></div>
               <h3>AI กำลังประมวลผล...</h3>
               <p>Cell Segmentation &rarr; Feature Extraction &rarr; Diagnosis</p>
+              {progress && progress.bboxes.length > 0 && (
+                  <div className="detail-card stream-preview">
+                      <p>จัดประเภทแล้ว {progress.cells.length} / {progress.bboxes.length} เซลล์</p>
+                      <InteractiveImage
+                          imageUrl={progress.imageUrl ? `${BACKEND_URL}/${progress.imageUrl}` : preview}
+                          pending={progress.bboxes}
+                          cells={progress.cells.filter(c => c.characteristic !== 'nomal_cell')}
+                          onCellClick={() => {}}
+                      />
+                  </div>
+              )}
           </div>
       )}
 
@@ -518,9 +593,9 @@ function AnalysisPage() {
       {/* GALLERIES & MODALS */}
       {showSizeGallery && <SizeGallery title="Size Calculation Results" items={sizeData} onClose={()=>setShowSizeGallery(false)} />}
       {showDistanceGallery && <DistanceGallery title="Distance Algorithm Visualization" items={distanceData} onClose={()=>setShowDistanceGallery(false)} />}
-      {showChromatinGallery && <ImageGallery title="Abnormal Chromatin" images={chromatinCells} onClose={()=>setShowChromatinGallery(false)}/>}
-      {showSchuffnerGallery && <ImageGallery title="Schüffner's Dot / Amoeboid" images={schuffnerCells} onClose={()=>setShowSchuffnerGallery(false)}/>}
-      {showBasketGallery && <ImageGallery title="Basket/Band Form" images={basketCells} onClose={()=>setShowBasketGallery(false)}/>}
+      {showChromatinGallery && <ImageGallery title="Abnormal Chromatin" images={chromatinCells} atlas={res?.crop_atlas} onClose={()=>setShowChromatinGallery(false)}/>}
+      {showSchuffnerGallery && <ImageGallery title="Schüffner's Dot / Amoeboid" images={schuffnerCells} atlas={res?.crop_atlas} onClose={()=>setShowSchuffnerGallery(false)}/>}
+      {showBasketGallery && <ImageGallery title="Basket/Band Form" images={basketCells} atlas={res?.crop_atlas} onClose={()=>setShowBasketGallery(false)}/>}
       {viewingImage && <SingleImageViewer imageUrl={viewingImage} onClose={()=>setViewingImage(null)}/>}
 
       {/* CELL DETAIL MODAL */}
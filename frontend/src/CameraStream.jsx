@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { initializeApp, getApps, getApp } from "firebase/app";
 import { getDatabase, ref, onValue } from "firebase/database";
 
@@ -23,9 +23,29 @@ if (!getApps().length) {
 }
 const db = getDatabase(app);
 
+const BACKEND_URL = 'http://127.0.0.1:5001';
+
+// กรอบของเซลล์ที่ผิดปกติจากผล Live (bbox อยู่ในพิกัดภาพที่ตัดแล้ว -> บวก crop_box กลับเป็นพิกัดเฟรม)
+const LiveOverlay = ({ result, size }) => {
+  if (!result?.success || !size.w) return null;
+  const [ox, oy] = result.crop_box || [0, 0];
+  return result.cells.filter(c => c.characteristic !== 'nomal_cell' && c.bbox).map((cell, index) => (
+    <div key={index} className="interactive-box"
+      style={{ position: 'absolute', left: `${((cell.bbox.x + ox) / size.w) * 100}%`, top: `${((cell.bbox.y + oy) / size.h) * 100}%`,
+               width: `${(cell.bbox.w / size.w) * 100}%`, height: `${(cell.bbox.h / size.h) * 100}%` }}>
+      <div className="box-tooltip">{cell.characteristic}</div>
+    </div>
+  ));
+};
+
 const CameraStream = () => {
   const [imageSrc, setImageSrc] = useState(null);
   const [lastUpdate, setLastUpdate] = useState(null);
+  // Live Analysis: ส่งเฟรมให้ Backend (ครั้งละ 1 Request, Backend เก็บเฉพาะเฟรมล่าสุด) แล้วรับผลผ่าน SSE
+  const [liveEnabled, setLiveEnabled] = useState(false);
+  const [liveResult, setLiveResult] = useState(null);
+  const [imgSize, setImgSize] = useState({ w: 0, h: 0 });
+  const sending = useRef(false);
 
   useEffect(() => {
     // อ้างอิงไปที่ streams/stream1 (ที่ Raspberry Pi ส่งมา)
@@ -43,6 +63,23 @@ const CameraStream = () => {
     return () => unsubscribe(); // ล้างการทำงานเมื่อปิด Component
   }, []);
 
+  useEffect(() => {
+    if (!liveEnabled || !imageSrc || sending.current) return;
+    sending.current = true;
+    const body = new FormData();
+    body.append('frame', imageSrc);
+    fetch(`${BACKEND_URL}/api/live/frame`, { method: 'POST', body })
+      .catch((err) => console.error("ส่งเฟรมไม่สำเร็จ:", err))
+      .finally(() => { sending.current = false; });
+  }, [liveEnabled, imageSrc]);
+
+  useEffect(() => {
+    if (!liveEnabled) { setLiveResult(null); return; }
+    const events = new EventSource(`${BACKEND_URL}/api/live/events`);
+    events.addEventListener('result', (e) => setLiveResult(JSON.parse(e.data)));
+    return () => events.close();
+  }, [liveEnabled]);
+
   return (
     <div style={{ textAlign: 'center', marginTop: '20px' }}>
       <h3>🔴 กล้อง Raspberry Pi (Live)</h3>
@@ -52,10 +89,15 @@ const CameraStream = () => {
         display: 'inline-block',
         overflow: 'hidden',
         boxShadow: '0 4px 8px rgba(0,0,0,0.2)',
-        background: '#000'
+        background: '#000',
+        position: 'relative'
       }}>
         {imageSrc ? (
-          <img src={imageSrc} alt="Live Stream" style={{ width: '640px', maxWidth: '100%', display: 'block' }} />
+          <>
+            <img src={imageSrc} alt="Live Stream" style={{ width: '640px', maxWidth: '100%', display: 'block' }}
+              onLoad={(e) => setImgSize({ w: e.target.naturalWidth, h: e.target.naturalHeight })} />
+            {liveEnabled && <LiveOverlay result={liveResult?.result} size={imgSize} />}
+          </>
         ) : (
           <div style={{ width: '640px', height: '480px', color: '#fff', display: 'flex', flexDirection:'column', alignItems: 'center', justifyContent: 'center' }}>
             <div className="loader" style={{marginBottom:'10px'}}></div>
@@ -64,6 +106,14 @@ const CameraStream = () => {
         )}
       </div>
       <p style={{ color: '#666', fontSize: '0.9rem' }}>อัปเดตล่าสุด: {lastUpdate || "รอการเชื่อมต่อ"}</p>
+      <button onClick={() => setLiveEnabled(v => !v)} className="analyze-button">
+        {liveEnabled ? '⏹ หยุดวิเคราะห์สด' : '▶ วิเคราะห์สด (Live)'}
+      </button>
+      {liveEnabled && liveResult?.result?.success && (
+        <p style={{ color: '#334155', fontSize: '0.9rem' }}>
+          {liveResult.result.overall_diagnosis} · {liveResult.result.total_cells_segmented} เซลล์ · ช้ากว่าภาพจริง {liveResult.latency_seconds}s
+        </p>
+      )}
     </div>
   );
 };